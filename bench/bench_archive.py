@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# bench_archive.py
+
+# 202610182100
+#
+# the raw json archive of zha_archive.py against the zha_ws.json file it replaces (open, append, close on every
+# call), write time per call, bytes on disk, and the time to read back one call by its time
+# writes --polls web socket results of a drifting synthetic mesh of --devices devices
+#
+#  python3 bench/bench_archive.py --devices 100 --polls 500
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_process import Snapshot
+from zha_archive import RawArchive, ArchiveReader, zstandard
+from bench_delta import synthetic_results
+
+
+def ms(latency) :
+    latency = sorted(latency)
+    return f"median {statistics.median(latency) * 1000:7.2f} ms  p95 {latency[int(len(latency) * 0.95) - 1] * 1000:7.2f} ms"
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the raw json archive against the zha_ws.json append file")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--polls", type=int, default=500)
+    parser.add_argument("--drift", type=float, default=0.05)
+    parser.add_argument("--interval", type=float, default=300, help="seconds between the web socket calls")
+    parser.add_argument("--reads", type=int, default=100, help="calls read back by time")
+    parser.add_argument("--dir", default=None, help="directory for the test files")
+    args = parser.parse_args()
+
+    start = datetime(2026, 1, 1)
+    snapshots = []
+    for ii, result in enumerate(synthetic_results(args.devices, args.polls, args.drift)) :
+        raw = json.dumps({"id" : ii + 1, "type" : "result", "success" : True, "result" : result})
+        snapshots.append(Snapshot(ii, start + timedelta(seconds=args.interval * ii), raw=raw, site="bench"))
+    raw_bytes = sum(len(snapshot.raw) for snapshot in snapshots)
+    print(f"{args.devices} devices, {args.polls} calls, {raw_bytes / args.polls / 1e3:.0f} kB of json per call")
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+
+        # the old way, the whole file has to be read and parsed to get at one call
+        raw_json_file = os.path.join(tmp, "zha_ws.json")
+        with open(raw_json_file, 'w') as f :
+            f.write('[\n')
+        latency = []
+        for snapshot in snapshots :
+            write_start = time.perf_counter()
+            with open(raw_json_file, 'a') as f :
+                f.write(snapshot.raw + ',\n')
+            latency.append(time.perf_counter() - write_start)
+        read_start = time.perf_counter()
+        with open(raw_json_file) as f :
+            calls = [json.loads(line.rstrip().rstrip(",")) for line in f if line.strip() not in ("[", "]", "")]
+        read_seconds = time.perf_counter() - read_start
+        print(f"json file  write {ms(latency)}  {os.path.getsize(raw_json_file) / 1e6:8.1f} MB  1.0x  " \
+            f"read one call {read_seconds * 1000:8.2f} ms (the whole file, {len(calls)} calls)")
+
+        for compression in ("gzip", "zstd") :
+            if compression == "zstd" and zstandard is None :
+                print("zstd       the zstandard module is not installed")
+                continue
+            directory = os.path.join(tmp, compression)
+            archive = RawArchive(directory, compression=compression).open()
+            latency = []
+            for snapshot in snapshots :
+                write_start = time.perf_counter()
+                archive.write(snapshot)
+                latency.append(time.perf_counter() - write_start)
+            archive.close()
+            size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory) if not name.startswith("zha_ws.idx"))
+            reader = ArchiveReader(directory)
+            read_latency = []
+            for ii in range(args.reads) :
+                when = start + timedelta(seconds=rng.uniform(0, args.interval * args.polls))
+                read_start = time.perf_counter()
+                call = reader.call_at(when)
+                read_latency.append(time.perf_counter() - read_start)
+                if call is None :
+                    raise AssertionError("no call in the archive at " + str(when))
+            reader.close()
+            print(f"{compression:10s} write {ms(latency)}  {size / 1e6:8.1f} MB  {os.path.getsize(raw_json_file) / size:4.1f}x  " \
+                f"read one call {ms(read_latency)}")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
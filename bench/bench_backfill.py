@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# bench_backfill.py
+
+# 202610182230
+#
+# backfill of the database from a raw json dump (zha_backfill.py), web socket results per second with 0 (in
+# process), 1, 2 and 4 pool processes, and the rows of each against one run of the whole file through one
+# processor, the way the live collector would have done it
+# writes a dump the way zha_ws.py and ws06.py did, '[' then a result per line with a ',' after it, of --polls
+# results of a drifting synthetic mesh of --devices devices, with no ']' and the last line cut off half way
+#
+#  python3 bench/bench_backfill.py --devices 100 --polls 500
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_backfill import ZhaBackfill
+from bench_delta import synthetic_results
+
+
+def make_dump(dump_file, devices, polls, drift) :
+    rng = random.Random(3)
+    start = datetime(2026, 1, 1)
+    with open(dump_file, "w") as f :
+        f.write("[\n")
+        for ii, result in enumerate(synthetic_results(devices, polls + 1, drift)) :
+            retrieve_time = start + timedelta(seconds=60 * ii)
+            for device in result :
+                if rng.random() < 0.3 or device["device_type"] == "Coordinator" :
+                    device["last_seen"] = (retrieve_time - timedelta(seconds=rng.randint(0, 30))).strftime('%Y-%m-%dT%H:%M:%S')
+            line = json.dumps({"id" : ii + 1, "type" : "result", "success" : True, "result" : result}) + ",\n"
+            # the program was killed while it wrote the last one
+            f.write(line if ii < polls else line[: len(line) // 2])
+
+
+def table_rows(database_file) :
+    sql_conn = sqlite3.connect(database_file)
+    rows = sql_conn.execute("select * from zha order by rowid").fetchall()
+    sql_conn.close()
+    return rows
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the parallel backfill from raw json dumps")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--polls", type=int, default=500)
+    parser.add_argument("--drift", type=float, default=0.05)
+    parser.add_argument("--chunk", type=int, default=50, help="web socket results per chunk")
+    parser.add_argument("--dir", default=None, help="directory for the test files")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        dump_file = os.path.join(tmp, "ws06.json")
+        make_dump(dump_file, args.devices, args.polls, args.drift)
+        print(f"{args.devices} devices, {args.polls} results, dump {os.path.getsize(dump_file) / 1e6:.1f} MB")
+
+        # the whole file through one processor
+        backfill = ZhaBackfill(os.path.join(tmp, "reference.db"), chunk_calls=args.polls + 1, workers=0, site="bench").open()
+        backfill.run([dump_file])
+        backfill.close()
+        reference = table_rows(os.path.join(tmp, "reference.db"))
+
+        for workers in (0, 1, 2, 4) :
+            target = os.path.join(tmp, f"backfill-{workers}.db")
+            backfill = ZhaBackfill(target, chunk_calls=args.chunk, workers=workers, site="bench").open()
+            start = time.perf_counter()
+            backfill.run([dump_file])
+            elapsed = time.perf_counter() - start
+            backfill.close()
+            rows = table_rows(target)
+            different = sum(1 for row, expected in zip(rows, reference) if row != expected) + abs(len(rows) - len(reference))
+            print(f"{workers} workers  {backfill.calls} results, {backfill.rows_written} rows in {elapsed:6.1f}s  " \
+                f"{backfill.calls / elapsed:7.1f} results/s  {backfill.skipped} lines skipped  " \
+                f"{different} rows differ from one processor ({100.0 * different / max(len(reference), 1):.2f}%)")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
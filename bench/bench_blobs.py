@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+# bench_blobs.py
+
+# 202610182130
+#
+# the device json of ws03.py kept once per distinct content (zha_blobs.py) against json.dumps(device) on every
+# row, insert rows per second, database size and the dedupe ratio
+# writes --polls web socket calls of a drifting synthetic mesh of --devices devices, on each call --drift of the
+# neighbor lqi values and --seen of the devices' last_seen change, so their json changes
+#
+#  python3 bench/bench_blobs.py --devices 100 --polls 500 --drift 0.02 --seen 0.1
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_blobs import BlobStore, prepare_table, report
+from bench_delta import synthetic_results, database_bytes
+
+
+def calls(args) :
+    rng = random.Random(2)
+    start = datetime(2026, 1, 1)
+    for ii, result in enumerate(synthetic_results(args.devices, args.polls, args.drift)) :
+        retrieve_time = start + timedelta(seconds=5 * ii)
+        for device in result :
+            if rng.random() < args.seen :
+                device["last_seen"] = retrieve_time.strftime('%Y-%m-%dT%H:%M:%S')
+        yield int(retrieve_time.timestamp()), result
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the device json blob store against json on every row")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--polls", type=int, default=500)
+    parser.add_argument("--drift", type=float, default=0.02, help="part of the neighbor lqi values that change on each call")
+    parser.add_argument("--seen", type=float, default=0.1, help="part of the devices whose last_seen changes on each call")
+    parser.add_argument("--dir", default=None, help="directory for the test databases")
+    args = parser.parse_args()
+
+    polls = list(calls(args))
+    rows = sum(len(result) for retrieve_ts, result in polls)
+    print(f"{args.devices} devices, {args.polls} calls, {rows} rows")
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+
+        # ws03.py before, the json on every row
+        sql_conn = sqlite3.connect(os.path.join(tmp, "inline.db"))
+        sql_conn.execute("CREATE TABLE IF NOT EXISTS zha (retrieve_ts integer, ieee_address text, attributes json)")
+        start = time.perf_counter()
+        for retrieve_ts, result in polls :
+            sql_conn.executemany("insert into zha values (?, ?, ?)", [(retrieve_ts, str(device["ieee"]), json.dumps(device)) for device in result])
+            sql_conn.commit()
+        inline_seconds = time.perf_counter() - start
+        sql_conn.close()
+        inline_bytes = database_bytes(os.path.join(tmp, "inline.db"))
+        print(f"inline  {rows / inline_seconds:9.0f} rows/s  {inline_bytes / 1e6:8.1f} MB")
+
+        # ws03.py now, a hash on every row, the json once per content
+        sql_conn = sqlite3.connect(os.path.join(tmp, "blobs.db"))
+        sql_conn.execute("CREATE TABLE IF NOT EXISTS zha (retrieve_ts integer, ieee_address text, attributes json, attributes_hash blob)")
+        blobs = BlobStore(sql_conn).open()
+        prepare_table(sql_conn)
+        start = time.perf_counter()
+        for retrieve_ts, result in polls :
+            sql_conn.executemany("insert into zha (retrieve_ts, ieee_address, attributes_hash) values (?, ?, ?)", \
+                [(retrieve_ts, str(device["ieee"]), blobs.put(device)) for device in result])
+            sql_conn.commit()
+        blob_seconds = time.perf_counter() - start
+        stats = report(sql_conn)
+        sql_conn.close()
+        blob_bytes = database_bytes(os.path.join(tmp, "blobs.db"))
+        print(f"blobs   {rows / blob_seconds:9.0f} rows/s  {blob_bytes / 1e6:8.1f} MB  {inline_bytes / blob_bytes:.1f}x smaller file, " \
+            f"{stats['blobs']} blobs for {stats['rows']} rows, json dedupe ratio {stats['ratio']:.1f}x")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
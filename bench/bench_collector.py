@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# bench_collector.py
+
+# 202610181200
+#
+# poll-to-persist latency and sustained polls per second of the asyncio collector (zha_collector.py)
+# compared with the old single 'while True' loop of zha_ws.py, both run against a local fake HA server
+#
+#  python3 bench/bench_collector.py --devices 300 --polls 50
+#  python3 bench/bench_collector.py --devices 300 --polls 50 --interval 1 --disk-delay 0.5 --render-delay 0.002
+#
+# --disk-delay adds a pause to every database write and --render-delay to every line displayed,
+# to show what a slow disk or a slow terminal does to each design
+
+import os
+import sys
+import io
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rich.console import Console
+from websocket import create_connection
+
+from zha_fake_ha import FakeHomeAssistant, FakeHomeAssistantThread, generate_mesh
+from zha_process import ZhaProcessor
+from zha_render import render_snapshot
+from zha_store import ZhaStore
+from zha_collector import ZhaCollector
+
+
+# a store that takes extra time on every write, like a busy disk
+class SlowStore(ZhaStore) :
+
+    def __init__(self, database_file, delay) :
+        super().__init__(database_file)
+        self.delay = delay
+
+    def write_snapshot(self, snapshot) :
+        time.sleep(self.delay)
+        return super().write_snapshot(snapshot)
+
+
+# a terminal that takes extra time on every line displayed, like a slow ssh session
+class SlowTerminal(io.StringIO) :
+
+    def __init__(self, delay) :
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text) :
+        lines = text.count("\n")
+        if lines and self.delay :
+            time.sleep(self.delay * lines)
+        return len(text)
+
+
+def make_console(render_delay) :
+    return Console(file=SlowTerminal(render_delay), emoji=False, color_system="256", highlight=False, width=140)
+
+
+# the old zha_ws.py main loop : call, decode, display, write, sleep, all one after the other
+def legacy_loop(ha_ip, token, store, console, polls, interval) :
+
+    ws = create_connection("ws://" + ha_ip + "/api/websocket")
+    ws.recv()
+    ws.send(json.dumps({'type': 'auth', 'access_token': token}))
+    ws.recv()
+
+    processor = ZhaProcessor()
+    latency = []
+    start = time.perf_counter()
+    for ident in range(1, polls + 1) :
+        sent = time.perf_counter()
+        ws.send(json.dumps({'id': ident, 'type': 'zha/devices'}))
+        result = ws.recv()
+        retrieve_time = datetime.now().replace(microsecond=0)
+        json_result = json.loads(result)
+        snapshot = processor.process(int(json_result['id']) - 1, retrieve_time, json_result["result"])
+        render_snapshot(console, snapshot)
+        store.write_snapshot(snapshot)
+        latency.append(time.perf_counter() - sent)
+        time.sleep(interval)
+    elapsed = time.perf_counter() - start
+    ws.close()
+    return latency, elapsed
+
+
+def collector_run(ha_ip, token, store, console, polls, interval) :
+
+    async def collect() :
+        collector = ZhaCollector(store, console=console)
+        collector.add_site(ha_ip, ha_ip, token, check_interval=interval)
+        await collector.run(polls=polls)
+        return collector
+
+    start = time.perf_counter()
+    collector = asyncio.run(collect())
+    elapsed = time.perf_counter() - start
+    return collector.persist_latency, elapsed
+
+
+def report(name, latency, elapsed, polls) :
+    latency = sorted(latency)
+    p95 = latency[int(len(latency) * 0.95) - 1] if latency else 0
+    print(f"{name:10} polls {len(latency):5}  polls/s {len(latency) / elapsed:8.2f}  " \
+        f"poll-to-persist ms  median {statistics.median(latency) * 1000:8.1f}  p95 {p95 * 1000:8.1f}  max {latency[-1] * 1000:8.1f}")
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the asyncio collector against the old polling loop")
+    parser.add_argument("--devices", type=int, default=300)
+    parser.add_argument("--polls", type=int, default=50)
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between web socket calls, 0 for as fast as possible")
+    parser.add_argument("--disk-delay", type=float, default=0.0, help="extra seconds per database write")
+    parser.add_argument("--render-delay", type=float, default=0.0, help="extra seconds per console line displayed")
+    args = parser.parse_args()
+
+    fake_thread = FakeHomeAssistantThread(FakeHomeAssistant(generate_mesh(args.devices)))
+    fake = fake_thread.start()
+
+    print(f"{args.devices} devices, {args.polls} polls, interval {args.interval}s, disk delay {args.disk_delay}s, render delay {args.render_delay}s")
+    with tempfile.TemporaryDirectory() as tmp :
+        for name, runner in (("loop", legacy_loop), ("asyncio", collector_run)) :
+            store = SlowStore(os.path.join(tmp, name + ".db"), args.disk_delay).open()
+            latency, elapsed = runner(fake.ha_ip, fake.access_token, store, make_console(args.render_delay), args.polls, args.interval)
+            store.close()
+            report(name, latency, elapsed, args.polls)
+
+    fake_thread.stop()
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# bench_current.py
+
+# 202610181930
+#
+# the mesh right now, from the zha_current / device_current tables (zha_current.py) against the newest web
+# socket call found in the zha table with max(packet), as the history grows
+# writes --polls web socket calls of a drifting synthetic mesh with the current tables kept up to date, and
+# every --every calls times both ways of reading the newest links
+#
+#  python3 bench/bench_current.py --devices 200 --polls 2000 --every 250
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_process import ZhaProcessor
+from zha_store import ZhaStore
+from zha_current import ZhaCurrent, current_links
+from bench_delta import synthetic_results
+
+
+LATEST_SQL = "select * from zha where packet = (select max(packet) from zha)"
+
+
+def timed(function, repeat=3) :
+    start = time.perf_counter()
+    for ii in range(repeat) :
+        rows = function()
+    return (time.perf_counter() - start) / repeat * 1000, len(rows)
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the current state tables against max(packet) on the zha table")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--polls", type=int, default=2000)
+    parser.add_argument("--every", type=int, default=250, help="calls between the timings")
+    parser.add_argument("--drift", type=float, default=0.05)
+    parser.add_argument("--dir", default=None, help="directory for the test database")
+    args = parser.parse_args()
+
+    start = datetime(2026, 1, 1)
+    processor = ZhaProcessor()
+    current = ZhaCurrent()
+    pragmas = {"journal_mode" : "wal", "synchronous" : "normal"}
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        store = ZhaStore(os.path.join(tmp, "current.db"), commit_polls=10, pragmas=pragmas, derived=[current]).open()
+        sql_conn = store.sql_conn
+        store_seconds = 0.0
+        for ii, result in enumerate(synthetic_results(args.devices, args.polls + 1, args.drift)) :
+            snapshot = processor.process(ii, start + timedelta(seconds=60 * ii), result)
+            snapshot.site = "bench"
+            write_start = time.perf_counter()
+            store.write_snapshot(snapshot)
+            store_seconds += time.perf_counter() - write_start
+            if snapshot.setup_pass or ii % args.every != 0 :
+                continue
+            store.commit()
+            latest_ms, latest_rows = timed(lambda : sql_conn.execute(LATEST_SQL).fetchall())
+            current_ms, current_rows = timed(lambda : current_links(sql_conn, "bench"))
+            print(f"{store.rows_written:9d} history rows  max(packet) {latest_ms:8.2f} ms ({latest_rows} rows)  zha_current {current_ms:6.2f} ms ({current_rows} rows)")
+        store.close()
+        print(f"{current.rows_changed} current rows written for {store.rows_written} history rows, {current.rows_deleted} deleted, " \
+            f"writing {store.rows_written / store_seconds:.0f} history rows/s with the current tables")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+# bench_decode.py
+
+# 202610190000
+# the streamed decode, zha_decode.stream_devices()
+# 202610182345
+#
+# decoding of 'zha/devices' frames (zha_decode.py), time per poll and peak allocation per poll, for meshes of
+# 50, 500 and 5000 devices from the fake HA server (zha_fake_ha.py)
+#  json          json.loads() of the frame, the full tree of dicts the processing used to get
+#  json records  zha_decode.decode_devices() with the json module, what runs when orjson is not installed
+#  orjson rec.   zha_decode.decode_devices() with orjson
+#  stream        zha_decode.stream_devices(), the devices read one at a time, as the processor takes them
+# and the same again followed by the processing of the call, ZhaProcessor.process()
+# the peak is measured with tracemalloc, on a run of its own since tracemalloc slows everything down, it is what
+# decoding and processing the call allocate, the frame itself comes on top of it
+#
+#  python3 bench/bench_decode.py
+#  python3 bench/bench_decode.py --devices 50 500 5000 --polls 20
+#  python3 bench/bench_decode.py --devices 20000 --polls 5
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zha_decode
+from zha_decode import decode_devices, stream_devices
+from zha_process import ZhaProcessor
+from zha_fake_ha import generate_mesh
+
+
+def json_tree(frame) :
+    message = json.loads(frame)
+    return message["id"], message["success"], message["result"]
+
+
+def json_records(frame) :
+    # decode_devices() as it runs without orjson
+    orjson, zha_decode.orjson = zha_decode.orjson, None
+    try :
+        return decode_devices(frame)
+    finally :
+        zha_decode.orjson = orjson
+
+
+DECODERS = [("json", json_tree), ("json records", json_records)]
+if zha_decode.orjson is not None :
+    DECODERS.append(("orjson rec.", decode_devices))
+DECODERS.append(("stream", stream_devices))
+
+
+def run(decoder, frame, polls, process) :
+    processor = ZhaProcessor()
+    retrieve_time = datetime.now().replace(microsecond=0)
+    # setup pass
+    processor.process(0, retrieve_time, decoder(frame)[2])
+    times = []
+    for ii in range(polls) :
+        start = time.perf_counter()
+        ident, success, devices = decoder(frame)
+        if process :
+            processor.process(ii + 1, retrieve_time, devices)
+        else :
+            # the streamed devices are only decoded as they are read
+            devices = list(devices)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def peak(decoder, frame, process) :
+    processor = ZhaProcessor()
+    retrieve_time = datetime.now().replace(microsecond=0)
+    processor.process(0, retrieve_time, decoder(frame)[2])
+    tracemalloc.start()
+    ident, success, devices = decoder(frame)
+    if process :
+        processor.process(1, retrieve_time, devices)
+    else :
+        devices = list(devices)
+    current, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak_bytes
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the decoding of 'zha/devices' frames")
+    parser.add_argument("--devices", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--polls", type=int, default=20, help="frames decoded per measurement")
+    args = parser.parse_args()
+
+    if zha_decode.orjson is None :
+        print("orjson is not installed, only the json module is measured")
+    for device_count in args.devices :
+        devices = generate_mesh(device_count)
+        frame = json.dumps({"id" : 1, "type" : "result", "success" : True, "result" : devices})
+        print(f"{device_count} devices, frame {len(frame) / 1e6:.2f} MB")
+        for name, decoder in DECODERS :
+            decode_ms = run(decoder, frame, args.polls, False) * 1000
+            decode_peak = peak(decoder, frame, False) / 1e6
+            process_ms = run(decoder, frame, args.polls, True) * 1000
+            process_peak = peak(decoder, frame, True) / 1e6
+            print(f"  {name:13}  decode {decode_ms:8.2f} ms  peak {decode_peak:7.2f} MB    " \
+                f"decode + process {process_ms:8.2f} ms  peak {process_peak:7.2f} MB")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+# bench_delta.py
+
+# 202610181730
+#
+# compression of the change only (delta) schema of zha_delta.py, against the wide zha table and the normalized
+# schema, rows and bytes for the same web socket calls, and a check that the history rebuilt from the delta
+# intervals is the same as the zha table
+#
+# the calls are either a raw json capture of zha_ws.py ('raw_json_keep : True', the raw/ archive directory, or a
+# zha_ws.json of before the archive) replayed one call
+# every --interval seconds, or a synthetic mesh where --drift of the links change lqi / rssi on each call
+#
+#  python3 bench/bench_delta.py --capture raw/
+#  python3 bench/bench_delta.py --devices 100 --polls 500 --drift 0.02
+
+import os
+import sys
+import json
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_fake_ha import generate_mesh
+from zha_process import ZhaProcessor
+from zha_store import ZhaStore
+from zha_normalized import NormalizedZhaStore
+from zha_delta import DeltaZhaStore, reconstruct
+from zha_archive import ArchiveReader
+
+
+# the 'zha/devices' results in a raw json capture, the archive directory of zha_archive.py, or a zha_ws.json file
+# of one web socket result per line, which may not be finished
+def capture_results(capture_file) :
+    if os.path.isdir(capture_file) :
+        reader = ArchiveReader(capture_file)
+        for call in reader.calls() :
+            if isinstance(call["raw"].get("result"), list) :
+                yield call["raw"]["result"]
+        reader.close()
+        return
+    with open(capture_file) as f :
+        for line in f :
+            line = line.strip().rstrip(",")
+            if line in ("", "[", "]") :
+                continue
+            message = json.loads(line)
+            if isinstance(message.get("result"), list) :
+                yield message["result"]
+
+
+# a synthetic mesh where a fraction of the neighbor lqi values move a little on each call
+def synthetic_results(devices, polls, drift, seed=1) :
+    rng = random.Random(seed)
+    mesh = generate_mesh(devices)
+    for ii in range(polls) :
+        for device in mesh :
+            for neighbor in device["neighbors"] :
+                if rng.random() < drift :
+                    neighbor["lqi"] = str(max(0, min(255, int(neighbor["lqi"]) + rng.randint(-8, 8))))
+            if rng.random() < drift :
+                device["rssi"] = max(-100, min(0, (device["rssi"] or -60) + rng.randint(-3, 3)))
+        yield json.loads(json.dumps(mesh))
+
+
+def database_bytes(database_file) :
+    sql_conn = sqlite3.connect(database_file)
+    sql_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size = sql_conn.execute("PRAGMA page_count").fetchone()[0] * sql_conn.execute("PRAGMA page_size").fetchone()[0]
+    sql_conn.close()
+    return size
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="compression of the delta schema")
+    parser.add_argument("--capture", default=None, help="raw json capture of zha_ws.py, instead of a synthetic mesh")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--polls", type=int, default=500)
+    parser.add_argument("--drift", type=float, default=0.02, help="fraction of links that change on each call")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between the calls")
+    parser.add_argument("--dir", default=None, help="directory for the test databases")
+    args = parser.parse_args()
+
+    results = capture_results(args.capture) if args.capture else synthetic_results(args.devices, args.polls, args.drift)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        stores = [store_class(os.path.join(tmp, name + ".db"), commit_polls=20).open() for name, store_class in \
+            (("wide", ZhaStore), ("normalized", NormalizedZhaStore), ("delta", DeltaZhaStore))]
+        wide, normalized, delta = stores
+
+        processor = ZhaProcessor()
+        start = datetime.now().replace(microsecond=0)
+        polls = 0
+        for ii, result in enumerate(results) :
+            snapshot = processor.process(ii, start + timedelta(seconds=args.interval * ii), result)
+            snapshot.site = "bench"
+            for store in stores :
+                store.write_snapshot(snapshot)
+            polls += 1
+        for store in stores :
+            store.close()
+
+        print(f"{polls} web socket calls" + (f" from {args.capture}" if args.capture else f", {args.devices} devices, drift {args.drift}"))
+        wide_bytes = database_bytes(wide.database_file)
+        for name, store, rows in (("wide", wide, wide.rows_written), ("normalized", normalized, normalized.rows_written), \
+            ("delta", delta, delta.intervals_written)) :
+            size = database_bytes(store.database_file)
+            print(f"{name:10}  rows {rows:10}  size {size / 1e6:8.2f} MB  compression {wide_bytes / size:6.1f}x")
+        print(f"delta      rows / zha rows {delta.intervals_written / max(1, wide.rows_written):.4f}  ({delta.links_confirmed} links confirmed without a write)")
+
+        # the rebuilt history has to be the zha table, less the two last seen columns
+        wide_conn = sqlite3.connect(wide.database_file)
+        delta_conn = sqlite3.connect(delta.database_file)
+        expected = wide_conn.execute("select packet, retrieve_ts, neighbor_address, neighbor_lqi, neighbor_rssi, neighbor_device_type, " \
+            "neighbor_available, neighbor_depth, neighbor_relationship, peer_nwk, peer_lqi, peer_rssi, peer_available, peer_address, site " \
+            "from zha order by packet, neighbor_address, peer_address").fetchall()
+        rebuilt = sorted(((row[0], row[1].isoformat(" ")) + row[2:6] + ({1 : 'true', 0 : 'false'}.get(row[6], 'unk'),) + row[7:12] + \
+            ({1 : 'true', 0 : 'false'}.get(row[12], 'unk'),) + row[13:] for row in reconstruct(delta_conn)), key=lambda row : (row[0], row[2], row[13]))
+        print("reconstruction " + ("matches the zha table" if rebuilt == expected else "DOES NOT MATCH the zha table"))
+        wide_conn.close()
+        delta_conn.close()
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# bench_export.py
+
+# 202610182030
+#
+# export of the zha history to Parquet (zha_export.py), rows per second and the size of the Parquet files
+# against the size of the SQLite database, then the incremental export of one more day
+# writes --days of web socket calls every --interval seconds of a drifting synthetic mesh, with the rollups,
+# and compares reading the history into python with a select against reading the Parquet files
+#
+#  python3 bench/bench_export.py --devices 100 --days 7 --interval 60
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import resource
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pyarrow.dataset
+
+from zha_process import ZhaProcessor
+from zha_store import ZhaStore
+from zha_rollup import ZhaRollup
+from zha_export import ZhaExporter
+from bench_delta import synthetic_results, database_bytes
+
+
+def fill(store, processor, results, start, interval, first, count) :
+    for ii in range(first, first + count) :
+        snapshot = processor.process(ii, start + timedelta(seconds=interval * ii), next(results))
+        snapshot.site = "bench"
+        store.write_snapshot(snapshot)
+
+
+def directory_bytes(directory) :
+    return sum(os.path.getsize(os.path.join(path, name)) for path, directories, names in os.walk(directory) for name in names)
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the Parquet export of the zha history")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--interval", type=float, default=60, help="seconds between the web socket calls")
+    parser.add_argument("--drift", type=float, default=0.05)
+    parser.add_argument("--chunk-rows", type=int, default=50000)
+    parser.add_argument("--dir", default=None, help="directory for the test database and files")
+    args = parser.parse_args()
+
+    start = datetime(2026, 1, 1)
+    per_day = int(86400 / args.interval)
+    polls = int(args.days * per_day)
+    processor = ZhaProcessor()
+    results = iter(synthetic_results(args.devices, polls + per_day + 1, args.drift))
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        store = ZhaStore(os.path.join(tmp, "export.db"), commit_polls=50, pragmas={"journal_mode" : "wal", "synchronous" : "normal"}, \
+            derived=[ZhaRollup()]).open()
+        fill(store, processor, results, start, args.interval, 0, polls + 1)
+        store.close()
+        sqlite_bytes = database_bytes(store.database_file)
+        print(f"{args.devices} devices, {args.days} days every {args.interval}s, {store.rows_written} zha rows, sqlite {sqlite_bytes / 1e6:.1f} MB")
+
+        out_dir = os.path.join(tmp, "parquet")
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        exporter = ZhaExporter(store.database_file, out_dir, chunk_rows=args.chunk_rows).open()
+        export_start = time.perf_counter()
+        exporter.export()
+        elapsed = time.perf_counter() - export_start
+        exporter.close()
+        parquet_bytes = directory_bytes(out_dir)
+        print(f"export       {exporter.rows_exported} rows in {elapsed:.1f}s, {exporter.rows_exported / elapsed:.0f} rows/s, " \
+            f"{exporter.files_written} files, {parquet_bytes / 1e6:.1f} MB, {sqlite_bytes / parquet_bytes:.1f}x smaller than sqlite, " \
+            f"max rss {rss_before:.0f} MB before, {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB after")
+
+        # one more day, only it is exported
+        store.open()
+        fill(store, processor, results, start, args.interval, polls + 1, per_day)
+        store.close()
+        exporter = ZhaExporter(store.database_file, out_dir, chunk_rows=args.chunk_rows).open()
+        export_start = time.perf_counter()
+        exporter.export()
+        elapsed = time.perf_counter() - export_start
+        exporter.close()
+        print(f"incremental  {exporter.rows_exported} rows of one more day in {elapsed:.1f}s")
+
+        read_start = time.perf_counter()
+        sql_conn = sqlite3.connect(store.database_file)
+        rows = sql_conn.execute("select * from zha").fetchall()
+        sql_conn.close()
+        select_seconds = time.perf_counter() - read_start
+        read_start = time.perf_counter()
+        table = pyarrow.dataset.dataset(os.path.join(out_dir, "zha"), partitioning="hive").to_table()
+        parquet_seconds = time.perf_counter() - read_start
+        print(f"read back    select * {len(rows)} rows {select_seconds:.2f}s, parquet {table.num_rows} rows {parquet_seconds:.2f}s")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
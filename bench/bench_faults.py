@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+# bench_faults.py
+
+# 202610190200
+# the mesh runs rewire the neighbor tables as well
+# 202610190000
+# --stream-decode, the sites read the results with zha_decode.stream_devices()
+# 202610182330
+#
+# the asyncio collector (zha_collector.py) against a fake HA server (zha_fake_ha.py) that misbehaves : a living
+# mesh with drift, devices going offline, renames and neighbor tables that move, and answers that are late,
+# oversized, never come, or are a closed connection
+# each run is --sites sites polling the same fake for --seconds seconds, with a short web socket timeout and
+# interval so the faults come often, and reports the calls answered, persisted and lost, the reconnects and the
+# poll-to-persist latency, first with no faults, then with each fault alone, then all of them together
+#
+#  python3 bench/bench_faults.py --devices 300 --sites 2 --seconds 10
+#  python3 bench/bench_faults.py --devices 1000 --router-ratio 0.2 --fan-out 10 --seconds 20
+#  python3 bench/bench_faults.py --devices 5000 --fault oversize --stream-decode
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_fake_ha import FakeHomeAssistant, FakeHomeAssistantThread, generate_mesh
+from zha_store import ZhaStore
+from zha_collector import ZhaCollector
+
+
+FAULTS = {
+    "none" : {},
+    "mesh" : {"drift" : 0.05, "seen" : 0.5, "offline" : 0.02, "rename" : 0.002, "rewire" : 0.001},
+    "latency" : {"latency" : 0.05, "jitter" : 0.2},
+    "oversize" : {"oversize" : 0.2},
+    "disconnect" : {"disconnect" : 0.05},
+    "hang" : {"hang" : 0.05},
+    "all" : {"drift" : 0.05, "seen" : 0.5, "offline" : 0.02, "rename" : 0.002, "rewire" : 0.001, "latency" : 0.05, "jitter" : 0.2, \
+        "oversize" : 0.1, "disconnect" : 0.03, "hang" : 0.03},
+    }
+
+
+# counts the errors the collector logs, each one is a lost connection or call
+class ErrorCounter(logging.Handler) :
+
+    def __init__(self) :
+        super().__init__(logging.ERROR)
+        self.errors = 0
+
+    def emit(self, record) :
+        self.errors += 1
+
+
+def run(fake, database_file, sites, seconds, interval, ws_timeout, stream_decode) :
+
+    logger = logging.getLogger("bench_faults")
+    logger.propagate = False
+    counter = ErrorCounter()
+    logger.handlers = [counter]
+
+    async def collect() :
+        collector = ZhaCollector(store, logger=logger)
+        for ii in range(sites) :
+            collector.add_site("site%d" % ii, fake.ha_ip, fake.access_token, check_interval=interval, ws_timeout=ws_timeout, \
+                stream_decode=stream_decode)
+        try :
+            await asyncio.wait_for(collector.run(), seconds)
+        except asyncio.TimeoutError :
+            pass
+        return collector
+
+    store = ZhaStore(database_file).open()
+    start = time.perf_counter()
+    collector = asyncio.run(collect())
+    elapsed = time.perf_counter() - start
+    store.close()
+    return collector, counter.errors, elapsed
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the collector against a fake HA server with faults")
+    parser.add_argument("--devices", type=int, default=300)
+    parser.add_argument("--router-ratio", type=float, default=0.3)
+    parser.add_argument("--fan-out", type=int, default=6)
+    parser.add_argument("--sites", type=int, default=2, help="sites polling the fake at the same time")
+    parser.add_argument("--seconds", type=float, default=10.0, help="seconds of each run")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between calls of each site")
+    parser.add_argument("--ws-timeout", type=float, default=1.0, help="seconds before a call is taken as hung")
+    parser.add_argument("--oversize-mb", type=float, default=4.0)
+    parser.add_argument("--stream-decode", action="store_true", help="read the devices of each result one at a time")
+    parser.add_argument("--fault", choices=list(FAULTS), action="append", default=None, help="only this run, can be given more than once")
+    args = parser.parse_args()
+
+    print(f"{args.devices} devices, {args.sites} sites, {args.seconds}s per run, interval {args.interval}s, ws timeout {args.ws_timeout}s")
+    with tempfile.TemporaryDirectory() as tmp :
+        for name in (args.fault or list(FAULTS)) :
+            fake = FakeHomeAssistant(generate_mesh(args.devices, router_ratio=args.router_ratio, fan_out=args.fan_out), \
+                oversize_bytes=int(args.oversize_mb * 1024 * 1024), **FAULTS[name])
+            fake_thread = FakeHomeAssistantThread(fake)
+            fake_thread.start()
+            collector, errors, elapsed = run(fake, os.path.join(tmp, name + ".db"), args.sites, args.seconds, args.interval, args.ws_timeout, \
+                args.stream_decode)
+            fake_thread.stop()
+            latency = sorted(collector.persist_latency)
+            sent = sum(site.polls_sent for site in collector.sites)
+            median = statistics.median(latency) * 1000 if latency else 0.0
+            p95 = latency[int(len(latency) * 0.95) - 1] * 1000 if latency else 0.0
+            print(f"{name:10} answered {fake.calls:5}  persisted {collector.polls_persisted:5}  polls/s {collector.polls_persisted / elapsed:7.1f}  " \
+                f"lost {sent - collector.polls_persisted:3}  connections {fake.connections:3}  errors {errors:3}  " \
+                f"(disconnects {fake.disconnects}, hangs {fake.hangs}, oversized {fake.oversized}, renames {fake.renames})  " \
+                f"poll-to-persist ms median {median:7.1f} p95 {p95:7.1f}  {sum(site.bytes_received for site in collector.sites) / 1e6:.0f} MB")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
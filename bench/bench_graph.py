@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+# bench_graph.py
+
+# 202610190100
+#
+# the neighbor graph of the processing (zha_graph.NeighborGraph) against the neighbor_db dict of "ieee:ieee" keys
+# and the is_neighbor flags it replaced, for meshes of 50, 500 and 5000 devices from the fake HA server
+# (zha_fake_ha.py) with a few neighbor tables changing on each call
+#  per call : keeping the neighbor tables of one call, the uplink lqi lookup of each link, and is_neighbor of
+#             every device
+#  queries  : who hears X, is X orphaned, children of router R and the asymmetric links, answered from the graph,
+#             and the same answered by walking the neighbor lists of the call, which is all there was before
+#
+#  python3 bench/bench_graph.py
+#  python3 bench/bench_graph.py --devices 5000 --polls 20 --queries 2000
+
+import os
+import sys
+import copy
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_decode import device_records
+from zha_graph import NeighborGraph, CHILD
+from zha_fake_ha import FakeHomeAssistant, generate_mesh
+
+
+# the neighbor_db and is_neighbor of before, for comparison
+# both keep the uplink lqi of each link, as the processing does
+def dict_call(neighbor_db, devices) :
+    is_neighbor = {}
+    uplinks = []
+    for device in devices :
+        is_neighbor.setdefault(device.ieee, "false")
+        for neighbor in device.neighbors :
+            is_neighbor[neighbor.ieee] = "true"
+            neighbor_db[device.ieee + ":" + neighbor.ieee] = {"lqi" : neighbor.lqi}
+        for neighbor in device.neighbors :
+            uplinks.append(int(neighbor_db.get(neighbor.ieee + ":" + device.ieee, {"lqi" : 0})["lqi"]))
+    return is_neighbor, uplinks
+
+
+def graph_call(graph, devices) :
+    uplinks = []
+    for device in devices :
+        graph.set_neighbors(device.ieee, device.neighbors)
+        for neighbor in device.neighbors :
+            uplink = graph.edge(neighbor.ieee, device.ieee)
+            uplinks.append(uplink.lqi if uplink is not None else 0)
+    return dict((device.ieee, "false" if graph.is_orphaned(device.ieee) else "true") for device in devices), uplinks
+
+
+# the queries without the graph, from the neighbor lists of one call
+
+def scan_heard_by(devices, ieee) :
+    return [device.ieee for device in devices for neighbor in device.neighbors if neighbor.ieee == ieee]
+
+
+def scan_is_orphaned(devices, ieee) :
+    return not any(neighbor.ieee == ieee for device in devices for neighbor in device.neighbors)
+
+
+def scan_children(devices, ieee) :
+    for device in devices :
+        if device.ieee == ieee :
+            return [neighbor.ieee for neighbor in device.neighbors if neighbor.relationship == CHILD]
+    return []
+
+
+def scan_asymmetric(devices) :
+    tables = dict((device.ieee, set(neighbor.ieee for neighbor in device.neighbors)) for device in devices)
+    return [(ieee, other) for ieee, table in tables.items() for other in table if tables.get(other) and ieee not in tables[other]]
+
+
+# the 'zha/devices' results of a living mesh, decoded
+def make_calls(device_count, polls) :
+    fake = FakeHomeAssistant(generate_mesh(device_count), drift=0.05, seen=0.5, offline=0.002, rename=0.001)
+    calls = []
+    for ii in range(polls) :
+        fake.advance()
+        calls.append(device_records(copy.deepcopy(fake.devices)))
+    return calls
+
+
+def time_calls(function, database, calls) :
+    times = []
+    for devices in calls :
+        started = time.perf_counter()
+        function(database, devices)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times[1 :])
+
+
+# microseconds per query, for a list of arguments
+def time_query(function, arguments) :
+    started = time.perf_counter()
+    for argument in arguments :
+        function(argument)
+    return (time.perf_counter() - started) / len(arguments) * 1e6
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the neighbor graph of the processing")
+    parser.add_argument("--devices", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--polls", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=1000, help="graph queries of each kind, a tenth of them for the scans")
+    args = parser.parse_args()
+
+    random.seed(1)
+    for device_count in args.devices :
+        calls = make_calls(device_count, args.polls)
+        print(f"{device_count} devices, {sum(len(device.neighbors) for device in calls[-1])} neighbor table entries")
+
+        dict_ms = time_calls(dict_call, {}, calls) * 1000
+        graph = NeighborGraph()
+        graph_ms = time_calls(graph_call, graph, calls) * 1000
+        print(f"  per call   neighbor_db {dict_ms:8.2f} ms   graph {graph_ms:8.2f} ms")
+
+        devices = calls[-1]
+        ieees = [random.choice(devices).ieee for ii in range(args.queries)]
+        routers = [device.ieee for device in devices if device.device_type in ("Router", "Coordinator")]
+        router_ieees = [random.choice(routers) for ii in range(args.queries)]
+        scans = max(1, args.queries // 10)
+        for name, graph_query, scan_query, arguments in ( \
+            ("heard_by", graph.heard_by, lambda ieee : scan_heard_by(devices, ieee), ieees), \
+            ("is_orphaned", graph.is_orphaned, lambda ieee : scan_is_orphaned(devices, ieee), ieees), \
+            ("children", graph.children, lambda ieee : scan_children(devices, ieee), router_ieees), \
+            ("asymmetric", lambda ieee : graph.asymmetric(), lambda ieee : scan_asymmetric(devices), ieees[: scans])) :
+            graph_us = time_query(graph_query, arguments)
+            scan_us = time_query(scan_query, arguments[: scans])
+            print(f"  {name:11} graph {graph_us:10.2f} us   scan of the call {scan_us:10.2f} us")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# bench_migrate.py
+
+# 202610182200
+#
+# migration of the databases of ws03 .. ws08 and zha_ws.py (zha_migrate.py), rows per second with 0 (in process),
+# 1, 2 and 4 reader processes, the peak memory of the writer, and a migration stopped after a few chunks and
+# started again, which has to end with the same rows as one run straight through
+# writes one source database of each schema, --polls web socket calls of a synthetic mesh of --devices devices,
+# and a zha_ws.py database partitioned part way (zha_partition.py), the first half of the calls in its zha table
+#
+#  python3 bench/bench_migrate.py --devices 100 --polls 200
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import resource
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_process import ZhaProcessor
+from zha_store import ZhaStore
+from zha_partition import PartitionedZhaStore, partition_tables
+from zha_blobs import BlobStore
+from zha_migrate import ZhaMigration
+from bench_delta import synthetic_results
+
+
+WS_TABLES = {
+    "ws03" : "CREATE TABLE zha (retrieve_ts integer, ieee_address text, attributes json, attributes_hash blob)",
+    "ws04" : "CREATE TABLE zha (retrieve_ts integer, ieee_address text, user_given_name text, delta_last_seen real, nwk int, lqi int, rssi int, available text, attributes json, attributes_hash blob)",
+    "ws05" : "CREATE TABLE zha (retrieve_ts integer, ieee_address text, user_given_name text, delta_last_seen real, nwk int, lqi int, rssi int, available text)",
+    "ws06" : "CREATE TABLE zha (packet integer, retrieve_ts integer, ieee_address text, user_given_name text, delta_last_seen real, last_seen_ts integer, device_type text, relationship text, nwk int, depth int, lqi int, rssi int, available text, peer_address text, peer_given_name text)",
+    "ws07" : "CREATE TABLE zha (packet integer, retrieve_ts integer, neighbor_address text, neighbor_given_name text, neighbor_lqi int, neighbor_rssi int, neighbor_delta_last_seen real, neighbor_last_seen_ts integer, neighbor_device_type text, neighbor_available text, neighbor_depth int, neighbor_relationship text, peer_nwk int, peer_lqi int, peer_rssi int, peer_available text, peer_address text, peer_given_name text)",
+    }
+
+
+# one database of each schema, the same web socket calls written the way each program wrote them
+def make_sources(directory, devices, polls) :
+    start = datetime(2026, 1, 1)
+    connections = {}
+    for schema, table in WS_TABLES.items() :
+        connections[schema] = sqlite3.connect(os.path.join(directory, schema + ".db"))
+        connections[schema].execute(table)
+    blobs = BlobStore(connections["ws03"]).open()
+    store = ZhaStore(os.path.join(directory, "zha_ws.db"), commit_polls=50).open()
+    processor = ZhaProcessor()
+    for ii, result in enumerate(synthetic_results(devices, polls + 1, 0.05)) :
+        retrieve_time = start + timedelta(seconds=60 * ii)
+        connections["ws03"].executemany("insert into zha (retrieve_ts, ieee_address, attributes_hash) values (?, ?, ?)", \
+            [(int(retrieve_time.timestamp()), device["ieee"], blobs.put(device)) for device in result])
+        snapshot = processor.process(ii, retrieve_time, result)
+        snapshot.site = "bench"
+        store.write_snapshot(snapshot)
+        ts = retrieve_time.isoformat(" ")
+        devices_json = dict((device["ieee"], json.dumps(device)) for device in result)
+        connections["ws04"].executemany("insert into zha values (?, ?, ?, ?, ?, ?, ?, ?, ?, null)", \
+            [(ts, link.neighbor_address, link.neighbor_given_name, link.neighbor_delta_last_seen, None, None, link.neighbor_rssi, \
+            link.neighbor_available, devices_json[link.peer_address]) for link in snapshot.links])
+        connections["ws05"].executemany("insert into zha values (?, ?, ?, ?, ?, ?, ?, ?)", \
+            [(ts, link.neighbor_address, link.neighbor_given_name, link.neighbor_delta_last_seen, None, None, link.neighbor_rssi, \
+            link.neighbor_available) for link in snapshot.links])
+        connections["ws06"].executemany("insert into zha values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", \
+            [(ii, ts, link.neighbor_address, link.neighbor_given_name, link.neighbor_delta_last_seen, link.neighbor_last_seen_ts.isoformat(" "), \
+            link.neighbor_device_type, link.neighbor_relationship, None, link.neighbor_depth, link.peer_lqi, link.neighbor_rssi, \
+            link.neighbor_available, link.peer_address, link.peer_given_name) for link in snapshot.links])
+        connections["ws07"].executemany("insert into zha values (" + ", ".join(["?"] * 18) + ")", \
+            [(ii, ts, link.neighbor_address, link.neighbor_given_name, link.neighbor_lqi, link.neighbor_rssi, link.neighbor_delta_last_seen, \
+            link.neighbor_last_seen_ts.isoformat(" "), link.neighbor_device_type, link.neighbor_available, link.neighbor_depth, \
+            link.neighbor_relationship, link.peer_nwk, link.peer_lqi, link.peer_rssi, link.peer_available, link.peer_address, \
+            link.peer_given_name) for link in snapshot.links])
+    for sql_conn in connections.values() :
+        sql_conn.commit()
+        sql_conn.close()
+    store.close()
+    return [os.path.join(directory, name + ".db") for name in list(WS_TABLES) + ["zha_ws"]] + [make_partitioned(directory, devices, polls)]
+
+
+# the same calls an hour apart, the first half in the zha table, then partitioning turned on, a table per day
+def make_partitioned(directory, devices, polls) :
+    database_file = os.path.join(directory, "zha_ws_partitioned.db")
+    start = datetime(2026, 1, 1)
+    processor = ZhaProcessor()
+    store = ZhaStore(database_file, commit_polls=50).open()
+    for ii, result in enumerate(synthetic_results(devices, polls + 1, 0.05)) :
+        if ii == polls // 2 :
+            store.close()
+            store = PartitionedZhaStore(database_file, partition_period="day", commit_polls=50).open()
+        snapshot = processor.process(ii, start + timedelta(hours=ii), result)
+        snapshot.site = "bench"
+        store.write_snapshot(snapshot)
+    store.close()
+    return database_file
+
+
+# the rows of the zha tables of the sources, and of the partitions of a partitioned one
+def source_rows(sources) :
+    rows = 0
+    for source in sources :
+        sql_conn = sqlite3.connect(source)
+        for table in ["zha"] + list(partition_tables(sql_conn).values()) :
+            rows += sql_conn.execute("select count(*) from " + table).fetchone()[0]
+        sql_conn.close()
+    return rows
+
+
+def table_rows(database_file, table) :
+    sql_conn = sqlite3.connect(database_file)
+    rows = sql_conn.execute("select count(*) from " + table).fetchone()[0]
+    sql_conn.close()
+    return rows
+
+
+class Interrupt(Exception) :
+    pass
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the migration of ws03 .. ws08 and zha_ws.py databases")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--polls", type=int, default=200)
+    parser.add_argument("--chunk-rows", type=int, default=20000)
+    parser.add_argument("--dir", default=None, help="directory for the test databases")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        sources = make_sources(tmp, args.devices, args.polls)
+        rows_in = source_rows(sources)
+        print(f"{len(sources)} sources, {args.devices} devices, {args.polls} calls, {rows_in} source rows, " \
+            f"{sum(os.path.getsize(source) for source in sources) / 1e6:.1f} MB")
+
+        expected = None
+        for schema in ("wide", "normalized") :
+            for workers in (0, 1, 2, 4) :
+                target = os.path.join(tmp, f"target-{schema}-{workers}.db")
+                migration = ZhaMigration(target, schema=schema, chunk_rows=args.chunk_rows, workers=workers, site="bench").open()
+                start = time.perf_counter()
+                migration.run(sources)
+                elapsed = time.perf_counter() - start
+                migration.close()
+                rows = table_rows(target, "zha" if schema == "wide" else "link")
+                expected = expected if expected is not None else rows
+                print(f"{schema:10s} {workers} workers  {rows} rows in {elapsed:6.1f}s  {rows / elapsed:8.0f} rows/s" + \
+                    ("" if rows == expected and not migration.errors else f"  MISMATCH, expected {expected} rows, errors {migration.errors}"))
+
+        # stopped after three chunks, then started again
+        target = os.path.join(tmp, "target-resume.db")
+        chunks = []
+        def stop(source, rows) :
+            chunks.append(source)
+            if len(chunks) == 3 :
+                raise Interrupt()
+        migration = ZhaMigration(target, chunk_rows=args.chunk_rows, workers=2, site="bench").open()
+        try :
+            migration.run(sources, progress=stop)
+        except Interrupt :
+            pass
+        migration.close()
+        first = table_rows(target, "zha")
+        migration = ZhaMigration(target, chunk_rows=args.chunk_rows, workers=2, site="bench").open()
+        migration.run(sources)
+        migration.close()
+        rows = table_rows(target, "zha")
+        print(f"resume     {first} rows before the stop, {rows} rows after the second run, " + ("same as one run" if rows == expected else "MISMATCH"))
+        print(f"max rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB writer, " \
+            f"{resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024:.0f} MB largest reader")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
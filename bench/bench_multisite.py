@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+# bench_multisite.py
+
+# 202610181500
+#
+# test harness for collecting from several Home Assistant sites in one process
+# starts N fake HA servers (zha_fake_ha.py, each in its own process), then collects from all of them
+#  - with one collector process that has N sites
+#  - with N collector processes that have one site each, the way it had to be done before
+# checks that every site's rows landed in the database under its own site name, and reports the
+# peak memory and cpu time of the collector processes for both ways
+#
+#  python3 bench/bench_multisite.py --sites 4 --devices 100 --polls 10
+
+import os
+import sys
+import time
+import socket
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+
+def free_port() :
+    with socket.socket() as sock :
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10) :
+    end = time.time() + timeout
+    while time.time() < end :
+        try :
+            with socket.create_connection(("127.0.0.1", port), timeout=1) :
+                return
+        except OSError :
+            time.sleep(0.05)
+    raise RuntimeError("fake HA server on port " + str(port) + " did not start")
+
+
+# runs in the child process : collect 'polls' calls from each of the given ports into one database
+def child(ports, polls, interval, database_file) :
+
+    from zha_store import ZhaStore
+    from zha_collector import ZhaCollector
+
+    store = ZhaStore(database_file).open()
+
+    async def collect() :
+        collector = ZhaCollector(store)
+        for port in ports :
+            collector.add_site("site" + str(port), "127.0.0.1:" + str(port), "fake-token", check_interval=interval)
+        await collector.run(polls=polls)
+
+    asyncio.run(collect())
+    store.close()
+
+
+# start a child collector process, returns it and its start time
+def spawn(ports, args, database_file) :
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--ports", ",".join(str(port) for port in ports), \
+        "--polls", str(args.polls), "--interval", str(args.interval), "--db", database_file]
+    return subprocess.Popen(command), time.perf_counter()
+
+
+# wait for child processes, returns (wall seconds, cpu seconds summed, peak rss MB summed)
+def reap(children) :
+    cpu = 0.0
+    rss = 0.0
+    end = time.perf_counter()
+    for process, start in children :
+        pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = status
+        end = time.perf_counter()
+        cpu += usage.ru_utime + usage.ru_stime
+        # ru_maxrss is kilobytes on linux
+        rss += usage.ru_maxrss / 1024.0
+    return end - children[0][1], cpu, rss
+
+
+# every site should have its own rows, from every call after the first (setup) pass
+def check(database_files, ports, polls) :
+    counts = {}
+    for database_file in database_files :
+        sql_conn = sqlite3.connect(database_file)
+        for site, rows, packets in sql_conn.execute("select site, count(*), count(distinct packet) from zha group by site") :
+            counts[site] = (rows, packets)
+        sql_conn.close()
+    ok = True
+    for port in ports :
+        rows, packets = counts.get("site" + str(port), (0, 0))
+        if rows == 0 or packets != polls - 1 :
+            ok = False
+            print("FAIL site" + str(port) + " rows " + str(rows) + " packets " + str(packets))
+    return ok
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="multi site collection harness")
+    parser.add_argument("--sites", type=int, default=4)
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--polls", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=0.5)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--ports", default="", help=argparse.SUPPRESS)
+    parser.add_argument("--db", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child :
+        child([int(port) for port in args.ports.split(",")], args.polls, args.interval, args.db)
+        return
+
+    ports = [free_port() for ii in range(args.sites)]
+    servers = [subprocess.Popen([sys.executable, os.path.join(HERE, "..", "zha_fake_ha.py"), "--port", str(port), \
+        "--devices", str(args.devices)], stdout=subprocess.DEVNULL) for port in ports]
+    ok = True
+    try :
+        for port in ports :
+            wait_for_port(port)
+
+        print(f"{args.sites} sites, {args.devices} devices each, {args.polls} polls every {args.interval}s")
+        with tempfile.TemporaryDirectory() as tmp :
+
+            database_file = os.path.join(tmp, "combined.db")
+            wall, cpu, rss = reap([spawn(ports, args, database_file)])
+            ok = check([database_file], ports, args.polls) and ok
+            print(f"one process, {args.sites} sites   : wall {wall:6.2f}s  cpu {cpu:6.2f}s  peak rss {rss:7.1f} MB")
+
+            database_files = [os.path.join(tmp, "separate" + str(port) + ".db") for port in ports]
+            wall, cpu, rss = reap([spawn([port], args, database_file) for port, database_file in zip(ports, database_files)])
+            ok = check(database_files, ports, args.polls) and ok
+            print(f"{args.sites} processes, 1 site each : wall {wall:6.2f}s  cpu {cpu:6.2f}s  peak rss {rss:7.1f} MB (summed)")
+    finally :
+        for server in servers :
+            server.terminate()
+            server.wait()
+
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
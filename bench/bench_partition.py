@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# bench_partition.py
+
+# 202610181830
+#
+# expiry of old history, dropping whole day partitions (zha_partition.py) against deleting rows from the one
+# zha table and a VACUUM, and the insert latency of the collector while each one runs
+# writes --days of web socket calls every --interval seconds of a synthetic mesh, keeping --retention days
+#
+#  python3 bench/bench_partition.py --devices 100 --days 10 --retention 7 --interval 600
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_store import ZhaStore
+from zha_partition import PartitionedZhaStore
+from bench_store import make_snapshots
+
+
+def ms(latency) :
+    latency = sorted(latency)
+    return f"median {statistics.median(latency) * 1000:8.2f} ms  max {latency[-1] * 1000:8.2f} ms"
+
+
+# the same calls one after the other, restamped every interval seconds from start
+def calls(snapshots, start, interval, count) :
+    for ii in range(count) :
+        snapshot = snapshots[ii % len(snapshots)]
+        retrieve_time = start + timedelta(seconds=interval * ii)
+        snapshot.packet = ii + 1
+        snapshot.retrieve_time = retrieve_time
+        snapshot.links = [link._replace(retrieve_ts=retrieve_time) for link in snapshot.links]
+        yield snapshot
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark dropping partitions against deleting rows")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--days", type=int, default=10)
+    parser.add_argument("--retention", type=int, default=7)
+    parser.add_argument("--interval", type=float, default=600, help="seconds between the web socket calls")
+    parser.add_argument("--dir", default=None, help="directory for the test databases")
+    args = parser.parse_args()
+
+    snapshots = make_snapshots(args.devices, 10)
+    start = datetime(2026, 1, 1)
+    count = int(args.days * 86400 / args.interval)
+    pragmas = {"journal_mode" : "wal", "synchronous" : "normal"}
+    print(f"{args.devices} devices, {len(snapshots[0].links)} rows per call, {args.days} days every {args.interval}s, keep {args.retention} days")
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+
+        # partitions, expiry happens inside the web socket call that crosses into the next day
+        store = PartitionedZhaStore(os.path.join(tmp, "partitioned.db"), retention_days=args.retention, pragmas=pragmas).open()
+        normal = []
+        expiring = []
+        for snapshot in calls(snapshots, start, args.interval, count) :
+            dropped = store.partitions_dropped
+            call_start = time.perf_counter()
+            store.write_snapshot(snapshot)
+            (expiring if store.partitions_dropped > dropped else normal).append(time.perf_counter() - call_start)
+        size = os.path.getsize(store.database_file)
+        store.close()
+        print(f"partitions  {store.partitions_dropped} dropped, insert {ms(normal)}, calls that dropped a partition {ms(expiring)}, file {size / 1e6:.1f} MB")
+
+        # one table, the same rows, then the rows before the cutoff deleted while the collector keeps inserting
+        store = ZhaStore(os.path.join(tmp, "single.db"), pragmas=pragmas).open()
+        all_calls = list(calls(snapshots, start, args.interval, count))
+        for snapshot in all_calls :
+            store.write_snapshot(snapshot)
+        cutoff = start + timedelta(days=args.days - args.retention)
+        timing = {}
+
+        def expire() :
+            sql_conn = sqlite3.connect(store.database_file, timeout=60)
+            expire_start = time.perf_counter()
+            sql_conn.execute("delete from zha where retrieve_ts < ?", (cutoff.isoformat(" "),))
+            sql_conn.commit()
+            timing["delete"] = time.perf_counter() - expire_start
+            sql_conn.close()
+
+        expirer = threading.Thread(target=expire)
+        during = []
+        expirer.start()
+        ii = 0
+        while expirer.is_alive() :
+            call_start = time.perf_counter()
+            store.write_snapshot(all_calls[ii % len(all_calls)])
+            during.append(time.perf_counter() - call_start)
+            ii += 1
+        expirer.join()
+        store.close()
+
+        sql_conn = sqlite3.connect(store.database_file)
+        vacuum_start = time.perf_counter()
+        sql_conn.execute("VACUUM")
+        timing["vacuum"] = time.perf_counter() - vacuum_start
+        sql_conn.close()
+        print(f"row delete  delete {timing['delete']:.2f}s, vacuum {timing['vacuum']:.2f}s, insert during the delete {ms(during) if during else '-'} ({len(during)} calls)")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# bench_queries.py
+
+# 202610181900
+#
+# the named queries of zha_queries.py on a big zha table, without and with the indexes they need
+# fills the zha table with --rows rows of a synthetic mesh of --devices devices, a call every --interval seconds,
+# times each query on the table as it is, then times creating the indexes, the query plan check and the
+# queries again
+#
+#  python3 bench/bench_queries.py --rows 10000000 --devices 200
+#  python3 bench/bench_queries.py --rows 1000000 --devices 200 --dir /var/tmp
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_store import ZhaStore, ZHA_INSERT
+from zha_queries import run_query, create_indexes, check_plans
+
+
+# a call of 'devices' devices, each one lists up to 'neighbors' others, fixed for the whole run
+def make_links(devices, neighbors, rng) :
+    addresses = ["00:0d:6f:00:%02x:%02x:%02x:%02x" % (ii >> 24 & 255, ii >> 16 & 255, ii >> 8 & 255, ii & 255) for ii in range(devices)]
+    links = []
+    for ii, neighbor in enumerate(addresses) :
+        for peer in rng.sample(addresses[: ii] + addresses[ii + 1 :], min(neighbors, devices - 1)) :
+            links.append((neighbor, peer, rng.randint(20, 255)))
+    # a few devices nobody lists as a neighbor
+    return addresses, [link for link in links if link[0] not in addresses[-3 :]]
+
+
+def fill(sql_conn, args, start, rng) :
+    addresses, links = make_links(args.devices, args.neighbors, rng)
+    calls = max(1, args.rows // len(links))
+    for packet in range(calls) :
+        retrieve_ts = (start + timedelta(seconds=args.interval * packet)).isoformat(" ")
+        sql_conn.executemany(ZHA_INSERT, [(packet, retrieve_ts, neighbor, lqi, -60, 0, retrieve_ts, "Router", 1, 1, "Sibling",
+            "0x1234", max(0, min(255, lqi + rng.randint(-10, 10))), -60, rng.random() > 0.01, peer, "bench") for neighbor, peer, lqi in links])
+        if packet % 100 == 99 :
+            sql_conn.commit()
+    sql_conn.commit()
+    return addresses, links, calls
+
+
+def timed(sql_conn, name, values, repeat) :
+    query_start = time.perf_counter()
+    for ii in range(repeat) :
+        rows = run_query(sql_conn, name, **values)
+    return (time.perf_counter() - query_start) / repeat, len(rows)
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the named queries without and with their indexes")
+    parser.add_argument("--rows", type=int, default=10000000)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--neighbors", type=int, default=10, help="neighbors each device lists")
+    parser.add_argument("--interval", type=float, default=600, help="seconds between the web socket calls")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dir", default=None, help="directory for the test database")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    start = datetime(2026, 1, 1)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        # the tables as zha_ws.py makes them, the rows then go in without the store for speed
+        store = ZhaStore(os.path.join(tmp, "queries.db"), pragmas={"journal_mode" : "wal", "synchronous" : "normal"}).open()
+        store.close()
+        sql_conn = sqlite3.connect(store.database_file)
+
+        fill_start = time.perf_counter()
+        addresses, links, calls = fill(sql_conn, args, start, rng)
+        rows = calls * len(links)
+        print(f"{rows} rows, {args.devices} devices, {calls} calls, filled in {time.perf_counter() - fill_start:.0f}s")
+
+        # a day in the middle of the history, the links and devices picked before
+        day_start = start + timedelta(seconds=args.interval * calls / 2)
+        window = {"start" : day_start, "end" : day_start + timedelta(days=1)}
+        neighbor, peer, lqi = links[len(links) // 2]
+        queries = {
+            "link_history" : dict(window, neighbor=neighbor, peer=peer),
+            "availability_timeline" : dict(window, device=peer),
+            "worst_links" : dict(window, limit=10),
+            "never_neighbor" : window,
+        }
+
+        before = {}
+        for name, values in queries.items() :
+            before[name] = timed(sql_conn, name, values, 1)
+
+        index_start = time.perf_counter()
+        create_indexes(sql_conn)
+        print(f"indexes created in {time.perf_counter() - index_start:.1f}s, " \
+            f"plan check {'ok' if not check_plans(sql_conn) else 'FAIL ' + ', '.join(check_plans(sql_conn))}")
+
+        for name, values in queries.items() :
+            seconds, count = timed(sql_conn, name, values, args.repeat)
+            print(f"{name:22s} {count:6d} rows  without indexes {before[name][0] * 1000:10.1f} ms  with {seconds * 1000:8.2f} ms")
+        sql_conn.close()
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
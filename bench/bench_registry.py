@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# bench_registry.py
+
+# 202610190030
+#
+# the in memory device database of the processing (zha_registry.DeviceRegistry) against the dict of 11 key dicts
+# it replaced, for meshes of 50, 500 and 5000 devices from the fake HA server (zha_fake_ha.py) with half of the
+# devices seen again and a few lqi / rssi values moving on each call
+#  per call : the device database part of a call, forget the devices gone, update every device, the neighbor
+#             lookups of the neighbor walk, and the devices of the snapshot, and the whole of ZhaProcessor.process()
+#  memory   : of the device database, and of the devices of --queued snapshots, as many as wait in the writer
+#             queue when the database falls behind
+#
+#  python3 bench/bench_registry.py
+#  python3 bench/bench_registry.py --devices 5000 --polls 20 --queued 1000
+
+import os
+import sys
+import copy
+import time
+import argparse
+import statistics
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_decode import device_records
+from zha_registry import DeviceRegistry, unknown_device
+from zha_process import ZhaProcessor
+from zha_fake_ha import FakeHomeAssistant, generate_mesh
+
+
+# the device_db of before, for comparison, both look up the neighbor and peer record of each link, as the
+# processing does
+def dict_call(device_db, devices, retrieve_time) :
+    links = []
+    current_ieee = set(device.ieee for device in devices)
+    for ieee in list(device_db) :
+        if ieee not in current_ieee :
+            device_db.pop(ieee, None)
+    template = {"user_given_name" : "", "last_seen" : retrieve_time, "device_type" : "*", "nwk" : -1, "lqi" : -1, "rssi" : 0, \
+        "available" : "unk", "is_neighbor" : "false", "manufacturer" : "", "model" : "", "power_source" : ""}
+    for device in devices :
+        is_neigh = device_db[device.ieee]["is_neighbor"] if device.ieee in device_db else "false"
+        device_db[device.ieee] = {"user_given_name" : device.user_given_name, "last_seen" : device.last_seen, \
+            "device_type" : device.device_type, "nwk" : device.nwk, "lqi" : device.lqi, "rssi" : device.rssi, \
+            "available" : "true" if device.available else "false", "is_neighbor" : is_neigh, "manufacturer" : device.manufacturer, \
+            "model" : device.model, "power_source" : device.power_source}
+        for neighbor in device.neighbors :
+            if neighbor.ieee in device_db :
+                device_db[neighbor.ieee]["is_neighbor"] = "true"
+            links.append((device_db.get(neighbor.ieee, template), device_db[device.ieee]))
+    return dict(device_db)
+
+
+def registry_call(registry, devices, retrieve_time) :
+    registry.retain(set(device.ieee for device in devices))
+    template = unknown_device(retrieve_time)
+    links = []
+    for device in devices :
+        record = registry.record(device.ieee)
+        record.user_given_name = device.user_given_name
+        record.last_seen = device.last_seen
+        record.device_type = device.device_type
+        record.nwk = device.nwk
+        record.lqi = device.lqi
+        record.rssi = device.rssi
+        record.available = "true" if device.available else "false"
+        record.manufacturer = device.manufacturer
+        record.model = device.model
+        record.power_source = device.power_source
+        for neighbor in device.neighbors :
+            neighbor_record = registry.get(neighbor.ieee)
+            if neighbor_record is not None :
+                neighbor_record.is_neighbor = "true"
+            else :
+                neighbor_record = template
+            links.append((neighbor_record, record))
+    return registry.snapshot()
+
+
+# the 'zha/devices' results of a living mesh, decoded
+def make_calls(device_count, polls) :
+    fake = FakeHomeAssistant(generate_mesh(device_count), drift=0.05, seen=0.5, offline=0.002, rename=0.001)
+    calls = []
+    for ii in range(polls) :
+        fake.advance()
+        calls.append(copy.deepcopy(fake.devices))
+    return calls
+
+
+def time_calls(function, database, calls) :
+    start = datetime(2026, 1, 1)
+    times = []
+    for ii, devices in enumerate(calls) :
+        started = time.perf_counter()
+        function(database, devices, start + timedelta(seconds=60 * ii))
+        times.append(time.perf_counter() - started)
+    return statistics.median(times[1 :])
+
+
+def memory(function, database, calls, queued) :
+    start = datetime(2026, 1, 1)
+    tracemalloc.start()
+    snapshots = []
+    for ii in range(queued) :
+        snapshots.append(function(database, calls[ii % len(calls)], start + timedelta(seconds=60 * ii)))
+        if ii == 0 :
+            database_bytes = tracemalloc.get_traced_memory()[0]
+    total = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return database_bytes, total
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the device registry of the processing")
+    parser.add_argument("--devices", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--polls", type=int, default=20)
+    parser.add_argument("--queued", type=int, default=100, help="snapshots held for the memory measurement")
+    args = parser.parse_args()
+
+    for device_count in args.devices :
+        calls = make_calls(device_count, args.polls)
+        records = [device_records(devices) for devices in calls]
+        print(f"{device_count} devices")
+        for name, function, database in (("dict", dict_call, {}), ("registry", registry_call, DeviceRegistry())) :
+            call_ms = time_calls(function, database, records) * 1000
+            # a new database for the memory measurement, it starts empty
+            database_bytes, total = memory(function, {} if name == "dict" else DeviceRegistry(), records, args.queued)
+            print(f"  {name:9} device database per call {call_ms:8.2f} ms   memory {database_bytes / 1e6:7.2f} MB, " \
+                f"with {args.queued} snapshots {total / 1e6:8.2f} MB")
+        processor = ZhaProcessor()
+        process_ms = time_calls(lambda processor, devices, retrieve_time : processor.process(0, retrieve_time, devices), \
+            processor, records) * 1000
+        print(f"  ZhaProcessor.process() per call {process_ms:8.2f} ms")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
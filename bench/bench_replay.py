@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# bench_replay.py
+
+# 202610182300
+#
+# end to end replay of a raw json archive through the zha_ws.py pipeline (zha_replay.py), calls per second and
+# how many times faster than real time, without and with the console display, and a check that two replays
+# give the same rows as each other and as the calls run straight through ZhaProcessor and ZhaStore
+# writes an archive of --polls calls every --interval seconds of a drifting synthetic mesh of --devices devices,
+# with a restart of zha_ws.py half way (a new segment, the packet numbers start again)
+#
+#  python3 bench/bench_replay.py --devices 100 --polls 500
+
+import io
+import os
+import sys
+import json
+import random
+import asyncio
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rich.console import Console
+
+from zha_process import ZhaProcessor, Snapshot
+from zha_store import ZhaStore
+from zha_archive import RawArchive
+from zha_replay import ZhaReplay
+from bench_delta import synthetic_results
+
+
+# the raw web socket messages and their times, the packet numbers start again at the restart
+def recorded_calls(devices, polls, drift, interval) :
+    rng = random.Random(4)
+    start = datetime(2026, 1, 1)
+    calls = []
+    for ii, result in enumerate(synthetic_results(devices, polls, drift)) :
+        retrieve_time = start + timedelta(seconds=interval * ii)
+        for device in result :
+            if rng.random() < 0.3 :
+                device["last_seen"] = (retrieve_time - timedelta(seconds=rng.randint(0, int(interval)))).strftime('%Y-%m-%dT%H:%M:%S')
+        ident = ii + 1 if ii < polls // 2 else ii - polls // 2 + 1
+        calls.append((retrieve_time, json.dumps({"id" : ident, "type" : "result", "success" : True, "result" : result})))
+    return calls
+
+
+def make_archive(directory, calls) :
+    archive = RawArchive(directory).open()
+    for ii, (retrieve_time, raw) in enumerate(calls) :
+        if ii == len(calls) // 2 :
+            # zha_ws.py stopped and started again
+            archive.close()
+            archive = RawArchive(directory).open()
+        archive.write(Snapshot(json.loads(raw)["id"] - 1, retrieve_time, raw=raw, site="bench"))
+    archive.close()
+
+
+# the calls straight through the processor and the store, a new processor at the restart
+def reference(database_file, calls) :
+    store = ZhaStore(database_file, commit_polls=100).open()
+    for ii, (retrieve_time, raw) in enumerate(calls) :
+        if ii == 0 or ii == len(calls) // 2 :
+            processor = ZhaProcessor()
+        message = json.loads(raw)
+        snapshot = processor.process(message["id"] - 1, retrieve_time, message["result"])
+        snapshot.site = "bench"
+        store.write_snapshot(snapshot)
+    store.close()
+
+
+def table_digest(database_file) :
+    sql_conn = sqlite3.connect(database_file)
+    digest = hashlib.blake2b()
+    rows = 0
+    for row in sql_conn.execute("select * from zha order by rowid") :
+        digest.update(repr(row).encode())
+        rows += 1
+    sql_conn.close()
+    return rows, digest.hexdigest()[: 16]
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the offline replay of a raw json archive")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--polls", type=int, default=500)
+    parser.add_argument("--drift", type=float, default=0.05)
+    parser.add_argument("--interval", type=float, default=60, help="seconds between the recorded calls")
+    parser.add_argument("--dir", default=None, help="directory for the test files")
+    args = parser.parse_args()
+
+    calls = recorded_calls(args.devices, args.polls, args.drift, args.interval)
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        make_archive(os.path.join(tmp, "raw"), calls)
+        reference(os.path.join(tmp, "reference.db"), calls)
+        expected = table_digest(os.path.join(tmp, "reference.db"))
+        print(f"{args.devices} devices, {args.polls} calls every {args.interval:.0f}s, {expected[0]} rows straight through the processor")
+
+        for run, render in (("replay 1", False), ("replay 2", False), ("rendered", True)) :
+            database_file = os.path.join(tmp, run.replace(" ", "-") + ".db")
+            store = ZhaStore(database_file, commit_polls=100).open()
+            console = Console(file=io.StringIO(), width=200) if render else None
+            replay = ZhaReplay(os.path.join(tmp, "raw"), store, console=console)
+            asyncio.run(replay.run())
+            store.close()
+            digest = table_digest(database_file)
+            print(f"{run:9s} {replay.calls} calls in {replay.seconds:6.1f}s  {replay.calls / replay.seconds:7.1f} calls/s  " \
+                f"{replay.clock.seconds / replay.seconds:7.0f}x real time  {replay.restarts} restarts  {digest[0]} rows  " + \
+                ("same rows" if digest == expected else "ROWS DIFFER"))
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
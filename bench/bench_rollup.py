@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+# bench_rollup.py
+
+# 202610181800
+#
+# a week of one link from the rollup tables (zha_rollup.py) against the same question asked of the zha table
+# writes --days of web socket calls every --interval seconds of a drifting synthetic mesh, with and without the
+# rollups kept up to date, then times the week summary of a few links both ways, over the same whole hours so
+# both give the same numbers, and the backfill, of the zha table and of the same rows in a database partitioned
+# part way (zha_partition.py), which has to give the same rollups
+#
+#  python3 bench/bench_rollup.py --devices 50 --days 7 --interval 60
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_process import ZhaProcessor
+from zha_store import ZhaStore
+from zha_partition import PartitionedZhaStore, PARTITION_TABLE, period_start, period_end, partition_name
+from zha_rollup import ZhaRollup, backfill, link_summary
+from bench_delta import synthetic_results
+
+
+RAW_SUMMARY = "select count(*), min(peer_lqi), max(peer_lqi), avg(peer_lqi), min(neighbor_rssi), max(neighbor_rssi), avg(neighbor_rssi) " \
+    "from zha where neighbor_address = ? and peer_address = ? and retrieve_ts >= ? and retrieve_ts < ?"
+
+
+def fill(stores, args, start) :
+    processor = ZhaProcessor()
+    polls = int(args.days * 86400 / args.interval)
+    elapsed = [0.0] * len(stores)
+    for ii, result in enumerate(synthetic_results(args.devices, polls + 1, args.drift)) :
+        snapshot = processor.process(ii, start + timedelta(seconds=args.interval * ii), result)
+        snapshot.site = "bench"
+        for jj, store in enumerate(stores) :
+            write_start = time.perf_counter()
+            store.write_snapshot(snapshot)
+            elapsed[jj] += time.perf_counter() - write_start
+    for jj, store in enumerate(stores) :
+        write_start = time.perf_counter()
+        store.close()
+        elapsed[jj] += time.perf_counter() - write_start
+    return elapsed
+
+
+# the rows of a zha table again, those of the first day in the zha table, the days after it in a partition each
+def partitioned_copy(database_file, copy_file) :
+    PartitionedZhaStore(copy_file).open().close()
+    sql_conn = sqlite3.connect(copy_file)
+    sql_conn.execute("attach database ? as source", (database_file,))
+    first, last = [datetime.fromisoformat(value) for value in sql_conn.execute("select min(retrieve_ts), max(retrieve_ts) from source.zha").fetchone()]
+    day = period_start(first, "day") + timedelta(days=1)
+    sql_conn.execute("insert into zha select * from source.zha where retrieve_ts < ?", (day.isoformat(" "),))
+    while day <= last :
+        table = partition_name(day)
+        sql_conn.execute(PARTITION_TABLE.format(table=table))
+        sql_conn.execute("insert into " + table + " select * from source.zha where retrieve_ts >= ? and retrieve_ts < ?", \
+            (day.isoformat(" "), period_end(day, "day").isoformat(" ")))
+        day = period_end(day, "day")
+    sql_conn.commit()
+    sql_conn.close()
+
+
+def rollup_totals(database_file) :
+    sql_conn = sqlite3.connect(database_file)
+    totals = [sql_conn.execute("select count(*), sum(samples), sum(lqi_mean * samples), max(lqi_p95) from " + table).fetchone() \
+        for table in ("rollup_1m", "rollup_1h", "rollup_1d")]
+    sql_conn.close()
+    return totals
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the rollup tables against scanning the zha table")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--days", type=float, default=7)
+    parser.add_argument("--interval", type=float, default=60, help="seconds between the web socket calls")
+    parser.add_argument("--drift", type=float, default=0.05)
+    parser.add_argument("--links", type=int, default=5, help="links to ask about")
+    parser.add_argument("--dir", default=None, help="directory for the test databases")
+    args = parser.parse_args()
+
+    # on hour boundaries, link_summary() reads the rollup_1h buckets from the one of start to the one of end, the
+    # zha table is asked about the rows of the same hours, up to the end of the hour of end
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=args.days)
+    end = start + timedelta(days=args.days)
+    end_of_buckets = end + timedelta(hours=1)
+    pragmas = {"journal_mode" : "wal", "synchronous" : "normal"}
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        plain = ZhaStore(os.path.join(tmp, "plain.db"), commit_polls=10, pragmas=pragmas).open()
+        rolled = ZhaStore(os.path.join(tmp, "rollup.db"), commit_polls=10, pragmas=pragmas, derived=[ZhaRollup()]).open()
+        plain_seconds, rolled_seconds = fill([plain, rolled], args, start)
+        rows = plain.rows_written
+        print(f"{args.devices} devices, {args.days} days every {args.interval}s, {rows} zha rows")
+        print(f"insert rows/s  without rollups {rows / plain_seconds:10.0f}  with rollups {rows / rolled_seconds:10.0f}")
+
+        sql_conn = sqlite3.connect(rolled.database_file)
+        links = sql_conn.execute("select distinct neighbor_address, peer_address from zha limit ?", (args.links,)).fetchall()
+        raw_seconds = 0.0
+        rollup_seconds = 0.0
+        for neighbor_address, peer_address in links :
+            query_start = time.perf_counter()
+            raw = sql_conn.execute(RAW_SUMMARY, (neighbor_address, peer_address, start.isoformat(" "), end_of_buckets.isoformat(" "))).fetchone()
+            raw_seconds += time.perf_counter() - query_start
+            query_start = time.perf_counter()
+            summary = link_summary(sql_conn, neighbor_address, peer_address, start, end)
+            rollup_seconds += time.perf_counter() - query_start
+        print(f"week summary of a link  zha table {raw_seconds / len(links) * 1000:9.2f} ms  rollup_1h {rollup_seconds / len(links) * 1000:9.3f} ms")
+        print(f"  last link, zha table samples {raw[0]} lqi {raw[1]}..{raw[2]} mean {raw[3]:.1f}, " \
+            f"rollup samples {summary[0]} lqi {summary[1]}..{summary[2]} mean {summary[3]:.1f} p95 {summary[4]}")
+        sql_conn.close()
+
+        partitioned_file = os.path.join(tmp, "partitioned.db")
+        partitioned_copy(plain.database_file, partitioned_file)
+
+        backfill_start = time.perf_counter()
+        rows_read, buckets = backfill(plain.database_file, "wide")
+        elapsed = time.perf_counter() - backfill_start
+        print(f"backfill  {rows_read} rows in {elapsed:.1f}s ({rows_read / elapsed:.0f} rows/s), {buckets} rollup rows")
+
+        backfill_start = time.perf_counter()
+        rows_read, buckets = backfill(partitioned_file, "wide")
+        elapsed = time.perf_counter() - backfill_start
+        same = rollup_totals(partitioned_file) == rollup_totals(plain.database_file)
+        print(f"backfill, partitioned  {rows_read} rows in {elapsed:.1f}s ({rows_read / elapsed:.0f} rows/s), {buckets} rollup rows, " + \
+            ("same rollups" if same else "MISMATCH"))
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# bench_routes.py
+
+# 202610190200
+#
+# the routing analytics of the processing (zha_routes.MeshRoutes), kept up to date from the tables that changed,
+# against computing them from scratch on each call, for synthetic meshes from the fake HA server (zha_fake_ha.py)
+# of 5000 devices by default, with lqi drift and --rewire entries of the router tables moving on each call
+#  incremental  MeshRoutes.update() of the processing, after the neighbor tables of the call are in the graph
+#  scratch      a new MeshRoutes on the same graph, every path and the dominator tree found again
+# and the whole of ZhaProcessor.process(), which includes the incremental update
+# the results of both are compared on every call, hops, cost, children and stranded have to be the same
+#
+#  python3 bench/bench_routes.py
+#  python3 bench/bench_routes.py --devices 500 5000 --rewire 0 0.001 0.01 --polls 20
+
+import os
+import sys
+import copy
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_decode import device_records
+from zha_graph import NeighborGraph
+from zha_routes import MeshRoutes
+from zha_process import ZhaProcessor
+from zha_fake_ha import FakeHomeAssistant, generate_mesh
+
+
+# the 'zha/devices' results of a living mesh, decoded
+def make_calls(device_count, polls, rewire) :
+    fake = FakeHomeAssistant(generate_mesh(device_count), drift=0.05, seen=0.5, rewire=rewire)
+    calls = []
+    for ii in range(polls) :
+        fake.advance()
+        calls.append(device_records(copy.deepcopy(fake.devices)))
+    return calls, fake.rewired
+
+
+def coordinator(devices) :
+    for device in devices :
+        if device.device_type == "Coordinator" :
+            return device.ieee
+    return None
+
+
+def same(routes, other) :
+    return all((route.hops, route.cost, route.children, route.stranded) == \
+        (other[ieee].hops, other[ieee].cost, other[ieee].children, other[ieee].stranded) for ieee, route in routes.items())
+
+
+def run(calls) :
+    graph = NeighborGraph()
+    routes = MeshRoutes(graph)
+    incremental = []
+    scratch = []
+    for devices in calls :
+        for device in devices :
+            graph.set_neighbors(device.ieee, device.neighbors)
+        addresses = [device.ieee for device in devices]
+        started = time.perf_counter()
+        result = routes.update(coordinator(devices), addresses)
+        incremental.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        check = MeshRoutes(graph).update(coordinator(devices), addresses)
+        scratch.append(time.perf_counter() - started)
+        if not same(result, check) :
+            raise AssertionError("incremental routes differ from the ones computed from scratch")
+    return statistics.median(incremental[1 :]), statistics.median(scratch[1 :]), routes, result
+
+
+def process_ms(calls) :
+    processor = ZhaProcessor()
+    start = datetime(2026, 1, 1)
+    times = []
+    for ii, devices in enumerate(calls) :
+        started = time.perf_counter()
+        processor.process(ii, start + timedelta(seconds=60 * ii), devices)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times[1 :]) * 1000
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the incremental routing analytics of the processing")
+    parser.add_argument("--devices", type=int, nargs="+", default=[5000])
+    parser.add_argument("--rewire", type=float, nargs="+", default=[0.0, 0.001, 0.01], help="part of the table entries that move on each call")
+    parser.add_argument("--polls", type=int, default=20)
+    args = parser.parse_args()
+
+    for device_count in args.devices :
+        for rewire in args.rewire :
+            calls, rewired = make_calls(device_count, args.polls, rewire)
+            incremental, scratch, routes, result = run(calls)
+            hops = [route.hops for route in result.values() if route.hops is not None]
+            critical = sum(1 for route in result.values() if route.stranded > 0)
+            print(f"{device_count} devices, rewire {rewire}, {rewired / args.polls:.0f} entries moved per call, " \
+                f"max hops {max(hops)}, no route {len(result) - len(hops)}, single points of failure {critical}")
+            print(f"  per call  incremental {incremental * 1000:8.2f} ms   scratch {scratch * 1000:8.2f} ms   " \
+                f"links changed {routes.links_changed / args.polls:7.0f}   dominator tree {routes.dominator_runs}/{routes.updates} calls   " \
+                f"ZhaProcessor.process() {process_ms(calls):8.2f} ms")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
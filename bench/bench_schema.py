@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# bench_schema.py
+
+# 202610181700
+#
+# database size and insert throughput of the wide 'zha' table against the normalized schema (zha_normalized.py),
+# and the time to migrate the wide database into the normalized one
+# writes --polls web socket calls of a synthetic mesh into each, then scales the bytes per row up to a month of
+# calls every --interval seconds
+#
+#  python3 bench/bench_schema.py --devices 100 --polls 500 --interval 5
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_store import ZhaStore
+from zha_normalized import NormalizedZhaStore, migrate
+from bench_store import make_snapshots
+
+
+# the database file, with the wal folded back in
+def database_bytes(store) :
+    store.sql_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    page_count = store.sql_conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = store.sql_conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def fill(store, snapshots, polls) :
+    store.open()
+    start = time.perf_counter()
+    for ii in range(polls) :
+        snapshot = snapshots[ii % len(snapshots)]
+        snapshot.packet = ii + 1
+        store.write_snapshot(snapshot)
+    store.commit()
+    elapsed = time.perf_counter() - start
+    size = database_bytes(store)
+    store.close()
+    return store.rows_written / elapsed, size
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="size and insert throughput, wide against normalized schema")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--polls", type=int, default=500, help="web socket calls written to each database")
+    parser.add_argument("--interval", type=float, default=5, help="check_interval seconds, for the size of a month")
+    parser.add_argument("--dir", default=None, help="directory for the test databases")
+    args = parser.parse_args()
+
+    snapshots = make_snapshots(args.devices, 20)
+    rows_per_call = len(snapshots[0].links)
+    month_rows = rows_per_call * 30 * 86400 / args.interval
+    pragmas = {"journal_mode" : "wal", "synchronous" : "normal"}
+    print(f"{args.devices} devices, {rows_per_call} rows per call, {args.polls} calls, a month is {month_rows / 1e6:.1f} M rows")
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        results = {}
+        for name, store_class in (("wide", ZhaStore), ("normalized", NormalizedZhaStore)) :
+            database_file = os.path.join(tmp, name + ".db")
+            rows_per_second, size = fill(store_class(database_file, commit_polls=10, pragmas=pragmas), snapshots, args.polls)
+            bytes_per_row = size / (rows_per_call * args.polls)
+            results[name] = bytes_per_row
+            print(f"{name:10}  rows/s {rows_per_second:10.0f}  bytes/row {bytes_per_row:6.1f}  " \
+                f"size {size / 1e6:8.1f} MB  a month {bytes_per_row * month_rows / 1e9:7.2f} GB")
+
+        store = NormalizedZhaStore(os.path.join(tmp, "migrated.db"), pragmas=pragmas).open()
+        start = time.perf_counter()
+        rows = migrate(os.path.join(tmp, "wide.db"), store)
+        elapsed = time.perf_counter() - start
+        store.close()
+        print(f"migration   rows/s {rows / elapsed:10.0f}  ({rows} rows in {elapsed:.1f}s, a month in {month_rows / (rows / elapsed) / 60:.1f} min)")
+        print(f"normalized is {100 * (1 - results['normalized'] / results['wide']):.1f}% smaller")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+# bench_store.py
+
+# 202610181530
+#
+# rows per second and commits (disk syncs) per web socket call written to the zha table
+#  before : one execute per row and two commits per row, the way zha_ws.py used to write
+#  after  : one executemany per table and one transaction per call (commit_polls 1)
+#  group  : one transaction for several calls (commit_polls N)
+# using synthetic 'zha/devices' results of 50, 500 and 5000 devices
+#
+#  python3 bench/bench_store.py --sizes 50,500,5000 --polls 5 --group 10
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_fake_ha import generate_mesh
+from zha_process import ZhaProcessor
+from zha_store import ZhaStore, ZHA_INSERT, zha_values
+
+
+# the old write : every row and every name on its own, with a commit after each
+class RowAtATimeStore(ZhaStore) :
+
+    def write_snapshot(self, snapshot) :
+        sql_cursor = self.sql_conn.cursor()
+        for link in snapshot.links :
+            sql_cursor.execute(ZHA_INSERT, zha_values(link) + [snapshot.site])
+            self.sql_conn.commit()
+            sql_cursor.execute('insert or ignore into zha_device_name values (?, ?)', [link.neighbor_address, link.neighbor_given_name])
+            sql_cursor.execute('update zha_device_name set device_given_name = ? where device_address = ?', (link.neighbor_address, link.neighbor_given_name))
+            self.sql_conn.commit()
+            self.commits += 2
+        self.rows_written += len(snapshot.links)
+        return len(snapshot.links)
+
+
+# the snapshots of 'polls' web socket calls on a mesh of this size
+def make_snapshots(device_count, polls) :
+    processor = ZhaProcessor()
+    devices = generate_mesh(device_count)
+    start = datetime.now().replace(microsecond=0)
+    # first pass only sets up the in memory database
+    processor.process(0, start, [dict(device, neighbors=list(device["neighbors"])) for device in devices])
+    snapshots = []
+    for ii in range(1, polls + 1) :
+        snapshot = processor.process(ii, start + timedelta(seconds=5 * ii), [dict(device, neighbors=list(device["neighbors"])) for device in devices])
+        snapshot.site = "bench"
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def measure(store, snapshots) :
+    store.open()
+    start = time.perf_counter()
+    for snapshot in snapshots :
+        store.write_snapshot(snapshot)
+    store.close()
+    elapsed = time.perf_counter() - start
+    return store.rows_written / elapsed, store.commits / len(snapshots)
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark batched zha table writes")
+    parser.add_argument("--sizes", default="50,500,5000", help="mesh sizes, comma separated")
+    parser.add_argument("--polls", type=int, default=5, help="web socket calls written per mesh size")
+    parser.add_argument("--before-polls", type=int, default=1, help="calls written the old row at a time way, it is slow")
+    parser.add_argument("--group", type=int, default=10, help="commit_polls for the group commit run")
+    parser.add_argument("--dir", default=None, help="directory for the test databases, put it on the disk you care about")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        for size in [int(size) for size in args.sizes.split(",")] :
+            snapshots = make_snapshots(size, max(args.polls, args.before_polls))
+            rows = len(snapshots[0].links)
+            print(f"{size} devices, {rows} rows per call")
+            runs = (("before", RowAtATimeStore(os.path.join(tmp, "before%d.db" % size)), snapshots[:args.before_polls]), \
+                ("after", ZhaStore(os.path.join(tmp, "after%d.db" % size)), snapshots[:args.polls]), \
+                ("group " + str(args.group), ZhaStore(os.path.join(tmp, "group%d.db" % size), commit_polls=args.group), snapshots[:args.polls]))
+            for name, store, run_snapshots in runs :
+                rows_per_second, commits_per_poll = measure(store, run_snapshots)
+                print(f"  {name:10} rows/s {rows_per_second:12.0f}  commits per call {commits_per_poll:10.1f}")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
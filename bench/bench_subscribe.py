@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+# bench_subscribe.py
+
+# 202610181400
+#
+# bytes received from HA and cpu spent decoding / processing them, 'poll' ingest mode (full 'zha/devices' every
+# check_interval) compared with 'subscribe' mode (HA events, full resync every resync_interval), both scaled to
+# one hour, against a local fake HA server that sends a steady stream of events
+#
+#  python3 bench/bench_subscribe.py --devices 300 --seconds 60 --interval 5 --resync 300 --event-rate 5
+
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_fake_ha import FakeHomeAssistant, generate_mesh
+from zha_store import ZhaStore
+from zha_collector import ZhaCollector, INGEST_POLL, INGEST_SUBSCRIBE
+
+
+async def measure(mode, args, database_file) :
+
+    fake = await FakeHomeAssistant(generate_mesh(args.devices), event_rate=args.event_rate).start()
+    store = ZhaStore(database_file).open()
+    collector = ZhaCollector(store)
+    collector.add_site(mode, fake.ha_ip, fake.access_token, check_interval=args.interval, \
+        ingest_mode=mode, resync_interval=args.resync)
+
+    task = asyncio.create_task(collector.run())
+    await asyncio.sleep(args.seconds)
+    task.cancel()
+    try :
+        await task
+    except asyncio.CancelledError :
+        pass
+    store.close()
+    await fake.stop()
+    return collector.sites[0], collector.polls_persisted
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark subscribe ingest mode against polling")
+    parser.add_argument("--devices", type=int, default=300)
+    parser.add_argument("--seconds", type=float, default=60, help="how long to run each mode")
+    parser.add_argument("--interval", type=float, default=5, help="check_interval seconds")
+    parser.add_argument("--resync", type=float, default=300, help="resync_interval seconds, subscribe mode")
+    parser.add_argument("--event-rate", type=float, default=5, help="HA events per second")
+    args = parser.parse_args()
+
+    scale = 3600.0 / args.seconds
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp :
+        for mode in (INGEST_POLL, INGEST_SUBSCRIBE) :
+            site, polls_persisted = asyncio.run(measure(mode, args, os.path.join(tmp, mode + ".db")))
+            results[mode] = (site.bytes_received * scale, site.decode_cpu_seconds * scale)
+            print(f"{mode:10} snapshots {polls_persisted:5}  full downloads {site.full_downloads:4}  " \
+                f"events applied {site.tracker.events_applied:6}  " \
+                f"MB/hour {results[mode][0] / 1e6:9.2f}  cpu s/hour {results[mode][1]:8.2f}")
+
+    poll_bytes, poll_cpu = results[INGEST_POLL]
+    sub_bytes, sub_cpu = results[INGEST_SUBSCRIBE]
+    print(f"saved per hour : {(poll_bytes - sub_bytes) / 1e6:.2f} MB ({100 * (1 - sub_bytes / max(poll_bytes, 1)):.1f}%), " \
+        f"{poll_cpu - sub_cpu:.2f} cpu seconds ({100 * (1 - sub_cpu / max(poll_cpu, 1e-9)):.1f}%)")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
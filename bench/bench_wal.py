@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+# bench_wal.py
+
+# 202610181630
+#
+# writer latency and reader latency with a writer at full poll rate and a heavy report reader at the same time,
+# under each SQLite configuration
+#  delete       : sqlite defaults, rollback journal, synchronous full, the way zha_ws.db used to be opened
+#  wal          : journal_mode wal, synchronous normal
+#  wal-tuned    : wal plus mmap_size, a bigger cache_size and temp_store memory
+# the writer writes one web socket call of a synthetic mesh every --interval seconds (0 for back to back) with
+# ZhaStore, the reader runs in its own process and repeats a report query (per neighbor averages over the whole
+# zha table) through ZhaReader
+#
+#  python3 bench/bench_wal.py --devices 300 --history 200 --seconds 10 --interval 0.1
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_store import ZhaStore, ZhaReader
+from bench_store import make_snapshots
+
+
+CONFIGURATIONS = (("delete", None), \
+    ("wal", {"journal_mode" : "wal", "synchronous" : "normal"}), \
+    ("wal-tuned", {"journal_mode" : "wal", "synchronous" : "normal", "mmap_size" : 268435456, "cache_size" : -65536, "temp_store" : "memory"}))
+
+REPORT_QUERY = "select neighbor_address, count(*), avg(neighbor_lqi), min(neighbor_rssi), max(retrieve_ts) " \
+    "from zha group by neighbor_address order by 3"
+
+
+# child process : run the report query until told to stop, send back the latencies and errors
+def reader(database_file, pragmas, stop, results) :
+    reader_pragmas = dict((name, value) for name, value in (pragmas or {}).items() if name in ("mmap_size", "cache_size", "temp_store"))
+    zha_reader = ZhaReader(database_file, pragmas=reader_pragmas).open()
+    latency = []
+    errors = 0
+    while not stop.is_set() :
+        start = time.perf_counter()
+        try :
+            zha_reader.query(REPORT_QUERY)
+        except sqlite3.OperationalError :
+            errors += 1
+            continue
+        latency.append(time.perf_counter() - start)
+    zha_reader.close()
+    results.put((latency, errors))
+
+
+def ms(latency) :
+    if not latency :
+        return "      -       -       -"
+    latency = sorted(latency)
+    return f"{statistics.median(latency) * 1000:7.1f} {latency[max(0, int(len(latency) * 0.95) - 1)] * 1000:7.1f} {latency[-1] * 1000:7.1f}"
+
+
+def measure(database_file, pragmas, snapshots, history, args) :
+
+    # history for the reader to chew on
+    store = ZhaStore(database_file, commit_polls=50, pragmas=pragmas).open()
+    for ii in range(history) :
+        store.write_snapshot(snapshots[ii % len(snapshots)])
+    store.close()
+
+    store = ZhaStore(database_file, pragmas=pragmas).open()
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=reader, args=(database_file, pragmas, stop, results))
+    process.start()
+    time.sleep(0.5)
+
+    latency = []
+    errors = 0
+    end = time.perf_counter() + args.seconds
+    ii = 0
+    while time.perf_counter() < end :
+        start = time.perf_counter()
+        try :
+            store.write_snapshot(snapshots[ii % len(snapshots)])
+            latency.append(time.perf_counter() - start)
+        except sqlite3.OperationalError :
+            # 'database is locked' after the 5 second busy timeout
+            errors += 1
+            store.sql_conn.rollback()
+            store.uncommitted_polls = 0
+        ii += 1
+        pause = args.interval - (time.perf_counter() - start)
+        if pause > 0 :
+            time.sleep(pause)
+
+    stop.set()
+    reader_latency, reader_errors = results.get()
+    process.join()
+    store.close()
+    return latency, errors, reader_latency, reader_errors
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark SQLite journal / pragma settings with a writer and a reader")
+    parser.add_argument("--devices", type=int, default=300)
+    parser.add_argument("--history", type=int, default=200, help="web socket calls in the database before the run")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between writes, 0 for back to back")
+    parser.add_argument("--dir", default=None, help="directory for the test databases")
+    args = parser.parse_args()
+
+    snapshots = make_snapshots(args.devices, 10)
+    print(f"{args.devices} devices ({len(snapshots[0].links)} rows per call), {args.history} calls of history, " \
+        f"writer every {args.interval}s for {args.seconds}s")
+    print(f"{'':10} {'writes':>6} {'locked':>6}  writer ms median     p95     max  {'reads':>6} {'errors':>6}  reader ms median     p95     max")
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp :
+        for name, pragmas in CONFIGURATIONS :
+            latency, errors, reader_latency, reader_errors = measure(os.path.join(tmp, name + ".db"), pragmas, snapshots, args.history, args)
+            print(f"{name:10} {len(latency):6} {errors:6}  {'':9}{ms(latency)}  {len(reader_latency):6} {reader_errors:6}  {'':9}{ms(reader_latency)}")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
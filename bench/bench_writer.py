@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# bench_writer.py
+
+# 202610181600
+#
+# the background database writer (zha_writer.py) while another program holds the database locked
+# collects from a local fake HA server, and part way through a second connection takes an exclusive lock on the
+# database for --lock seconds, like a long report or an open sqlite3 shell transaction
+# for each overflow policy (block, coalesce, spill) reports how long the calls took compared to their schedule,
+# the deepest the writer queue got, write latency, and what ended up in the database
+#
+#  python3 bench/bench_writer.py --devices 100 --polls 40 --interval 0.25 --lock 4 --queue 5
+
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zha_fake_ha import FakeHomeAssistant, FakeHomeAssistantThread, generate_mesh
+from zha_store import ZhaStore
+from zha_collector import ZhaCollector
+from zha_writer import OVERFLOW_POLICIES
+
+
+# hold an exclusive lock on the database for 'seconds', starting after 'delay' seconds
+def lock_database(database_file, delay, seconds) :
+    time.sleep(delay)
+    sql_conn = sqlite3.connect(database_file, isolation_level=None, timeout=30)
+    sql_conn.execute("BEGIN EXCLUSIVE")
+    time.sleep(seconds)
+    sql_conn.execute("COMMIT")
+    sql_conn.close()
+
+
+def measure(fake, policy, args, tmp) :
+
+    database_file = os.path.join(tmp, policy + ".db")
+    store = ZhaStore(database_file).open()
+    locker = threading.Thread(target=lock_database, args=(database_file, args.interval * args.polls / 4, args.lock))
+
+    async def collect() :
+        collector = ZhaCollector(store, persist_queue_size=args.queue, overflow=policy, spill_file=os.path.join(tmp, policy + ".spill"))
+        collector.writer.retry_seconds = 0.1
+        collector.add_site("bench", fake.ha_ip, fake.access_token, check_interval=args.interval)
+        locker.start()
+        await collector.run(polls=args.polls)
+        return collector
+
+    start = time.perf_counter()
+    collector = asyncio.run(collect())
+    elapsed = time.perf_counter() - start
+    locker.join()
+    store.close()
+
+    sql_conn = sqlite3.connect(database_file)
+    packets = sql_conn.execute("select count(distinct packet) from zha").fetchone()[0]
+    sql_conn.close()
+    return elapsed, packets, collector.writer.stats()
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="benchmark the background database writer against a locked database")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--polls", type=int, default=40)
+    parser.add_argument("--interval", type=float, default=0.25, help="seconds between web socket calls")
+    parser.add_argument("--lock", type=float, default=4, help="seconds the database is locked by another connection")
+    parser.add_argument("--queue", type=int, default=5, help="writer queue size")
+    args = parser.parse_args()
+
+    fake_thread = FakeHomeAssistantThread(FakeHomeAssistant(generate_mesh(args.devices)))
+    fake = fake_thread.start()
+
+    print(f"{args.devices} devices, {args.polls} polls every {args.interval}s (schedule {args.polls * args.interval:.1f}s), " \
+        f"database locked for {args.lock}s, writer queue {args.queue}")
+    with tempfile.TemporaryDirectory() as tmp :
+        for policy in OVERFLOW_POLICIES :
+            elapsed, packets, stats = measure(fake, policy, args, tmp)
+            print(f"{policy:9} wall {elapsed:6.2f}s  calls in database {packets:4}  max depth {stats['max_depth']:4}  " \
+                f"coalesced {stats['coalesced']:4}  spilled {stats['spilled_total']:4}  lock retries {stats['lock_retries']:4}  " \
+                f"write ms median {stats['write_ms_median']:7.1f} p95 {stats['write_ms_p95']:7.1f}  " \
+                f"persist ms p95 {stats['persist_ms_p95']:8.1f}")
+
+    fake_thread.stop()
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
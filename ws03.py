@@ -1,5 +1,7 @@
 #!/usr/bin/python3
 # ws03.py
+# 202610182130
+# the device json is kept once per distinct content in the device_blob table, rows have its hash, see zha_blobs.py
 # 202101081014  
 #
 # use home assistant web sockets to read zha zigbee devices current state and insert a record into SQLite database for each device found
@@ -16,6 +18,8 @@ import sqlite3
 from pathlib import Path
 from websocket import create_connection
 
+from zha_blobs import BlobStore, prepare_table
+
 # Home Assistant Long-Lived Access Token
 ACCESS_TOKEN = ""
 
@@ -31,7 +35,11 @@ QUERY_PERIOD_SECONDS = 5
 # open database and create table if it does not exists
 conn = sqlite3.connect(DATABASE_FILE)
 c = conn.cursor()
-c.execute("CREATE TABLE IF NOT EXISTS zha (retrieve_ts integer, ieee_address text, attributes json)")
+c.execute("CREATE TABLE IF NOT EXISTS zha (retrieve_ts integer, ieee_address text, attributes json, attributes_hash blob)")
+# the json of each device is written once per distinct content, the rows only have its hash, zha_attributes joins it back in
+blobs = BlobStore(conn).open()
+prepare_table(conn)
+conn.commit()
 
 # open web socket connection to Home Assistant server
 ws = create_connection("ws://" + HOME_ASSISTANT_IP + ":8123/api/websocket")
@@ -74,9 +82,11 @@ try :
             print(retrieve_time, device["ieee"], device)
 
             # insert the record for each device into the database table
-            c.execute("insert into zha values (?, ?, ?)", \
-                [retrieve_time, str(device["ieee"]), json.dumps(device)])
-            conn.commit()
+            c.execute("insert into zha (retrieve_ts, ieee_address, attributes_hash) values (?, ?, ?)", \
+                [retrieve_time, str(device["ieee"]), blobs.put(device)])
+
+        # write all the records from this web socket call in one transaction, not one commit per record
+        conn.commit()
 
 
     # sleep until next query
@@ -6,6 +6,8 @@ VERSION_MAJOR = "1"
 VERSION_MINOR = "1"
 WORKING_DIRECTORY = ""
 
+# 202610182130
+# the device json is kept once per distinct content in the device_blob table, rows have its hash, see zha_blobs.py
 # 202101091421   
 #
 # use home assistant web sockets to read zha zigbee devices current state and insert a record into SQLite database for each device found
@@ -38,6 +40,8 @@ from datetime import timedelta
 from pathlib import Path
 from websocket import create_connection
 
+from zha_blobs import BlobStore, prepare_table
+
 import logging
 import logging.handlers
 
@@ -101,7 +105,11 @@ def main():
     # open database and create table if it does not exists
     sql_conn = sqlite3.connect(DATABASE_FILE)
     sql_cursor = sql_conn.cursor()
-    sql_cursor.execute("CREATE TABLE IF NOT EXISTS zha (retrieve_ts integer, ieee_address text, user_given_name text, delta_last_seen real, nwk int, lqi int, rssi int, available text, attributes json)")
+    sql_cursor.execute("CREATE TABLE IF NOT EXISTS zha (retrieve_ts integer, ieee_address text, user_given_name text, delta_last_seen real, nwk int, lqi int, rssi int, available text, attributes json, attributes_hash blob)")
+    # the json of each device is written once per distinct content, the rows only have its hash, zha_attributes joins it back in
+    blobs = BlobStore(sql_conn).open()
+    prepare_table(sql_conn)
+    sql_conn.commit()
 
     # open web socket connection to Home Assistant server
     ws = create_connection("ws://" + HOME_ASSISTANT_IP + ":8123/api/websocket")
@@ -177,6 +185,9 @@ def main():
                     "available" : "unk" \
                     }
 
+                # one hash for all the neighbor rows of the device
+                attributes_hash = None
+
                 # iterate thru each neighbor of the device returned
                 # so basically we are going to display / find / 'pull up' / extract the network of devices by the neighbor connections
                 for neighbor in device["neighbors"] :
@@ -232,7 +243,9 @@ def main():
                             console.print(f"{str(device['user_given_name']):40.40} ", style=style)
 
                             # insert the record for each device into the database table
-                            sql_cursor.execute("insert into zha values (?, ?, ?, ?, ?, ?, ?, ?, ?)", \
+                            if attributes_hash is None :
+                                attributes_hash = blobs.put(device)
+                            sql_cursor.execute("insert into zha values (?, ?, ?, ?, ?, ?, ?, ?, null, ?)", \
                                 [retrieve_time, \
                                 str(neighbor["ieee"]), \
                                 str(device_db.get(neighbor['ieee'], device_db_template)['user_given_name']), \
@@ -241,8 +254,10 @@ def main():
                                 device_db.get(neighbor['ieee'], device_db_template)['lqi'], \
                                 device_db.get(neighbor['ieee'], device_db_template)['rssi'], \
                                 device_available, \
-                                json.dumps(device)])
-                            sql_conn.commit()
+                                attributes_hash])
+
+            # write all the records from this web socket call in one transaction, not one commit per record
+            sql_conn.commit()
 
             console.print(40*"-")
 
@@ -250,7 +250,9 @@ def main():
                                 device_db.get(neighbor['ieee'], device_db_template)['lqi'], \
                                 device_db.get(neighbor['ieee'], device_db_template)['rssi'], \
                                 device_available ])
-                            sql_conn.commit()
+
+            # write all the records from this web socket call in one transaction, not one commit per record
+            sql_conn.commit()
 
             console.print(40*"-")
 
@@ -373,7 +373,6 @@ def main():
                                     device_available, \
                                     str(device['ieee']), \
                                     str(device['user_given_name']) ])
-                                sql_conn.commit()
 
 
                 # display a line for all the device which are offline
@@ -428,6 +427,9 @@ def main():
 
                             console.print(f"{'unk  unk':>8.8}", style='bold red on black')
 
+                # write all the records from this web socket call in one transaction, not one commit per record
+                sql_conn.commit()
+
                 console.print(40*"-")
 
 
@@ -458,7 +458,6 @@ def main():
                                     peer_available, \
                                     str(device['ieee']), \
                                     str(device['user_given_name']) ])
-                                sql_conn.commit()
 
 
                 # display a line for all the device which are offline, the coordinator seems to put itself 'offline', so we
@@ -518,6 +517,9 @@ def main():
 
                             console.print(f"{'unk  unk':>8.8}", style='bold red on black')
 
+                # write all the records from this web socket call in one transaction, not one commit per record
+                sql_conn.commit()
+
                 console.print(40*"-")
 
 
@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+# zha_archive.py
+
+# 202610182300
+# ArchiveReader.read_raw(), the message of a line as text, for the replay of zha_replay.py
+# 202610182100
+#
+# archive of the raw web socket json, 'raw_json_keep : True' in zha_ws.yaml, it replaces the zha_ws.json file
+# zha_ws.json was opened, appended to and closed on every web socket call, never compressed, never rotated,
+# and only valid json once the program had ended cleanly
+#
+# the archive is a directory of compressed NDJSON segments, one line per web socket call :
+#
+#  {"retrieve_ts": "2026-10-18 21:00:00", "site": "home", "packet": 12, "raw": <the web socket message as received>}
+#
+# every line is compressed on its own, a gzip member or a zstd frame, and appended to the segment, which stays
+# open between calls, a segment is still a normal .ndjson.gz (zcat) or .ndjson.zst (zstdcat) file, the members
+# or frames one after the other are the whole file
+# a new segment is started for each day (local time), when a segment reaches segment_bytes, and each time the
+# program starts
+#
+# the index, <name>.idx.db in the same directory, has (retrieve_ts, site, packet, segment, offset, length) of
+# every line, so one call can be read back by time with one seek and the decompression of that line alone
+#
+#  python3 zha_archive.py raw/                                   # the segments and what is in them
+#  python3 zha_archive.py raw/ --at "2026-10-18 21:00:00"         # the call at or before that time
+#
+# gzip is in the python library, zstd needs 'pip3 install zstandard', it compresses better and faster
+
+import os
+import sys
+import gzip
+import json
+import sqlite3
+import argparse
+
+try :
+    import zstandard
+except ImportError :
+    zstandard = None
+
+from zha_store import sql_value
+
+
+ARCHIVE_COMPRESSIONS = {"gzip" : ".ndjson.gz", "zstd" : ".ndjson.zst"}
+
+ARCHIVE_INDEX_TABLE = "CREATE TABLE IF NOT EXISTS archive_index (retrieve_ts integer not null, site text, packet integer, segment text not null, offset integer not null, length integer not null)"
+ARCHIVE_INDEX_INDEXES = ("CREATE INDEX IF NOT EXISTS archive_index_ts ON archive_index (retrieve_ts)", \
+    "CREATE INDEX IF NOT EXISTS archive_index_site_ts ON archive_index (site, retrieve_ts)")
+
+
+class RawArchive :
+
+    # directory : where the segments and the index go
+    # name : first part of the segment file names, zha_ws-20261018-210000.ndjson.gz
+    # compression : "gzip" or "zstd"
+    # segment_bytes : a new segment is started once one is this big, compressed
+    def __init__(self, directory, name="zha_ws", compression="gzip", segment_bytes=64 * 1024 * 1024, level=None) :
+        if compression not in ARCHIVE_COMPRESSIONS :
+            raise ValueError("unknown raw archive compression : " + str(compression))
+        if compression == "zstd" and zstandard is None :
+            raise ValueError("raw archive compression zstd needs the zstandard module, pip3 install zstandard")
+        self.directory = directory
+        self.name = name
+        self.compression = compression
+        self.segment_bytes = segment_bytes
+        self.level = level
+        self.compressor = None
+        self.index_conn = None
+        # the open segment, its file name, size and the day it is for
+        self.segment = None
+        self.segment_name = None
+        self.segment_size = 0
+        self.segment_day = None
+        # statistics
+        self.calls_written = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def open(self) :
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_conn = sqlite3.connect(os.path.join(self.directory, self.name + ".idx.db"), check_same_thread=False)
+        self.index_conn.execute("PRAGMA journal_mode = wal")
+        self.index_conn.execute("PRAGMA synchronous = normal")
+        self.index_conn.execute(ARCHIVE_INDEX_TABLE)
+        for index in ARCHIVE_INDEX_INDEXES :
+            self.index_conn.execute(index)
+        self.index_conn.commit()
+        if self.compression == "zstd" :
+            self.compressor = zstandard.ZstdCompressor(level=self.level if self.level is not None else 3, write_content_size=True)
+        return self
+
+    def close(self) :
+        self.close_segment()
+        if self.index_conn is not None :
+            self.index_conn.commit()
+            self.index_conn.close()
+            self.index_conn = None
+
+    def close_segment(self) :
+        if self.segment is not None :
+            self.segment.close()
+            self.segment = None
+
+    def compress(self, data) :
+        if self.compression == "zstd" :
+            return self.compressor.compress(data)
+        return gzip.compress(data, compresslevel=self.level if self.level is not None else 6)
+
+    # the segment for a call at retrieve_time, a new one for a new day, or when the open one is full
+    def segment_for(self, retrieve_time) :
+        day = retrieve_time.date()
+        if self.segment is None or day != self.segment_day or self.segment_size >= self.segment_bytes :
+            self.close_segment()
+            name = self.name + "-" + retrieve_time.strftime("%Y%m%d-%H%M%S")
+            suffix = ARCHIVE_COMPRESSIONS[self.compression]
+            ii = 0
+            while os.path.exists(os.path.join(self.directory, name + ("-" + str(ii) if ii else "") + suffix)) :
+                ii += 1
+            self.segment_name = name + ("-" + str(ii) if ii else "") + suffix
+            self.segment = open(os.path.join(self.directory, self.segment_name), "ab")
+            self.segment_size = 0
+            self.segment_day = day
+        return self.segment
+
+    # append the raw json of one web socket call, snapshot.raw is the message as it came from the web socket
+    def write(self, snapshot) :
+        retrieve_ts = sql_value(snapshot.retrieve_time)
+        # the raw message is json already, it goes into the line as it is, a newline in json text can only be
+        # white space, so it is safe to turn into a space
+        line = ('{"retrieve_ts": ' + json.dumps(retrieve_ts) + ', "site": ' + json.dumps(snapshot.site) + \
+            ', "packet": ' + json.dumps(snapshot.packet) + ', "raw": ' + snapshot.raw.replace("\n", " ") + '}\n').encode()
+        data = self.compress(line)
+        segment = self.segment_for(snapshot.retrieve_time)
+        offset = self.segment_size
+        segment.write(data)
+        # readers of the archive see the call as soon as it is in the index
+        segment.flush()
+        self.segment_size += len(data)
+        self.index_conn.execute("insert into archive_index values (?, ?, ?, ?, ?, ?)", \
+            (retrieve_ts, snapshot.site, snapshot.packet, self.segment_name, offset, len(data)))
+        self.index_conn.commit()
+        self.calls_written += 1
+        self.bytes_in += len(line)
+        self.bytes_out += len(data)
+
+
+# ---- reading ----
+
+def decompress(data) :
+    if data[: 2] == b"\x1f\x8b" :
+        return gzip.decompress(data)
+    if zstandard is None :
+        raise ValueError("zstd raw archive segment, needs the zstandard module, pip3 install zstandard")
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+class ArchiveReader :
+
+    def __init__(self, directory, name="zha_ws") :
+        self.directory = directory
+        self.index_conn = sqlite3.connect("file:" + os.path.join(directory, name + ".idx.db") + "?mode=ro", uri=True)
+        # the segment read last, kept open for reads in order
+        self.segment = None
+        self.segment_name = None
+
+    def close(self) :
+        if self.segment is not None :
+            self.segment.close()
+        self.index_conn.close()
+
+    # one line of the archive, decompressed
+    def line(self, segment_name, offset, length) :
+        if segment_name != self.segment_name :
+            if self.segment is not None :
+                self.segment.close()
+            self.segment = open(os.path.join(self.directory, segment_name), "rb")
+            self.segment_name = segment_name
+        self.segment.seek(offset)
+        return decompress(self.segment.read(length))
+
+    # one line of the archive as a dict, the raw web socket message under "raw"
+    def read(self, segment_name, offset, length) :
+        return json.loads(self.line(segment_name, offset, length))
+
+    # the raw web socket message of one line as the text it was received as, without parsing the line, for
+    # zha_replay.py, the line is always '{"retrieve_ts": .., "site": .., "packet": .., "raw": <message>}', a
+    # '"' inside the site name is escaped, so the first ', "raw": ' is the one
+    def read_raw(self, segment_name, offset, length) :
+        text = self.line(segment_name, offset, length).decode()
+        return text[text.index(', "raw": ') + 9 : text.rindex("}")]
+
+    # the call at or before 'when', a datetime or 'YYYY-MM-DD HH:MM:SS', None if there is none
+    def call_at(self, when, site=None) :
+        sql = "select segment, offset, length from archive_index where retrieve_ts <= ?"
+        parameters = [sql_value(when)]
+        if site is not None :
+            sql += " and site = ?"
+            parameters.append(site)
+        row = self.index_conn.execute(sql + " order by retrieve_ts desc limit 1", parameters).fetchone()
+        return self.read(*row) if row is not None else None
+
+    # the index rows (retrieve_ts, site, packet, segment, offset, length) from start to end, oldest first
+    def entries(self, start=None, end=None, site=None) :
+        where = []
+        parameters = []
+        if start is not None :
+            where.append("retrieve_ts >= ?")
+            parameters.append(sql_value(start))
+        if end is not None :
+            where.append("retrieve_ts <= ?")
+            parameters.append(sql_value(end))
+        if site is not None :
+            where.append("site = ?")
+            parameters.append(site)
+        return self.index_conn.execute("select retrieve_ts, site, packet, segment, offset, length from archive_index" + \
+            (" where " + " and ".join(where) if where else "") + " order by retrieve_ts, rowid", parameters)
+
+    # the calls from start to end, oldest first
+    def calls(self, start=None, end=None, site=None) :
+        for retrieve_ts, site_name, packet, segment, offset, length in self.entries(start, end, site).fetchall() :
+            yield self.read(segment, offset, length)
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="raw web socket json archive of zha_ws.py")
+    parser.add_argument("directory", help="archive directory")
+    parser.add_argument("--name", default="zha_ws", help="first part of the segment file names")
+    parser.add_argument("--at", default=None, help="print the call at or before 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("--site", default=None, help="only this site")
+    args = parser.parse_args()
+
+    reader = ArchiveReader(args.directory, args.name)
+    if args.at :
+        call = reader.call_at(args.at, args.site)
+        if call is None :
+            print("no call at or before " + args.at)
+            sys.exit(1)
+        print(json.dumps(call))
+    else :
+        for row in reader.index_conn.execute("select segment, count(*), min(retrieve_ts), max(retrieve_ts), sum(length) from archive_index group by segment order by min(retrieve_ts)") :
+            print(f"{row[0]}  {row[1]:6d} calls  {row[2]} .. {row[3]}  {row[4] / 1e6:8.1f} MB")
+    reader.close()
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
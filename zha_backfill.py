@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# zha_backfill.py
+
+# 202610182230
+#
+# build the history in the database again from the raw json dumps of before the archive, the zha_ws.json of
+# zha_ws.py ('raw_json_keep : True') and the ws06.json / ws07.json / ws08.json of those programs, for runs
+# whose database was lost, or was of another schema
+# the dumps are a '[' line, then one web socket result per line with a ',' after it, and a ']' line only if the
+# program ended cleanly, the last line may be cut off half way if it did not, lines that are not json are skipped
+#
+# each web socket result goes through zha_process.ZhaProcessor, the same processing as the live collector, and the
+# rows are written in large transactions by zha_migrate.ZhaMigration, into the zha table or the normalized tables
+# the dumps have no time of the call, the retrieve time is taken as the newest last_seen of the devices in the
+# result, a device is always seen shortly before a call, so it is a little early, never after the real time
+#
+# the lines of a file are handed out in chunks of --chunk calls to a pool of --workers processes, each chunk
+# starts with the call before it as the setup pass of its processor, the way zha_ws.py starts, so the rows
+# are those of the live collector but for the uplink lqi of links gone from the neighbor tables for two calls
+# the chunks are written in file order, the line written up to is the checkpoint of the file, a backfill run
+# again carries on from there
+#
+#  python3 zha_backfill.py zha_ws.db ws06.json zha_ws.json --site home --workers 4
+#  python3 zha_backfill.py zha_ws.db ws06.json --schema normalized
+
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from datetime import datetime
+
+from zha_process import ZhaProcessor
+from zha_store import zha_values
+from zha_migrate import ZhaMigration
+
+
+# the (offset, length) of each line of a dump that can be a web socket result
+def line_offsets(dump_file) :
+    offsets = []
+    offset = 0
+    with open(dump_file, "rb") as f :
+        for line in f :
+            if line.strip() not in (b"", b"[", b"]") :
+                offsets.append((offset, len(line)))
+            offset += len(line)
+    return offsets
+
+
+# the 'zha/devices' result of one line, None for a line that is not json, cut off, or not a successful result
+def parse_line(line) :
+    line = line.strip().rstrip(b",")
+    try :
+        message = json.loads(line)
+    except ValueError :
+        return None
+    if not isinstance(message, dict) or not isinstance(message.get("result"), list) or not message.get("success", True) :
+        return None
+    return message
+
+
+# the time of a call, the newest last_seen of its devices
+def retrieve_time_of(devices) :
+    last_seen = [device["last_seen"] for device in devices if device.get("last_seen")]
+    return datetime.strptime(max(last_seen), '%Y-%m-%dT%H:%M:%S') if last_seen else None
+
+
+# pool worker, the rows of the calls at offsets of dump_file, the call at setup (or None) only fills the processor
+# returns (rows, calls, lines skipped, last packet)
+def backfill_chunk(dump_file, setup, offsets, site) :
+    processor = ZhaProcessor()
+    rows = []
+    calls = 0
+    skipped = 0
+    packet = None
+    with open(dump_file, "rb") as f :
+        for ii, (offset, length) in enumerate(([setup] if setup is not None else []) + offsets) :
+            is_setup = setup is not None and ii == 0
+            f.seek(offset)
+            message = parse_line(f.read(length))
+            retrieve_time = retrieve_time_of(message["result"]) if message is not None else None
+            if retrieve_time is None :
+                skipped += 0 if is_setup else 1
+                continue
+            call_packet = int(message.get("id", 1)) - 1
+            if processor.setup_pass :
+                # the first call only fills the processor's device database, the call before the chunk, or at the
+                # start of the file the first call, which then goes through again
+                processor.process(call_packet, retrieve_time, message["result"])
+                if is_setup :
+                    continue
+            snapshot = processor.process(call_packet, retrieve_time, message["result"])
+            rows.extend(tuple(zha_values(link)) + (link.neighbor_given_name, link.peer_given_name, site) for link in snapshot.links)
+            calls += 1
+            packet = call_packet
+    return rows, calls, skipped, packet
+
+
+class ZhaBackfill :
+
+    # the target database, schema and site as for zha_migrate.ZhaMigration
+    # chunk_calls : web socket results per pool task, and per transaction
+    # workers : pool processes, 0 runs the chunks in this process
+    def __init__(self, target_file, schema="wide", chunk_calls=50, workers=2, site=None) :
+        self.migration = ZhaMigration(target_file, schema=schema, workers=0, site=site)
+        self.chunk_calls = chunk_calls
+        self.workers = workers
+        self.site = site
+        # statistics
+        self.calls = 0
+        self.skipped = 0
+
+    def open(self) :
+        self.migration.open()
+        return self
+
+    def close(self) :
+        self.migration.close()
+
+    @property
+    def rows_written(self) :
+        return self.migration.rows_written
+
+    # backfill the dump files, progress(dump, calls of that file) after each chunk, returns the rows written
+    def run(self, dumps, progress=None) :
+        pool = multiprocessing.Pool(self.workers) if self.workers > 0 else None
+        try :
+            for dump_file in dumps :
+                self.backfill(os.path.abspath(dump_file), pool, progress)
+        finally :
+            if pool is not None :
+                pool.terminate()
+                pool.join()
+        return self.migration.rows_written
+
+    def backfill(self, dump, pool, progress) :
+        checkpoints = self.migration.checkpoints
+        if dump not in checkpoints :
+            checkpoints[dump] = ["json", 0, 0, 0, 0]
+        # the checkpoint is the number of lines written
+        source_schema, lines_done, packet, rows, done = checkpoints[dump]
+        if done :
+            return
+        offsets = line_offsets(dump)
+        tasks = []
+        for first in range(lines_done, len(offsets), self.chunk_calls) :
+            tasks.append((dump, offsets[first - 1] if first > 0 else None, offsets[first : first + self.chunk_calls], self.site))
+        calls = 0
+        if pool is None :
+            results = (backfill_chunk(*task) for task in tasks)
+        else :
+            # at most two chunks per worker waiting for the writer, results in file order
+            pending = [pool.apply_async(backfill_chunk, task) for task in tasks[: 2 * self.workers]]
+            results = self.in_order(pool, pending, tasks[2 * self.workers :])
+        for task, (rows, chunk_calls, skipped, chunk_packet) in zip(tasks, results) :
+            lines_done += len(task[2])
+            packet = chunk_packet if chunk_packet is not None else packet
+            self.migration.write(dump, rows, lines_done, packet)
+            calls += chunk_calls
+            self.calls += chunk_calls
+            self.skipped += skipped
+            if progress is not None :
+                progress(dump, calls)
+        self.migration.write(dump, [], lines_done, packet, done=True)
+
+    # the results of the pool tasks in order, the next task is started as each one is taken
+    def in_order(self, pool, pending, waiting) :
+        while pending :
+            result = pending.pop(0).get()
+            if waiting :
+                pending.append(pool.apply_async(backfill_chunk, waiting.pop(0)))
+            yield result
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="backfill the zha_ws.py database from zha_ws.json / ws06.json raw json dumps")
+    parser.add_argument("target", help="database to backfill, zha_ws.db")
+    parser.add_argument("dumps", nargs="+", help="raw json dump files")
+    parser.add_argument("--schema", choices=("wide", "normalized"), default="wide", help="the zha table, or the normalized tables")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="pool processes, 0 runs in this process")
+    parser.add_argument("--chunk", type=int, default=50, help="web socket results per chunk and per transaction")
+    parser.add_argument("--site", default=None, help="site of the rows")
+    args = parser.parse_args()
+
+    backfill = ZhaBackfill(args.target, schema=args.schema, chunk_calls=args.chunk, workers=args.workers, site=args.site).open()
+    start = time.perf_counter()
+    try :
+        backfill.run(args.dumps, progress=lambda dump, calls : print(f"\r{os.path.basename(dump)} {calls} calls", end=" " * 10, flush=True))
+    except KeyboardInterrupt :
+        print("\ninterrupted, run again to carry on from the checkpoints")
+    finally :
+        backfill.close()
+    elapsed = time.perf_counter() - start
+    print(f"\r{backfill.calls} calls, {backfill.rows_written} rows in {elapsed:.1f}s ({backfill.calls / max(elapsed, 1e-9):.1f} calls/s), " \
+        f"{backfill.skipped} lines skipped" + " " * 20)
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# zha_blobs.py
+
+# 202610182130
+#
+# content addressed store of the per device json of ws03.py and ws04.py
+# those programs kept json.dumps(device) in the 'attributes' column of every row of every web socket call, the
+# same few kB again and again for as long as a device does not change
+# now the json of a device is written once, to the device_blob table, under a hash of its content, and the rows
+# only have the hash, 'attributes_hash', the zha_attributes view puts the json back next to each row
+#
+#  device_blob : blob_hash (16 byte blake2b of the canonical json), attributes (the json)
+#
+# the canonical json has its keys sorted and no spaces, so the same device content always has the same hash
+# whatever order HA sent the keys in, the hashes already in the table are kept in memory so a device that
+# has not changed costs a hash and no write
+#
+# databases from before keep their rows with the json in 'attributes', new rows get an 'attributes_hash' and
+# a null 'attributes', the view shows both, --dedupe moves the json of the old rows into the blob table
+#
+#  python3 zha_blobs.py ws03.db                 # dedupe report, rows, blobs, bytes
+#  python3 zha_blobs.py ws03.db --dedupe        # move the json of the old rows into device_blob, then VACUUM
+
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+
+
+DEVICE_BLOB_TABLE = "CREATE TABLE IF NOT EXISTS device_blob (blob_hash blob primary key, attributes json) WITHOUT ROWID"
+ATTRIBUTES_VIEW = "zha_attributes"
+
+
+def canonical_json(device) :
+    return json.dumps(device, sort_keys=True, separators=(",", ":"))
+
+
+def blob_hash(text) :
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+class BlobStore :
+
+    def __init__(self, sql_conn) :
+        self.sql_conn = sql_conn
+        # the hashes in the device_blob table
+        self.hashes = set()
+        # statistics
+        self.blobs_seen = 0
+        self.blobs_written = 0
+        self.bytes_seen = 0
+        self.bytes_written = 0
+
+    def open(self) :
+        self.sql_conn.execute(DEVICE_BLOB_TABLE)
+        self.hashes = set(row[0] for row in self.sql_conn.execute("select blob_hash from device_blob"))
+        return self
+
+    # the hash of the json of a device, the json is written the first time its content shows up
+    def put(self, device) :
+        text = canonical_json(device)
+        digest = blob_hash(text)
+        self.blobs_seen += 1
+        self.bytes_seen += len(text)
+        if digest not in self.hashes :
+            self.sql_conn.execute("insert or ignore into device_blob values (?, ?)", (digest, text))
+            self.hashes.add(digest)
+            self.blobs_written += 1
+            self.bytes_written += len(text)
+        return digest
+
+    def get(self, digest) :
+        row = self.sql_conn.execute("select attributes from device_blob where blob_hash = ?", (digest,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+
+# the history table of ws03.py / ws04.py, with the attributes_hash column, and the view that joins the json back
+# in, a table from before gets the attributes_hash column added, its rows keep their json in 'attributes'
+def prepare_table(sql_conn, table="zha") :
+    columns = [row[1] for row in sql_conn.execute("PRAGMA table_info(" + table + ")")]
+    if "attributes_hash" not in columns :
+        sql_conn.execute("ALTER TABLE " + table + " ADD COLUMN attributes_hash blob")
+        columns.append("attributes_hash")
+    sql_conn.execute("DROP VIEW IF EXISTS " + ATTRIBUTES_VIEW)
+    sql_conn.execute("CREATE VIEW " + ATTRIBUTES_VIEW + " AS SELECT " + \
+        ", ".join("h." + column for column in columns if column not in ("attributes", "attributes_hash")) + \
+        ", coalesce(h.attributes, b.attributes) AS attributes FROM " + table + " h LEFT JOIN device_blob b ON b.blob_hash = h.attributes_hash")
+
+
+# move the json of the rows from before into device_blob, chunk_rows rows per transaction
+def dedupe(sql_conn, table="zha", chunk_rows=10000, progress=None) :
+    blobs = BlobStore(sql_conn).open()
+    moved = 0
+    while True :
+        rows = sql_conn.execute("select rowid, attributes from " + table + " where attributes is not null limit ?", (chunk_rows,)).fetchall()
+        if not rows :
+            break
+        sql_conn.executemany("update " + table + " set attributes = null, attributes_hash = ? where rowid = ?", \
+            [(blobs.put(json.loads(attributes)), rowid) for rowid, attributes in rows])
+        sql_conn.commit()
+        moved += len(rows)
+        if progress :
+            progress(moved)
+    return moved
+
+
+# rows, distinct blobs and bytes of the json, as it is stored and as it would be with the json on every row
+def report(sql_conn, table="zha") :
+    rows, inline_rows, inline_bytes, hashed_rows = sql_conn.execute("select count(*), count(attributes), coalesce(sum(length(attributes)), 0), " \
+        "count(attributes_hash) from " + table).fetchone()
+    blobs, blob_bytes = sql_conn.execute("select count(*), coalesce(sum(length(attributes)), 0) from device_blob").fetchone()
+    referenced_bytes = sql_conn.execute("select coalesce(sum(length(b.attributes)), 0) from " + table + \
+        " h join device_blob b on b.blob_hash = h.attributes_hash").fetchone()[0]
+    logical_bytes = inline_bytes + referenced_bytes
+    stored_bytes = inline_bytes + blob_bytes + hashed_rows * 16
+    return {"rows" : rows, "inline_rows" : inline_rows, "hashed_rows" : hashed_rows, "blobs" : blobs, \
+        "json_bytes" : logical_bytes, "stored_bytes" : stored_bytes, "ratio" : logical_bytes / stored_bytes if stored_bytes else 0.0}
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="dedupe report of the device json of ws03.py / ws04.py databases")
+    parser.add_argument("database", help="ws03.db or ws04.db")
+    parser.add_argument("--table", default="zha")
+    parser.add_argument("--dedupe", action="store_true", help="move the json of the rows from before into device_blob")
+    args = parser.parse_args()
+
+    sql_conn = sqlite3.connect(args.database)
+    sql_conn.execute(DEVICE_BLOB_TABLE)
+    prepare_table(sql_conn, args.table)
+    sql_conn.commit()
+
+    if args.dedupe :
+        start = time.perf_counter()
+        moved = dedupe(sql_conn, args.table, progress=lambda moved : print(f"{moved} rows", end="\r"))
+        print(f"{moved} rows moved in {time.perf_counter() - start:.1f}s ({moved / max(time.perf_counter() - start, 1e-9):.0f} rows/s)")
+        sql_conn.execute("VACUUM")
+
+    stats = report(sql_conn, args.table)
+    print(f"{stats['rows']} rows, {stats['inline_rows']} with the json in the row, {stats['hashed_rows']} with a hash, {stats['blobs']} distinct blobs")
+    print(f"json {stats['json_bytes'] / 1e6:.1f} MB, stored {stats['stored_bytes'] / 1e6:.1f} MB, dedupe ratio {stats['ratio']:.1f}x")
+    sql_conn.close()
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,523 @@
+#!/usr/bin/python3
+# zha_collector.py
+
+# 202610190000
+# stream_decode : poll mode 'zha/devices' results read device by device, without the json tree of the frame
+# a cancelled collector no longer hangs on a full decode or render queue
+# 202610182345
+# 'zha/devices' results are decoded into the device records of zha_decode.py, and the messages of subscribe mode
+# are parsed with orjson when it is installed
+# 202610182100
+# the raw json is kept in the compressed archive of zha_archive.py, written by the writer thread
+# 202610181600
+# database writes moved to the background writer thread of zha_writer.py, with a bounded queue and an overflow policy
+# 202610181430
+# one collector can now read several Home Assistant sites at the same time, each with its own web socket,
+# request ids and schedule, all writing into one database and one console
+# 202610181330
+# added 'subscribe' ingest mode, device data kept current from HA events with a slower full 'zha/devices' resync
+# 202610181130
+#
+# asyncio collector for zha_ws.py
+# the web socket i/o, the json decoding / processing, the SQLite database writes and the console display
+# each run as their own task, linked by queues, so a slow disk or a slow terminal never delays the next
+# 'zha/devices' call and a web socket that stops answering is timed out and reconnected
+#
+#   site 1 : poller / subscriber --> decode queue --> decoder --\
+#   site 2 : poller / subscriber --> decode queue --> decoder ---+--> writer queue  --> writer thread (SQLite, raw json archive)
+#   ...                                                           \-> render queue  --> renderer  (rich console)
+#
+# the blocking parts (json decode, console) run on their own single thread executors, shared by all sites,
+# so each of them keeps its work in order and the event loop stays free to talk to Home Assistant
+# the SQLite writes run on the thread of zha_writer.ZhaWriter, see there for what happens when the queue is full
+#
+# ingest modes :
+#  poll      : call 'zha/devices' every check_interval seconds, the way zha_ws.py always has
+#  subscribe : subscribe to HA events and keep the device data current from them (see zha_events.py), write /
+#              display the current data every check_interval seconds, and only download the full 'zha/devices'
+#              result (with the neighbor tables) every resync_interval seconds and after every reconnect
+
+import json
+import time
+import asyncio
+import logging
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import websockets
+
+from zha_process import ZhaProcessor
+from zha_decode import decode_devices, stream_devices, loads
+from zha_render import render_snapshot
+from zha_events import ZhaEventTracker, SUBSCRIBE_EVENT_TYPES, REFRESH_DEVICE, RESYNC
+from zha_writer import ZhaWriter, OVERFLOW_BLOCK
+
+
+INGEST_POLL = "poll"
+INGEST_SUBSCRIBE = "subscribe"
+
+# marks the end of the stream of web socket results going down the queues
+END_OF_POLLS = None
+
+# kinds of work on the decode queue
+DEVICES = "devices"     # a 'zha/devices' result, poll mode
+MESSAGE = "message"     # any message from HA, with the requests of its web socket, subscribe mode
+TICK = "tick"           # time to write / display the current device data, subscribe mode
+
+
+# open web socket connection to Home Assistant server and authenticate
+# returns the connection, raises on any failure
+async def ha_connect(ha_ip, access_token, timeout) :
+
+    ws = await asyncio.wait_for(websockets.connect("ws://" + ha_ip + "/api/websocket", max_size=None), timeout)
+    try :
+        # connection ack
+        await asyncio.wait_for(ws.recv(), timeout)
+        # send authentication token to HA server
+        await ws.send(json.dumps(
+                {'type': 'auth',
+                 'access_token': access_token}
+            ))
+        # authentication result
+        result = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+        if result.get("type") != "auth_ok" :
+            raise ConnectionError("Home Assistant authentication failed : " + str(result.get("message", result.get("type"))))
+    except BaseException :
+        await ws.close()
+        raise
+    return ws
+
+
+# put on a queue without waiting, if the queue is full throw away the oldest entry to make room
+# returns True if something was thrown away
+def put_drop_oldest(queue, item) :
+    dropped = False
+    while True :
+        try :
+            queue.put_nowait(item)
+            return dropped
+        except asyncio.QueueFull :
+            queue.get_nowait()
+            queue.task_done()
+            dropped = True
+
+
+# one Home Assistant instance : its web socket, request ids, schedule and in memory device data
+class ZhaSite :
+
+    def __init__(self, collector, name, ha_ip, access_token, check_interval=5, ws_timeout=30, \
+        ingest_mode=INGEST_POLL, resync_interval=300, keep_raw=False, stream_decode=False) :
+
+        self.collector = collector
+        self.logger = collector.logger
+        # the site name is recorded with every database row
+        self.name = name
+        self.ha_ip = ha_ip
+        self.access_token = access_token
+        # number of seconds between queries to ZHA
+        self.check_interval = check_interval
+        # seconds to wait on the web socket before we consider it hung and reconnect
+        self.ws_timeout = ws_timeout
+        # poll or subscribe, and in subscribe mode the seconds between full 'zha/devices' downloads
+        self.ingest_mode = ingest_mode
+        self.resync_interval = resync_interval
+        # keep the raw web socket json in the raw json archive of the collector
+        self.keep_raw = keep_raw
+        # read the devices of a 'zha/devices' result one at a time, for big meshes, see zha_decode.stream_devices()
+        self.stream_decode = stream_decode
+
+        self.processor = ZhaProcessor()
+        self.tracker = ZhaEventTracker()
+
+        self.decode_queue = asyncio.Queue(maxsize=100 if ingest_mode == INGEST_SUBSCRIBE else 2)
+
+        # subscribe mode : the open web socket, the next request id and what each outstanding request was for
+        # a reconnect starts a new dict, messages of the old web socket still waiting in the decode queue keep
+        # theirs, so an old id never takes the answer to a new request
+        self.ws = None
+        self.ident = 1
+        self.pending = {}
+        # subscribe mode snapshots are numbered here, poll mode uses the web socket call identifier
+        self.packet = 0
+        # subscribe mode, the last full 'zha/devices' download not yet written to the raw json archive
+        self.raw_full = None
+
+        # statistics, for the log and the benchmarks
+        self.polls_sent = 0
+        # bytes received from HA, and cpu seconds spent decoding and processing what was received
+        self.bytes_received = 0
+        self.decode_cpu_seconds = 0.0
+        self.full_downloads = 0
+
+    # ---- web socket, poll mode ----
+
+    async def poller(self, polls) :
+
+        ws = None
+        # we need a unique identifier to sent as part of each web socket request
+        ident = 1
+        loop = asyncio.get_running_loop()
+        cancelled = False
+
+        try :
+            while polls is None or self.polls_sent < polls :
+
+                if ws is None :
+                    try :
+                        ws = await ha_connect(self.ha_ip, self.access_token, self.ws_timeout)
+                        ident = 1
+                        next_poll = loop.time()
+                    except Exception as e :
+                        self.logger.error("Error : " + self.name + " : Unable connect to web socket, retrying : " + traceback.format_exc())
+                        await asyncio.sleep(self.check_interval * 5)
+                        continue
+
+                try :
+                    # this is the query to get the json list of current zigbee devices
+                    sent = time.perf_counter()
+                    await ws.send(json.dumps(
+                            {'id': ident, 'type': 'zha/devices'}
+                        ))
+
+                    # get the data string back from the web socket call, a hung socket is timed out here
+                    result = await asyncio.wait_for(ws.recv(), self.ws_timeout)
+
+                    # record the time when the data was retrieved
+                    retrieve_time = datetime.now().replace(microsecond=0)
+
+                except Exception as e :
+                    self.logger.error("Error : " + self.name + " : Unable to execute web socket call : " + traceback.format_exc())
+                    await ws.close()
+                    ws = None
+                    # pause, then reconnect to Home Assistant Web Socket interface
+                    await asyncio.sleep(self.check_interval * 5)
+                    continue
+
+                self.polls_sent += 1
+                self.full_downloads += 1
+                self.bytes_received += len(result)
+                await self.decode_queue.put((DEVICES, sent, retrieve_time, result))
+
+                # increment our unique web socket identifier
+                ident = ident + 1
+
+                # wait for the next call, measured from when this call was due, not from when processing ended
+                next_poll = max(next_poll + self.check_interval, loop.time())
+                await asyncio.sleep(next_poll - loop.time())
+
+        except asyncio.CancelledError :
+            cancelled = True
+            raise
+        finally :
+            if ws is not None :
+                await ws.close()
+            await self.end_of_polls(cancelled)
+
+    # ---- web socket, subscribe mode ----
+
+    # send a request to HA and remember what it was for, so the decoder knows what to do with the result
+    async def send_command(self, kind, message) :
+        if self.ws is None :
+            return
+        message["id"] = self.ident
+        self.pending[self.ident] = kind
+        self.ident += 1
+        await self.ws.send(json.dumps(message))
+
+    # ask for everything again : the registries, to map entities to zha devices, and the full 'zha/devices' result
+    async def request_resync(self) :
+        self.full_downloads += 1
+        await self.send_command("device_registry", {"type" : "config/device_registry/list"})
+        await self.send_command("entity_registry", {"type" : "config/entity_registry/list"})
+        await self.send_command(DEVICES, {"type" : "zha/devices"})
+
+    async def subscriber(self, polls) :
+
+        loop = asyncio.get_running_loop()
+        cancelled = False
+
+        try :
+            while polls is None or self.polls_sent < polls :
+
+                if self.ws is None :
+                    try :
+                        self.ws = await ha_connect(self.ha_ip, self.access_token, self.ws_timeout)
+                        self.ident = 1
+                        self.pending = {}
+                        for event_type in SUBSCRIBE_EVENT_TYPES :
+                            await self.send_command("subscribe", {"type" : "subscribe_events", "event_type" : event_type})
+                        # always start over with a full download after a (re)connect, we may have missed events
+                        await self.request_resync()
+                        next_tick = loop.time() + self.check_interval
+                        next_resync = loop.time() + self.resync_interval
+                        last_message = loop.time()
+                    except Exception as e :
+                        self.logger.error("Error : " + self.name + " : Unable connect to web socket, retrying : " + traceback.format_exc())
+                        if self.ws is not None :
+                            await self.ws.close()
+                            self.ws = None
+                        await asyncio.sleep(self.check_interval * 5)
+                        continue
+
+                try :
+                    try :
+                        text = await asyncio.wait_for(self.ws.recv(), max(0, next_tick - loop.time()))
+                        last_message = loop.time()
+                        self.bytes_received += len(text)
+                        await self.decode_queue.put((MESSAGE, None, datetime.now().replace(microsecond=0), (self.pending, text)))
+                        continue
+                    except asyncio.TimeoutError :
+                        pass
+
+                    # nothing at all from HA, not even the answer to our pings, the web socket is hung
+                    if loop.time() - last_message > self.ws_timeout :
+                        raise ConnectionError("no message from Home Assistant in " + str(self.ws_timeout) + " seconds")
+
+                    # time to write / display the current device data
+                    self.polls_sent += 1
+                    await self.decode_queue.put((TICK, time.perf_counter(), datetime.now().replace(microsecond=0), None))
+                    next_tick = max(next_tick + self.check_interval, loop.time())
+
+                    if loop.time() >= next_resync :
+                        await self.request_resync()
+                        next_resync = loop.time() + self.resync_interval
+                    else :
+                        await self.send_command("ping", {"type" : "ping"})
+
+                except Exception as e :
+                    self.logger.error("Error : " + self.name + " : Web socket subscription failed : " + traceback.format_exc())
+                    await self.ws.close()
+                    self.ws = None
+                    # pause, then reconnect to Home Assistant Web Socket interface
+                    await asyncio.sleep(self.check_interval * 5)
+
+        except asyncio.CancelledError :
+            cancelled = True
+            raise
+        finally :
+            if self.ws is not None :
+                await self.ws.close()
+                self.ws = None
+            await self.end_of_polls(cancelled)
+
+    # the source is done, tell the decoder, when cancelled the decoder is being cancelled too and may never take
+    # from a full queue, so the oldest waiting result makes room
+    async def end_of_polls(self, cancelled) :
+        if cancelled :
+            put_drop_oldest(self.decode_queue, END_OF_POLLS)
+        else :
+            await self.decode_queue.put(END_OF_POLLS)
+
+    # ---- json decoding and processing ----
+
+    def decode(self, retrieve_time, result) :
+
+        # convert the string that came back into device records, see zha_decode.py, streamed the devices are
+        # decoded as the processor reads them
+        if self.stream_decode :
+            ident, success, devices = stream_devices(result)
+        else :
+            ident, success, devices = decode_devices(result)
+
+        # if we did not get a success result back from service call, log the face and do not process results, cause there are none
+        if not success :
+            self.logger.error("Error : " + self.name + " : Did not receive a success indicator from web socket call : " + result[:1000])
+            return None
+
+        # we decrement by 1 to align with json entities starting at zero, but our first web socket call for real data starts at 1
+        snapshot = self.processor.process(int(ident) - 1, retrieve_time, devices)
+        if self.keep_raw :
+            snapshot.raw = result
+        return snapshot
+
+    # subscribe mode : apply one message from HA, returns (action, ieee) if we need to ask HA for more
+    # pending : the outstanding requests of the web socket the message came in on
+    def decode_message(self, pending, result) :
+
+        message = loads(result)
+
+        if message.get("type") == "event" :
+            return self.tracker.handle_event(message.get("event", {}))
+
+        # the answer to a request, a 'result', or the 'pong' of a ping
+        kind = pending.pop(message.get("id"), None)
+        if message.get("type") != "result" :
+            return None
+
+        if message.get("success") != True :
+            self.logger.error("Error : " + self.name + " : Did not receive a success indicator from web socket call : " + result[:1000])
+            return None
+
+        if kind == DEVICES :
+            self.tracker.load_devices(message["result"])
+            if self.keep_raw :
+                self.raw_full = result
+        elif kind == REFRESH_DEVICE :
+            self.tracker.load_device(message["result"])
+        elif kind == "device_registry" :
+            self.tracker.load_device_registry(message["result"])
+        elif kind == "entity_registry" :
+            self.tracker.load_entity_registry(message["result"])
+        return None
+
+    # subscribe mode : build a snapshot from the device data we have now
+    def decode_tick(self, retrieve_time) :
+        if not self.tracker.devices :
+            return None
+        self.packet += 1
+        snapshot = self.processor.process(self.packet, retrieve_time, self.tracker.device_list())
+        # the raw json archive keeps the full downloads
+        snapshot.raw, self.raw_full = self.raw_full, None
+        return snapshot
+
+    # run one piece of decode work, and count the cpu time it took
+    def timed(self, function, *args) :
+        start = time.thread_time()
+        try :
+            return function(*args)
+        finally :
+            self.decode_cpu_seconds += time.thread_time() - start
+
+    async def decoder(self) :
+
+        loop = asyncio.get_running_loop()
+        executor = self.collector.decode_executor
+        try :
+            while True :
+                item = await self.decode_queue.get()
+                self.decode_queue.task_done()
+                if item is END_OF_POLLS :
+                    break
+                kind, sent, retrieve_time, result = item
+                try :
+                    if kind == DEVICES :
+                        snapshot = await loop.run_in_executor(executor, self.timed, self.decode, retrieve_time, result)
+                    elif kind == TICK :
+                        snapshot = await loop.run_in_executor(executor, self.timed, self.decode_tick, retrieve_time)
+                    else :
+                        snapshot = None
+                        action = await loop.run_in_executor(executor, self.timed, self.decode_message, *result)
+                        if action is not None and action[0] == REFRESH_DEVICE :
+                            await self.send_command(REFRESH_DEVICE, {"type" : "zha/device", "ieee" : action[1]})
+                        elif action is not None and action[0] == RESYNC :
+                            await self.request_resync()
+                except Exception as e :
+                    self.logger.error("Error : " + self.name + " : Unable to process web socket result : " + traceback.format_exc())
+                    continue
+                if snapshot is None :
+                    continue
+
+                snapshot.site = self.name
+                await self.collector.queue_snapshot(self, sent, snapshot)
+        finally :
+            await self.collector.site_finished()
+
+    def source(self, polls) :
+        if self.ingest_mode == INGEST_SUBSCRIBE :
+            return self.subscriber(polls)
+        return self.poller(polls)
+
+
+class ZhaCollector :
+
+    # persist_queue_size, overflow, spill_file : the database writer queue, see zha_writer.py
+    # archive : zha_archive.RawArchive for the raw json of the sites that keep it, closed when run() ends
+    def __init__(self, store, console=None, persist_queue_size=1000, overflow=OVERFLOW_BLOCK, spill_file=None, \
+        render_queue_size=2, logger=None, archive=None) :
+
+        self.store = store
+        # None for no console display
+        self.console = console
+        self.logger = logger if logger is not None else logging.getLogger("zha_collector")
+        self.sites = []
+
+        self.archive = archive
+        self.writer = ZhaWriter(store, queue_size=persist_queue_size, overflow=overflow, spill_file=spill_file, logger=self.logger, \
+            archive=archive)
+        self.render_queue = asyncio.Queue(maxsize=render_queue_size)
+
+        # one thread each, so each step keeps its own order
+        self.decode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="zha_decode")
+        self.render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="zha_render")
+
+        # number of sites still sending results down the queues
+        self.sites_running = 0
+
+    # statistics of the database writer, for the log and the benchmarks
+    @property
+    def polls_persisted(self) :
+        return self.writer.polls_written
+
+    # seconds from sending the 'zha/devices' call to the results being committed to the database
+    @property
+    def persist_latency(self) :
+        return self.writer.persist_latency
+
+    # add a Home Assistant instance to collect from, see ZhaSite for the settings
+    def add_site(self, name, ha_ip, access_token, **settings) :
+        site = ZhaSite(self, name, ha_ip, access_token, **settings)
+        self.sites.append(site)
+        return site
+
+    # hand the result of one web socket call to the database and the console
+    # the writer queue only makes the collector wait if it is full and the overflow policy is 'block',
+    # and then on a thread of its own, so the other sites keep going
+    async def queue_snapshot(self, site, sent, snapshot) :
+        if self.writer.would_block() :
+            await asyncio.get_running_loop().run_in_executor(None, self.writer.put, sent, snapshot)
+        else :
+            self.writer.put(sent, snapshot)
+        if self.console is not None :
+            put_drop_oldest(self.render_queue, snapshot)
+
+    # a site's decoder is done, once all are done let the renderer finish up, the writer finishes when run() ends
+    async def site_finished(self) :
+        self.sites_running -= 1
+        if self.sites_running == 0 :
+            # the renderer may be cancelled with a full queue, it only ever drops display lines
+            put_drop_oldest(self.render_queue, END_OF_POLLS)
+
+    # ---- console ----
+
+    async def renderer(self) :
+
+        loop = asyncio.get_running_loop()
+        while True :
+            snapshot = await self.render_queue.get()
+            self.render_queue.task_done()
+            if snapshot is END_OF_POLLS :
+                break
+            try :
+                await loop.run_in_executor(self.render_executor, render_snapshot, self.console, snapshot)
+            except Exception as e :
+                self.logger.error("Error : Unable to display web socket result : " + traceback.format_exc())
+
+    # ---- run ----
+
+    # run until cancelled, or until each site has made 'polls' web socket calls and all their results are written
+    async def run(self, polls=None) :
+
+        loop = asyncio.get_running_loop()
+
+        self.writer.start()
+        self.sites_running = len(self.sites)
+        tasks = [asyncio.create_task(self.renderer())]
+        for site in self.sites :
+            tasks.append(asyncio.create_task(site.source(polls)))
+            tasks.append(asyncio.create_task(site.decoder()))
+        try :
+            await asyncio.gather(*tasks)
+        finally :
+            for task in tasks :
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # write whatever is still queued, then close the raw json archive
+            await loop.run_in_executor(None, self.writer.close)
+            if self.archive is not None :
+                await loop.run_in_executor(None, self.archive.close)
+            for executor in (self.decode_executor, self.render_executor) :
+                executor.shutdown(wait=True)
+
+
+# EOF
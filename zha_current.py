@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+# zha_current.py
+
+# 202610181930
+#
+# the mesh as it is right now, 'current_tables : True' in zha_ws.yaml
+# the zha table only grows, the newest web socket call is found with max(packet) and a filter on it, which gets
+# slower as the history grows, these tables hold only the last call of each site, so reading them costs the same
+# whatever the size of the history
+#
+#  zha_current    : one row per link (site, neighbor_address, peer_address) of the last web socket call
+#  device_current : one row per device (site, device_address) of the last web socket call
+#  current_poll   : one row per site, packet and retrieve_ts of the last web socket call
+#
+# a row is only written when its values change, INSERT ... ON CONFLICT DO UPDATE ... WHERE the values differ,
+# and the values last written are kept in memory so the rows that did not change are not even sent to sqlite,
+# changed_ts is when the values of the row last changed, first_seen_ts when it first showed up
+# links and devices that are not in the newest web socket call of their site are deleted
+#
+#  python3 zha_current.py zha_ws.db              # the links right now
+#  python3 zha_current.py zha_ws.db --devices    # the devices right now
+
+import sqlite3
+import argparse
+
+from zha_store import sql_value
+
+
+LINK_VALUES = ("neighbor_lqi", "neighbor_rssi", "neighbor_device_type", "neighbor_available", "neighbor_depth", \
+    "neighbor_relationship", "peer_nwk", "peer_lqi", "peer_rssi", "peer_available")
+DEVICE_VALUES = ("user_given_name", "device_type", "nwk", "lqi", "rssi", "available", "is_neighbor", "last_seen")
+
+ZHA_CURRENT_TABLE = "CREATE TABLE IF NOT EXISTS zha_current (site text not null, neighbor_address text not null, peer_address text not null, " \
+    "neighbor_lqi int, neighbor_rssi int, neighbor_device_type text, neighbor_available text, neighbor_depth int, neighbor_relationship text, " \
+    "peer_nwk int, peer_lqi int, peer_rssi int, peer_available text, first_seen_ts integer, changed_ts integer, " \
+    "PRIMARY KEY (site, neighbor_address, peer_address)) WITHOUT ROWID"
+DEVICE_CURRENT_TABLE = "CREATE TABLE IF NOT EXISTS device_current (site text not null, device_address text not null, " \
+    "user_given_name text, device_type text, nwk int, lqi int, rssi int, available text, is_neighbor text, last_seen integer, " \
+    "first_seen_ts integer, changed_ts integer, PRIMARY KEY (site, device_address)) WITHOUT ROWID"
+CURRENT_POLL_TABLE = "CREATE TABLE IF NOT EXISTS current_poll (site text primary key, packet integer, retrieve_ts integer, links integer, devices integer)"
+
+
+# insert a row, or update it only when one of the values is different, the row is left alone, not even
+# rewritten with the same values, when nothing changed
+def upsert_sql(table, keys, values) :
+    columns = keys + values
+    return "insert into " + table + " (" + ", ".join(columns) + ", first_seen_ts, changed_ts) values (" + \
+        ", ".join(["?"] * len(columns)) + ", ?, ?) on conflict (" + ", ".join(keys) + ") do update set " + \
+        ", ".join(value + " = excluded." + value for value in values) + ", changed_ts = excluded.changed_ts" + \
+        " where (" + ", ".join(values) + ") is not (" + ", ".join("excluded." + value for value in values) + ")"
+
+
+LINK_KEYS = ("site", "neighbor_address", "peer_address")
+DEVICE_KEYS = ("site", "device_address")
+ZHA_CURRENT_UPSERT = upsert_sql("zha_current", LINK_KEYS, LINK_VALUES)
+DEVICE_CURRENT_UPSERT = upsert_sql("device_current", DEVICE_KEYS, DEVICE_VALUES)
+CURRENT_POLL_UPSERT = "insert or replace into current_poll values (?, ?, ?, ?, ?)"
+
+# the int columns, sqlite stores a text value of an int column that is a number as an integer, and the values
+# compared with the ones in the table have to be stored the same way, or the depth "1" is never equal to 1
+INT_COLUMNS = ("neighbor_lqi", "neighbor_rssi", "neighbor_depth", "peer_nwk", "peer_lqi", "peer_rssi", "nwk", "lqi", "rssi")
+
+
+def column_value(column, value) :
+    value = sql_value(value)
+    if column in INT_COLUMNS and isinstance(value, str) and value.lstrip("-").isdigit() :
+        return int(value)
+    return value
+
+
+class ZhaCurrent :
+
+    def __init__(self) :
+        # site -> {(neighbor_address, peer_address) : values} and {device_address : values} as they are in the tables
+        # a site is read from the tables the first time it is seen, so a restart does not rewrite every row
+        self.links = {}
+        self.devices = {}
+        # statistics
+        self.rows_changed = 0
+        self.rows_deleted = 0
+
+    def create_tables(self, sql_cursor) :
+        sql_cursor.execute(ZHA_CURRENT_TABLE)
+        sql_cursor.execute(DEVICE_CURRENT_TABLE)
+        sql_cursor.execute(CURRENT_POLL_TABLE)
+
+    def load(self, sql_conn, site) :
+        self.links[site] = dict(((row[0], row[1]), tuple(row[2 :])) for row in sql_conn.execute( \
+            "select neighbor_address, peer_address, " + ", ".join(LINK_VALUES) + " from zha_current where site = ?", (site,)))
+        self.devices[site] = dict((row[0], tuple(row[1 :])) for row in sql_conn.execute( \
+            "select device_address, " + ", ".join(DEVICE_VALUES) + " from device_current where site = ?", (site,)))
+
+    def add_snapshot(self, sql_conn, snapshot) :
+        site = snapshot.site or ""
+        if site not in self.links :
+            self.load(sql_conn, site)
+        changed_ts = sql_value(snapshot.retrieve_time)
+
+        links = dict(((link.neighbor_address, link.peer_address), tuple(column_value(value, getattr(link, value)) for value in LINK_VALUES)) \
+            for link in snapshot.links)
+        self.update(sql_conn, "zha_current", LINK_KEYS, ZHA_CURRENT_UPSERT, self.links[site], links, site, changed_ts)
+
+        devices = dict((str(device_address), tuple(column_value(value, getattr(device, value)) for value in DEVICE_VALUES)) \
+            for device_address, device in snapshot.devices.items())
+        self.update(sql_conn, "device_current", DEVICE_KEYS, DEVICE_CURRENT_UPSERT, self.devices[site], devices, site, changed_ts)
+
+        sql_conn.execute(CURRENT_POLL_UPSERT, (site, snapshot.packet, changed_ts, len(links), len(devices)))
+
+    # make the rows of one table in the database, and 'current' in memory, the same as 'new'
+    def update(self, sql_conn, table, keys, upsert, current, new, site, changed_ts) :
+        changed = [key for key, values in new.items() if current.get(key) != values]
+        gone = [key for key in current if key not in new]
+        if changed :
+            sql_conn.executemany(upsert, [(site,) + (key if isinstance(key, tuple) else (key,)) + new[key] + (changed_ts, changed_ts) \
+                for key in changed])
+        if gone :
+            sql_conn.executemany("delete from " + table + " where " + " and ".join(key + " = ?" for key in keys), \
+                [(site,) + (key if isinstance(key, tuple) else (key,)) for key in gone])
+        for key in changed :
+            current[key] = new[key]
+        for key in gone :
+            del current[key]
+        self.rows_changed += len(changed)
+        self.rows_deleted += len(gone)
+
+    def close(self, sql_conn) :
+        pass
+
+
+# ---- reports ----
+
+def current_links(sql_conn, site=None) :
+    sql = "select * from zha_current"
+    if site is not None :
+        return sql_conn.execute(sql + " where site = ? order by neighbor_address, peer_address", (site,)).fetchall()
+    return sql_conn.execute(sql + " order by site, neighbor_address, peer_address").fetchall()
+
+
+def current_devices(sql_conn, site=None) :
+    sql = "select * from device_current"
+    if site is not None :
+        return sql_conn.execute(sql + " where site = ? order by device_address", (site,)).fetchall()
+    return sql_conn.execute(sql + " order by site, device_address").fetchall()
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="the zha mesh as of the last web socket call")
+    parser.add_argument("database", help="zha_ws.py database")
+    parser.add_argument("--devices", action="store_true", help="the devices instead of the links")
+    parser.add_argument("--site", default=None, help="only this site")
+    args = parser.parse_args()
+
+    sql_conn = sqlite3.connect(args.database)
+    for row in sql_conn.execute("select * from current_poll") :
+        print("site " + str(row[0]) + " packet " + str(row[1]) + " at " + str(row[2]) + " : " + str(row[3]) + " links " + str(row[4]) + " devices")
+    for row in (current_devices if args.devices else current_links)(sql_conn, args.site) :
+        print(row)
+    sql_conn.close()
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
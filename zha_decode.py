@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+# zha_decode.py
+
+# 202610190030
+# the IEEE addresses are interned
+# 202610190000
+# stream_devices(), the 'result' array read device by device without the json tree of the whole frame
+# 202610182345
+#
+# decode a 'zha/devices' web socket frame into compact device and neighbor records that hold only what
+# zha_process.ZhaProcessor, the display and the stores use, typed once here, instead of the full json tree with
+# the signatures, endpoints and quirk info of every device kept around for the whole of the processing
+#
+# the frame is parsed with orjson when it is installed, it takes bytes or str and is several times faster than
+# the json module, which is used when it is not, each device dict is turned into a Device right away and the
+# json tree is let go as soon as the records are built
+#
+#  lqi / rssi     int, 0 when ZHA has None
+#  last_seen      datetime
+#  available      bool
+#  neighbor lqi   int, ZHA sends it as a string
+#  neighbor depth int, ditto
+#  ieee           interned, the same str object for a device in every record, link row and snapshot, and every call
+#
+# the processor takes lists of json dicts as well, from the event tracker, the backfill and the migration,
+# and turns them into records with device_records()
+#
+# stream_devices() does not build the json tree of the frame at all, it reads the 'result' array one device at
+# a time with the json module's scanner, makes the Device and lets that device's dicts go before it reads the
+# next, so on a mesh of thousands of devices the memory of a call is the frame and the compact records, not the
+# frame, the tree and the records, orjson has no way to read part of a document, the streamed parse always
+# uses the json module
+
+import re
+import json
+from sys import intern
+
+try :
+    import orjson
+except ImportError :
+    orjson = None
+
+from datetime import datetime
+
+
+# one entry of the neighbor table of a device
+class Neighbor :
+
+    __slots__ = ("ieee", "device_type", "relationship", "depth", "lqi")
+
+    def __init__(self, ieee, device_type, relationship, depth, lqi) :
+        self.ieee = ieee
+        self.device_type = device_type
+        self.relationship = relationship
+        self.depth = depth
+        self.lqi = lqi
+
+    def __repr__(self) :
+        return "Neighbor(%s %s %s depth %s lqi %s)" % (self.ieee, self.device_type, self.relationship, self.depth, self.lqi)
+
+
+# one device of the 'zha/devices' result
+class Device :
+
+    __slots__ = ("ieee", "nwk", "user_given_name", "device_type", "lqi", "rssi", "last_seen", "available", \
+        "manufacturer", "model", "power_source", "neighbors")
+
+    def __init__(self, ieee, nwk, user_given_name, device_type, lqi, rssi, last_seen, available, \
+        manufacturer=None, model=None, power_source=None, neighbors=None) :
+        self.ieee = ieee
+        self.nwk = nwk
+        self.user_given_name = user_given_name
+        self.device_type = device_type
+        self.lqi = lqi
+        self.rssi = rssi
+        self.last_seen = last_seen
+        self.available = available
+        self.manufacturer = manufacturer
+        self.model = model
+        self.power_source = power_source
+        # list of Neighbor
+        self.neighbors = neighbors if neighbors is not None else []
+
+    def __repr__(self) :
+        return "Device(%s %s %r, %d neighbors)" % (self.ieee, self.device_type, self.user_given_name, len(self.neighbors))
+
+
+# ZHA sends None for a device it has no lqi / rssi for, the processing has always taken that as 0
+def to_int(value) :
+    return 0 if value is None or value == "None" else int(value)
+
+
+def neighbor_record(neighbor) :
+    return Neighbor(intern(neighbor["ieee"]), neighbor["device_type"], neighbor["relationship"], int(neighbor["depth"]), int(neighbor["lqi"]))
+
+
+# the Device of one json device dict, last_seen is always '%Y-%m-%dT%H:%M:%S', fromisoformat() reads that
+# several times faster than strptime()
+def device_record(device) :
+    return Device(intern(device["ieee"]), \
+        device["nwk"], \
+        device["user_given_name"], \
+        device["device_type"], \
+        to_int(device["lqi"]), \
+        to_int(device["rssi"]), \
+        datetime.fromisoformat(device["last_seen"]), \
+        bool(device["available"]), \
+        device.get("manufacturer"), \
+        device.get("model"), \
+        device.get("power_source"), \
+        [neighbor_record(neighbor) for neighbor in device.get("neighbors", ())])
+
+
+# the records of a 'zha/devices' result, json dicts are converted, records are passed through
+def device_records(devices) :
+    return [device if isinstance(device, Device) else device_record(device) for device in devices]
+
+
+# parse a web socket frame, str or bytes
+def loads(frame) :
+    if orjson is not None :
+        return orjson.loads(frame)
+    return json.loads(frame)
+
+
+# decode the frame of a 'zha/devices' call
+# returns (message id, success, list of Device), the list is None when the call did not succeed
+def decode_devices(frame) :
+    message = loads(frame)
+    success = message.get("success") == True
+    devices = device_records(message["result"]) if success else None
+    return message.get("id"), success, devices
+
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DECODER = json.JSONDecoder()
+
+
+# the fields of a web socket frame read in order, the 'result' array is not read into memory but handed out one
+# Device at a time by iterating over the stream, which can only be done once
+class DeviceStream :
+
+    def __init__(self, frame) :
+        if isinstance(frame, (bytes, bytearray, memoryview)) :
+            frame = bytes(frame).decode("utf-8")
+        self.frame = frame
+        # the fields other than 'result', as far as they have been read
+        self.message = {}
+        # True while the read position is inside the 'result' array
+        self.in_result = False
+        self.position = WHITESPACE.match(frame, 0).end()
+        if frame[self.position : self.position + 1] != "{" :
+            raise ValueError("web socket frame is not a json object")
+        self.position += 1
+        self.read_fields()
+
+    # read fields up to the start of the 'result' array, or to the end of the frame
+    def read_fields(self) :
+        frame = self.frame
+        position = self.position
+        while True :
+            position = WHITESPACE.match(frame, position).end()
+            char = frame[position : position + 1]
+            if char == "," :
+                position += 1
+                continue
+            if char == "}" :
+                self.position = position + 1
+                return
+            key, position = DECODER.raw_decode(frame, position)
+            position = WHITESPACE.match(frame, position).end()
+            if frame[position : position + 1] != ":" :
+                raise ValueError("expected ':' at " + str(position) + " of the web socket frame")
+            position = WHITESPACE.match(frame, position + 1).end()
+            if key == "result" and frame[position : position + 1] == "[" :
+                self.position = position + 1
+                self.in_result = True
+                return
+            self.message[key], position = DECODER.raw_decode(frame, position)
+
+    def __iter__(self) :
+        frame = self.frame
+        position = self.position
+        while self.in_result :
+            position = WHITESPACE.match(frame, position).end()
+            char = frame[position : position + 1]
+            if char == "," :
+                position += 1
+            elif char == "]" :
+                self.in_result = False
+                position += 1
+            elif char == "" :
+                raise ValueError("web socket frame ends inside the result")
+            else :
+                device, position = DECODER.raw_decode(frame, position)
+                self.position = position
+                yield device_record(device)
+        self.position = position
+        self.read_fields()
+
+
+# the streamed decode of the frame of a 'zha/devices' call, as decode_devices() but the devices are an iterator
+# of Device, to be read once, by ZhaProcessor.process()
+# HA sends id, type and success before the result, in the odd frame that does not the devices are read first
+def stream_devices(frame) :
+    stream = DeviceStream(frame)
+    devices = stream
+    if stream.in_result and "success" not in stream.message :
+        devices = list(stream)
+    success = stream.message.get("success") == True
+    return stream.message.get("id"), success, devices if success else None
+
+
+# EOF
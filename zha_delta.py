@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+# zha_delta.py
+
+# 202610181730
+#
+# change only storage of the zha neighbor 'link' history, 'schema : "delta"' in zha_ws.yaml
+# a link (neighbor, peer) gets a new row only when one of its values changes : lqi, rssi, availability,
+# relationship, depth (and the rarely changing device type and peer nwk), otherwise the row it already has is
+# still valid, most links keep the same values for minutes, so this is a fraction of the rows of the zha table
+#
+#  link_poll     : one row per web socket call, poll_id, site_id, packet, retrieve_ts
+#  link_interval : the values of a link and the web socket calls they were valid for, first_poll_id .. last_poll_id,
+#                  first_seen_ts .. last_confirmed_ts (unix epoch), last_poll_id / last_confirmed_ts are null while
+#                  the values are still current
+#
+# the site, device, device_type and relationship tables are the ones of zha_normalized.py
+# the full resolution history, one row per link per web socket call like the zha table, is the join of the two,
+# see reconstruct(), or the zha_delta_view view
+# neighbor_delta_last_seen and neighbor_last_seen_ts change on every call and are not kept in this schema
+
+from datetime import datetime
+
+from zha_normalized import NormalizedZhaStore, COLUMN, AVAILABLE_CODES, to_int, to_epoch
+
+
+LINK_POLL_TABLE = "CREATE TABLE IF NOT EXISTS link_poll (poll_id integer primary key, site_id integer, packet integer, retrieve_ts integer)"
+LINK_INTERVAL_TABLE = "CREATE TABLE IF NOT EXISTS link_interval (interval_id integer primary key, site_id integer, neighbor_id integer, peer_id integer, neighbor_lqi integer, neighbor_rssi integer, neighbor_device_type_id integer, neighbor_available integer, neighbor_depth integer, neighbor_relationship_id integer, peer_nwk integer, peer_lqi integer, peer_rssi integer, peer_available integer, first_poll_id integer, last_poll_id integer, first_seen_ts integer, last_confirmed_ts integer)"
+LINK_POLL_INDEX = "CREATE INDEX IF NOT EXISTS link_poll_site_ts ON link_poll (site_id, retrieve_ts)"
+LINK_INTERVAL_INDEX = "CREATE INDEX IF NOT EXISTS link_interval_first_poll ON link_interval (first_poll_id)"
+LINK_INTERVAL_PAIR_INDEX = "CREATE INDEX IF NOT EXISTS link_interval_pair ON link_interval (neighbor_id, peer_id, first_poll_id)"
+
+# largest poll_id, for intervals that are still open
+OPEN_POLL_ID = 9223372036854775807
+
+# the columns of link_interval that hold the values of a link, in order
+VALUE_COLUMNS = ("neighbor_lqi", "neighbor_rssi", "neighbor_device_type_id", "neighbor_available", "neighbor_depth", \
+    "neighbor_relationship_id", "peer_nwk", "peer_lqi", "peer_rssi", "peer_available")
+
+INTERVAL_INSERT = "insert into link_interval (site_id, neighbor_id, peer_id, " + ", ".join(VALUE_COLUMNS) + \
+    ", first_poll_id, first_seen_ts) values (" + ", ".join(["?"] * (len(VALUE_COLUMNS) + 5)) + ")"
+
+# the rows of the zha table, rebuilt from the intervals, one per link per web socket call
+RECONSTRUCT_SELECT = """SELECT link_poll.packet, link_poll.retrieve_ts, neighbor.ieee, link_interval.neighbor_lqi, link_interval.neighbor_rssi,
+ device_type.name, link_interval.neighbor_available, link_interval.neighbor_depth, relationship.name, link_interval.peer_nwk,
+ link_interval.peer_lqi, link_interval.peer_rssi, link_interval.peer_available, peer.ieee, site.name
+ FROM link_poll
+ JOIN link_interval ON link_interval.site_id IS link_poll.site_id
+  AND link_poll.poll_id BETWEEN link_interval.first_poll_id AND coalesce(link_interval.last_poll_id, """ + str(OPEN_POLL_ID) + """)
+ LEFT JOIN device AS neighbor ON neighbor.device_id = link_interval.neighbor_id
+ LEFT JOIN device AS peer ON peer.device_id = link_interval.peer_id
+ LEFT JOIN device_type ON device_type.device_type_id = link_interval.neighbor_device_type_id
+ LEFT JOIN relationship ON relationship.relationship_id = link_interval.neighbor_relationship_id
+ LEFT JOIN site ON site.site_id = link_poll.site_id"""
+
+DELTA_VIEW = """CREATE VIEW IF NOT EXISTS zha_delta_view AS SELECT link_poll.packet,
+ datetime(link_poll.retrieve_ts, 'unixepoch', 'localtime') AS retrieve_ts, neighbor.ieee AS neighbor_address,
+ link_interval.neighbor_lqi, link_interval.neighbor_rssi, device_type.name AS neighbor_device_type,
+ CASE link_interval.neighbor_available WHEN 1 THEN 'true' WHEN 0 THEN 'false' ELSE 'unk' END AS neighbor_available,
+ link_interval.neighbor_depth, relationship.name AS neighbor_relationship, link_interval.peer_nwk,
+ link_interval.peer_lqi, link_interval.peer_rssi,
+ CASE link_interval.peer_available WHEN 1 THEN 'true' WHEN 0 THEN 'false' ELSE 'unk' END AS peer_available,
+ peer.ieee AS peer_address, site.name AS site
+""" + RECONSTRUCT_SELECT[RECONSTRUCT_SELECT.index(" FROM link_poll") :]
+
+# what reconstruct() gives back for each row
+RECONSTRUCT_COLUMNS = ("packet", "retrieve_ts", "neighbor_address", "neighbor_lqi", "neighbor_rssi", "neighbor_device_type", \
+    "neighbor_available", "neighbor_depth", "neighbor_relationship", "peer_nwk", "peer_lqi", "peer_rssi", "peer_available", \
+    "peer_address", "site")
+
+
+class DeltaZhaStore(NormalizedZhaStore) :
+
+    def __init__(self, database_file, **settings) :
+        super().__init__(database_file, **settings)
+        # site_id -> {(neighbor_id, peer_id) : (interval_id, values)} of the intervals that are still open
+        self.open_intervals = {}
+        # site_id -> (poll_id, retrieve_ts) of the last web socket call written
+        self.last_poll = {}
+        # statistics, links written as a new interval, and links that matched their open interval
+        self.intervals_written = 0
+        self.links_confirmed = 0
+
+    def create_tables(self, sql_cursor) :
+        super().create_tables(sql_cursor)
+        for table in (LINK_POLL_TABLE, LINK_INTERVAL_TABLE, LINK_POLL_INDEX, LINK_INTERVAL_INDEX, LINK_INTERVAL_PAIR_INDEX, DELTA_VIEW) :
+            sql_cursor.execute(table)
+        # intervals left open by the last run end at the last call of their site that was written, calls after a
+        # restart start new intervals, so the time the program was not running is not part of any interval
+        sql_cursor.execute("""update link_interval set
+            last_poll_id = (select max(poll_id) from link_poll where link_poll.site_id IS link_interval.site_id),
+            last_confirmed_ts = (select max(retrieve_ts) from link_poll where link_poll.site_id IS link_interval.site_id)
+            where last_poll_id is null""")
+
+    # the values of a link that start a new interval when they change
+    def interval_values(self, link) :
+        return (to_int(link[COLUMN["neighbor_lqi"]]), \
+            to_int(link[COLUMN["neighbor_rssi"]]), \
+            self.lookup(self.device_type_ids, "device_type", link[COLUMN["neighbor_device_type"]]), \
+            AVAILABLE_CODES.get(link[COLUMN["neighbor_available"]]), \
+            to_int(link[COLUMN["neighbor_depth"]]), \
+            self.lookup(self.relationship_ids, "relationship", link[COLUMN["neighbor_relationship"]]), \
+            to_int(link[COLUMN["peer_nwk"]]), \
+            to_int(link[COLUMN["peer_lqi"]]), \
+            to_int(link[COLUMN["peer_rssi"]]), \
+            AVAILABLE_CODES.get(link[COLUMN["peer_available"]]))
+
+    def insert_links(self, snapshot) :
+
+        sql_conn = self.sql_conn
+        site_id = self.lookup(self.site_ids, "site", snapshot.site)
+        retrieve_ts = to_epoch(snapshot.retrieve_time)
+        poll_id = sql_conn.execute("insert into link_poll (site_id, packet, retrieve_ts) values (?, ?, ?)", \
+            (site_id, snapshot.packet, retrieve_ts)).lastrowid
+
+        # the current values of each link, a link listed twice keeps its last values
+        current = {}
+        for link in snapshot.links :
+            key = (self.device_id(link.neighbor_address, link.neighbor_given_name), self.device_id(link.peer_address, link.peer_given_name))
+            current[key] = self.interval_values(link)
+
+        open_intervals = self.open_intervals.setdefault(site_id, {})
+        last_poll_id, last_ts = self.last_poll.get(site_id, (None, None))
+
+        # intervals that end with the previous call, the link changed or is gone
+        closed = [interval_id for key, (interval_id, values) in open_intervals.items() if current.get(key) != values]
+        sql_conn.executemany("update link_interval set last_poll_id = ?, last_confirmed_ts = ? where interval_id = ?", \
+            [(last_poll_id, last_ts, interval_id) for interval_id in closed])
+
+        for key, values in current.items() :
+            interval = open_intervals.get(key)
+            if interval is not None and interval[1] == values :
+                self.links_confirmed += 1
+                continue
+            interval_id = sql_conn.execute(INTERVAL_INSERT, (site_id,) + key + values + (poll_id, retrieve_ts)).lastrowid
+            open_intervals[key] = (interval_id, values)
+            self.intervals_written += 1
+        for key in [key for key in open_intervals if key not in current] :
+            del open_intervals[key]
+
+        self.last_poll[site_id] = (poll_id, retrieve_ts)
+        return len(snapshot.links)
+
+
+# the full resolution history from the intervals, the rows the zha table would have had, in the order of
+# RECONSTRUCT_COLUMNS, with retrieve_ts as a local time datetime
+# site, start, end (datetimes), neighbor_address, peer_address, poll_id : only the rows that match, None for all
+# first_poll_id, last_poll_id : only the web socket calls in this range of link_poll ids
+def reconstruct(sql_conn, site=None, start=None, end=None, neighbor_address=None, peer_address=None, poll_id=None, \
+    first_poll_id=None, last_poll_id=None) :
+
+    where = []
+    parameters = []
+    if poll_id is not None :
+        where.append("link_poll.poll_id = ?")
+        parameters.append(poll_id)
+    if first_poll_id is not None :
+        where.append("link_poll.poll_id >= ?")
+        parameters.append(first_poll_id)
+    if last_poll_id is not None :
+        where.append("link_poll.poll_id <= ?")
+        parameters.append(last_poll_id)
+    if site is not None :
+        where.append("site.name = ?")
+        parameters.append(site)
+    if start is not None :
+        where.append("link_poll.retrieve_ts >= ?")
+        parameters.append(to_epoch(start))
+    if end is not None :
+        where.append("link_poll.retrieve_ts <= ?")
+        parameters.append(to_epoch(end))
+    if neighbor_address is not None :
+        where.append("neighbor.ieee = ?")
+        parameters.append(neighbor_address)
+    if peer_address is not None :
+        where.append("peer.ieee = ?")
+        parameters.append(peer_address)
+
+    sql = RECONSTRUCT_SELECT + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY link_poll.poll_id, link_interval.interval_id"
+    for row in sql_conn.execute(sql, parameters) :
+        yield (row[0], datetime.fromtimestamp(row[1])) + tuple(row[2:])
+
+
+# the links of one site as they were at the web socket call at or before 'when'
+def snapshot_at(sql_conn, site, when) :
+    row = sql_conn.execute("select max(link_poll.poll_id) from link_poll join site on site.site_id = link_poll.site_id " \
+        "where site.name = ? and link_poll.retrieve_ts <= ?", (site, to_epoch(when))).fetchone()
+    if row is None or row[0] is None :
+        return []
+    return list(reconstruct(sql_conn, poll_id=row[0]))
+
+
+# EOF
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# zha_device_history.py
+
+# 202610182000
+#
+# history of the attributes of each device, 'device_history : True' in zha_ws.yaml
+# zha_device_name only has the name a device has now, a rename or a new nwk address loses the old value, here
+# each version of the attributes of a device is a row, valid from the web socket call it was first seen in, to
+# the call it changed in (a slowly changing dimension)
+#
+#  device_attribute :
+#   site, device_address
+#   user_given_name, nwk, device_type, manufacturer, model, power_source
+#   valid_from    retrieve_ts of the first web socket call with these values
+#   valid_to      retrieve_ts of the first call with other values, or without the device, null for the current version
+#
+# the current versions are kept in memory, a web socket call only writes the devices that really changed,
+# two statements per change, nothing at all for the rest
+#
+#  python3 zha_device_history.py zha_ws.db                                  # every version of every device
+#  python3 zha_device_history.py zha_ws.db 00:15:8d:00:01:02:03:04          # the versions of one device
+#  python3 zha_device_history.py zha_ws.db --at "2026-10-01 12:00:00"       # the devices as they were then
+
+import sqlite3
+import argparse
+
+from zha_store import sql_value
+
+
+ATTRIBUTES = ("user_given_name", "nwk", "device_type", "manufacturer", "model", "power_source")
+
+DEVICE_ATTRIBUTE_TABLE = "CREATE TABLE IF NOT EXISTS device_attribute (site text not null, device_address text not null, " \
+    "user_given_name text, nwk text, device_type text, manufacturer text, model text, power_source text, " \
+    "valid_from integer not null, valid_to integer, PRIMARY KEY (site, device_address, valid_from)) WITHOUT ROWID"
+# the current versions, at most one per device
+DEVICE_ATTRIBUTE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS device_attribute_current ON device_attribute (site, device_address) WHERE valid_to IS NULL"
+
+DEVICE_ATTRIBUTE_INSERT = "insert or replace into device_attribute values (?, ?, " + ", ".join(["?"] * len(ATTRIBUTES)) + ", ?, null)"
+DEVICE_ATTRIBUTE_CLOSE = "update device_attribute set valid_to = ? where site = ? and device_address = ? and valid_to is null"
+
+
+# the attributes are all kept as text, the nwk address is an int or a "0x1234" string depending on the HA version
+def attribute_values(device) :
+    return tuple(None if getattr(device, attribute) is None else str(getattr(device, attribute)) for attribute in ATTRIBUTES)
+
+
+class ZhaDeviceHistory :
+
+    def __init__(self) :
+        # site -> {device_address : attribute values} of the current versions, a site is read from the table the
+        # first time it is seen
+        self.current = {}
+        # statistics
+        self.versions_written = 0
+
+    def create_tables(self, sql_cursor) :
+        sql_cursor.execute(DEVICE_ATTRIBUTE_TABLE)
+        sql_cursor.execute(DEVICE_ATTRIBUTE_INDEX)
+
+    def load(self, sql_conn, site) :
+        self.current[site] = dict((row[0], tuple(row[1 :])) for row in sql_conn.execute( \
+            "select device_address, " + ", ".join(ATTRIBUTES) + " from device_attribute where site = ? and valid_to is null", (site,)))
+
+    def add_snapshot(self, sql_conn, snapshot) :
+        site = snapshot.site or ""
+        if site not in self.current :
+            self.load(sql_conn, site)
+        current = self.current[site]
+        retrieve_ts = sql_value(snapshot.retrieve_time)
+
+        devices = dict((str(device_address), attribute_values(device)) for device_address, device in snapshot.devices.items())
+        changed = [device_address for device_address, values in devices.items() if current.get(device_address) != values]
+        gone = [device_address for device_address in current if device_address not in devices]
+        if not changed and not gone :
+            return
+
+        # the old version ends where the new one starts
+        sql_conn.executemany(DEVICE_ATTRIBUTE_CLOSE, [(retrieve_ts, site, device_address) for device_address in changed + gone \
+            if device_address in current])
+        sql_conn.executemany(DEVICE_ATTRIBUTE_INSERT, [(site, device_address) + devices[device_address] + (retrieve_ts,) \
+            for device_address in changed])
+        for device_address in changed :
+            current[device_address] = devices[device_address]
+        for device_address in gone :
+            del current[device_address]
+        self.versions_written += len(changed)
+
+    def close(self, sql_conn) :
+        pass
+
+
+# ---- reports ----
+
+# every version of one device, oldest first
+def device_versions(sql_conn, device_address, site=None) :
+    sql = "select * from device_attribute where device_address = ?"
+    parameters = [device_address]
+    if site is not None :
+        sql += " and site = ?"
+        parameters.append(site)
+    return sql_conn.execute(sql + " order by site, valid_from", parameters).fetchall()
+
+
+# the version of every device that was valid at 'when', a datetime or 'YYYY-MM-DD HH:MM:SS'
+def devices_at(sql_conn, when, site=None) :
+    when = sql_value(when)
+    sql = "select * from device_attribute where valid_from <= ? and (valid_to is null or valid_to > ?)"
+    parameters = [when, when]
+    if site is not None :
+        sql += " and site = ?"
+        parameters.append(site)
+    return sql_conn.execute(sql + " order by site, device_address", parameters).fetchall()
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="versions of the attributes of the zha devices")
+    parser.add_argument("database", help="zha_ws.py database")
+    parser.add_argument("device", nargs="?", help="ieee address of one device")
+    parser.add_argument("--at", default=None, help="the devices as they were at 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("--site", default=None, help="only this site")
+    args = parser.parse_args()
+
+    sql_conn = sqlite3.connect(args.database)
+    if args.at :
+        rows = devices_at(sql_conn, args.at, args.site)
+    elif args.device :
+        rows = device_versions(sql_conn, args.device, args.site)
+    else :
+        rows = sql_conn.execute("select * from device_attribute order by site, device_address, valid_from").fetchall()
+    for row in rows :
+        print(row)
+    sql_conn.close()
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# zha_events.py
+
+# 202610181330
+#
+# keep the in memory zigbee device data current from Home Assistant events, instead of downloading the whole
+# 'zha/devices' result (every device and every neighbor table) on every call
+# https://developers.home-assistant.io/docs/api/websocket/#subscribe-to-events
+#
+# events we listen to :
+#  zha_event                 : a zigbee device sent a command, so it was just seen
+#  state_changed             : an entity changed state, for the entities that belong to a zha device this means the
+#                              device reported in, or went 'unavailable'
+#  device_registry_updated   : a device was renamed, added or removed, re read that device (or everything)
+#
+# neighbor tables are not part of any event, they only get refreshed by the slower full 'zha/devices' resync
+
+from datetime import datetime
+
+
+# the event types we subscribe to
+SUBSCRIBE_EVENT_TYPES = ("zha_event", "state_changed", "device_registry_updated")
+
+# what the collector should do after an event
+REFRESH_DEVICE = "refresh_device"
+RESYNC = "resync"
+
+
+# HA sends times as UTC iso strings, ZHA 'last_seen' is local time without a time zone, convert to match
+def ha_time_to_last_seen(ha_time) :
+    try :
+        when = datetime.fromisoformat(ha_time)
+    except (TypeError, ValueError) :
+        when = datetime.now()
+    if when.tzinfo is not None :
+        when = when.astimezone().replace(tzinfo=None)
+    return when.replace(microsecond=0).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class ZhaEventTracker :
+
+    def __init__(self) :
+        # current 'zha/devices' style record for each device, keyed by ieee, neighbor tables included
+        self.devices = {}
+        # HA device registry id -> ieee, for the zha devices
+        self.device_id_to_ieee = {}
+        # entity_id -> ieee, for the entities of the zha devices
+        self.entity_to_ieee = {}
+        # number of events that changed a device
+        self.events_applied = 0
+
+    # ---- full data ----
+
+    # the result of a 'zha/devices' call, replaces everything we know
+    def load_devices(self, devices) :
+        self.devices = dict((device["ieee"], device) for device in devices)
+
+    # the result of a 'zha/device' call for a single device, keeps that device's current neighbor table
+    # when the device record does not carry one
+    def load_device(self, device) :
+        old = self.devices.get(device["ieee"])
+        if old is not None and "neighbors" not in device :
+            device["neighbors"] = old["neighbors"]
+        device.setdefault("neighbors", [])
+        self.devices[device["ieee"]] = device
+
+    def device_list(self) :
+        return list(self.devices.values())
+
+    # result of 'config/device_registry/list'
+    def load_device_registry(self, entries) :
+        self.device_id_to_ieee = {}
+        for entry in entries :
+            for identifier in entry.get("identifiers", []) :
+                if len(identifier) == 2 and identifier[0] == "zha" :
+                    self.device_id_to_ieee[entry["id"]] = identifier[1]
+
+    # result of 'config/entity_registry/list'
+    def load_entity_registry(self, entries) :
+        self.entity_to_ieee = {}
+        for entry in entries :
+            ieee = self.device_id_to_ieee.get(entry.get("device_id"))
+            if entry.get("platform") == "zha" and ieee is not None :
+                self.entity_to_ieee[entry["entity_id"]] = ieee
+
+    # ---- events ----
+
+    def device_seen(self, ieee, ha_time, available=True) :
+        device = self.devices.get(ieee)
+        if device is None :
+            return False
+        device["last_seen"] = ha_time_to_last_seen(ha_time)
+        device["available"] = available
+        self.events_applied += 1
+        return True
+
+    def device_unavailable(self, ieee) :
+        device = self.devices.get(ieee)
+        if device is None :
+            return False
+        device["available"] = False
+        self.events_applied += 1
+        return True
+
+    # apply one 'event' message, returns (action, ieee) when the collector has to go back to HA for more data
+    def handle_event(self, event) :
+
+        event_type = event.get("event_type")
+        data = event.get("data", {})
+
+        if event_type == "zha_event" :
+            self.device_seen(data.get("device_ieee"), event.get("time_fired"))
+
+        elif event_type == "state_changed" :
+            ieee = self.entity_to_ieee.get(data.get("entity_id"))
+            new_state = data.get("new_state")
+            if ieee is None or new_state is None :
+                return None
+            if new_state.get("state") == "unavailable" :
+                self.device_unavailable(ieee)
+            else :
+                self.device_seen(ieee, new_state.get("last_updated", event.get("time_fired")))
+
+        elif event_type == "device_registry_updated" :
+            ieee = self.device_id_to_ieee.get(data.get("device_id"))
+            if data.get("action") == "update" and ieee is not None :
+                return (REFRESH_DEVICE, ieee)
+            # a device we do not know about was added, or one was removed, start over
+            if data.get("action") in ("create", "remove") :
+                return (RESYNC, None)
+
+        return None
+
+
+# EOF
@@ -0,0 +1,300 @@
+#!/usr/bin/python3
+# zha_export.py
+
+# 202610182030
+#
+# export of the zha history to Parquet files for analytics (pandas, polars, duckdb, spark)
+# needs pyarrow, 'pip3 install pyarrow', zha_ws.py itself does not
+#
+# the zha table (and the zha_pYYYYMMDD partitions of zha_partition.py) and the rollup tables of zha_rollup.py
+# are read in chunks of --chunk-rows rows from a read only connection, so memory stays the same whatever the
+# size of the history and zha_ws.py can keep writing, and each chunk is written as one Parquet file per day :
+#
+#  <out>/zha/date=2026-10-18/zha-<first rowid>.parquet
+#  <out>/rollup_1h/date=2026-10-18/rollup_1h-<first bucket_ts>.parquet
+#
+# the date=... directories are hive partitioning, pyarrow.dataset / pandas.read_parquet / duckdb read the
+# directory of a table as one table with a date column, and skip the days a filter on date leaves out
+#
+# the addresses, device types, availability and site are dictionary encoded, so each distinct value is stored
+# once per file, lqi / rssi / depth are 16 bit integers, timestamps are timestamps, and the files are zstd
+# compressed
+#
+# incremental : <out>/_watermark.json has, for each table, the last rowid (zha) or bucket_ts (rollups) that was
+# exported, the next run only exports what came after it, the watermark is saved after each file, so an
+# export that is stopped carries on where it was
+# a rollup bucket is exported once a newer one is in the table, zha_rollup.py writes the buckets still open (this
+# hour, today) as they fill, so the newest bucket_ts of a rollup table waits for the next export, a bucket
+# merged after it was exported keeps the part that was exported, --full exports everything again
+# a backfill of the rollups rebuilds every bucket, the export after it notices (the rollup_rebuild table of
+# zha_rollup.py) and removes the exported rollup files and exports the rollup tables again, the zha table is
+# not touched by a backfill and carries on from its watermark
+#
+#  python3 zha_export.py zha_ws.db export/                  # what is new since the last export
+#  python3 zha_export.py zha_ws.db export/ --full           # all of it again
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from datetime import datetime
+
+try :
+    import pyarrow
+    import pyarrow.parquet
+except ImportError :
+    pyarrow = None
+
+from zha_store import ZhaReader
+from zha_partition import partition_tables
+from zha_rollup import ROLLUP_LEVELS
+
+
+WATERMARK_FILE = "_watermark.json"
+
+# the columns of the zha table, and how each one is stored in the Parquet files
+#  "dictionary" : dictionary encoded text, "timestamp" : 'YYYY-MM-DD HH:MM:SS' text, "nwk" : int or "0x1234" text
+ZHA_EXPORT_COLUMNS = (
+    ("packet", "int32"),
+    ("retrieve_ts", "timestamp"),
+    ("neighbor_address", "dictionary"),
+    ("neighbor_lqi", "int16"),
+    ("neighbor_rssi", "int16"),
+    ("neighbor_delta_last_seen", "float32"),
+    ("neighbor_last_seen_ts", "timestamp"),
+    ("neighbor_device_type", "dictionary"),
+    ("neighbor_available", "dictionary"),
+    ("neighbor_depth", "int16"),
+    ("neighbor_relationship", "dictionary"),
+    ("peer_nwk", "nwk"),
+    ("peer_lqi", "int16"),
+    ("peer_rssi", "int16"),
+    ("peer_available", "dictionary"),
+    ("peer_address", "dictionary"),
+    ("site", "dictionary"),
+)
+
+ROLLUP_EXPORT_COLUMNS = (
+    ("site", "dictionary"),
+    ("neighbor_address", "dictionary"),
+    ("peer_address", "dictionary"),
+    ("bucket_ts", "epoch"),
+    ("samples", "int32"),
+    ("lqi_min", "int16"),
+    ("lqi_max", "int16"),
+    ("lqi_mean", "float32"),
+    ("lqi_p95", "int16"),
+    ("rssi_min", "int16"),
+    ("rssi_max", "int16"),
+    ("rssi_mean", "float32"),
+    ("rssi_p95", "int16"),
+    ("available_samples", "int32"),
+    ("available_ratio", "float32"),
+)
+
+INTEGER_KINDS = ("int16", "int32")
+
+
+# the select list of the columns, sqlite hands back integers as text when that is how they were written,
+# and text that is not a number as 0, the cast makes the integer columns integers
+def select_list(columns) :
+    return ", ".join(("cast(" + name + " as integer)" if kind in INTEGER_KINDS else name) for name, kind in columns)
+
+
+def nwk_value(value) :
+    if isinstance(value, str) :
+        try :
+            return int(value, 0)
+        except ValueError :
+            return None
+    return value
+
+
+# one column of values from sqlite as an arrow array
+def arrow_array(values, kind) :
+    if kind == "dictionary" :
+        return pyarrow.array(values, type=pyarrow.string()).dictionary_encode()
+    if kind == "timestamp" :
+        return pyarrow.array(values, type=pyarrow.string()).cast(pyarrow.timestamp("us"))
+    if kind == "epoch" :
+        return pyarrow.array(values, type=pyarrow.timestamp("s", tz="UTC"))
+    if kind == "nwk" :
+        return pyarrow.array([nwk_value(value) for value in values], type=pyarrow.int32())
+    return pyarrow.array(values, type=getattr(pyarrow, kind)())
+
+
+def arrow_table(rows, columns) :
+    values = list(zip(*rows))
+    return pyarrow.table(dict((name, arrow_array(values[ii], kind)) for ii, (name, kind) in enumerate(columns)))
+
+
+def load_watermarks(out_dir) :
+    try :
+        with open(os.path.join(out_dir, WATERMARK_FILE)) as watermark_file :
+            return json.load(watermark_file)
+    except FileNotFoundError :
+        return {}
+
+
+# written to a new file that then replaces the old one, a crash never leaves half a watermark file
+def save_watermarks(out_dir, watermarks) :
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    with open(path + ".tmp", "w") as watermark_file :
+        json.dump(watermarks, watermark_file, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+class ZhaExporter :
+
+    # chunk_rows : rows read from the database and held in memory at a time
+    # compression : Parquet compression codec, "zstd", "snappy", "gzip" or "none"
+    def __init__(self, database_file, out_dir, chunk_rows=50000, compression="zstd", pragmas=None) :
+        if pyarrow is None :
+            raise RuntimeError("zha_export.py needs pyarrow, pip3 install pyarrow")
+        self.database_file = database_file
+        self.out_dir = out_dir
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self.pragmas = pragmas if pragmas is not None else {"mmap_size" : 268435456, "cache_size" : -32000}
+        self.reader = None
+        self.watermarks = {}
+        # statistics
+        self.rows_exported = 0
+        self.files_written = 0
+        self.bytes_written = 0
+
+    def open(self) :
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.reader = ZhaReader(self.database_file, self.pragmas).open()
+        self.watermarks = load_watermarks(self.out_dir)
+        return self
+
+    def close(self) :
+        if self.reader is not None :
+            self.reader.close()
+            self.reader = None
+
+    # forget what was exported, and remove the files
+    def reset(self) :
+        for dataset in ["zha"] + [table for table, bucket in ROLLUP_LEVELS] :
+            shutil.rmtree(os.path.join(self.out_dir, dataset), ignore_errors=True)
+        self.watermarks = {}
+        save_watermarks(self.out_dir, self.watermarks)
+
+    def tables(self) :
+        return set(row[0] for row in self.reader.query("select name from sqlite_master where type = 'table'"))
+
+    # the rows of each day of one chunk into a file of their own, then the watermark
+    def write_chunk(self, dataset, source, rows, columns, dates, first, last) :
+        table = arrow_table(rows, columns)
+        by_date = {}
+        for ii, date in enumerate(dates) :
+            by_date.setdefault(date, []).append(ii)
+        for date, indices in sorted(by_date.items()) :
+            directory = os.path.join(self.out_dir, dataset, "date=" + date)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, source + "-" + str(first) + ".parquet")
+            part = table if len(by_date) == 1 else table.take(pyarrow.array(indices, type=pyarrow.int32()))
+            pyarrow.parquet.write_table(part, path, compression=self.compression, use_dictionary=True)
+            self.files_written += 1
+            self.bytes_written += os.path.getsize(path)
+        self.rows_exported += len(rows)
+        self.watermarks[source] = last
+        save_watermarks(self.out_dir, self.watermarks)
+
+    # the zha table, or a partition of it, by rowid, so the rows written after the last export are the new ones
+    def export_links(self, source) :
+        sql = "select rowid, " + select_list(ZHA_EXPORT_COLUMNS) + " from " + source + " where rowid > ? order by rowid limit ?"
+        while True :
+            rows = self.reader.query(sql, (self.watermarks.get(source, 0), self.chunk_rows))
+            if not rows :
+                return
+            # retrieve_ts is 'YYYY-MM-DD HH:MM:SS', the day is its first 10 characters
+            dates = [(row[2] or "0000-00-00")[: 10] for row in rows]
+            self.write_chunk("zha", source, [row[1 :] for row in rows], ZHA_EXPORT_COLUMNS, dates, rows[0][0], rows[-1][0])
+
+    # a rollup table by bucket_ts, all the buckets of a bucket_ts go in the same chunk, up to the newest bucket_ts,
+    # which may still be open
+    def export_rollup(self, source) :
+        sql = "select " + select_list(ROLLUP_EXPORT_COLUMNS) + " from " + source + " where bucket_ts > ? and bucket_ts <= ? order by bucket_ts"
+        newest = self.reader.query("select max(bucket_ts) from " + source)[0][0]
+        if newest is None :
+            return
+        while True :
+            watermark = self.watermarks.get(source, 0)
+            # the bucket_ts about chunk_rows rows on, or the last one before the newest
+            last = self.reader.query("select bucket_ts from " + source + " where bucket_ts > ? and bucket_ts < ? order by bucket_ts limit 1 offset ?", \
+                (watermark, newest, self.chunk_rows - 1)) or \
+                self.reader.query("select max(bucket_ts) from " + source + " where bucket_ts > ? and bucket_ts < ?", (watermark, newest))
+            if last[0][0] is None :
+                return
+            rows = self.reader.query(sql, (watermark, last[0][0]))
+            dates = [datetime.fromtimestamp(row[3]).strftime("%Y-%m-%d") for row in rows]
+            self.write_chunk(source, source, rows, ROLLUP_EXPORT_COLUMNS, dates, rows[0][3], rows[-1][3])
+
+    # after a backfill of the rollups the buckets exported before are stale, the rollup files go and their
+    # watermarks start over, the backfill seen last is kept with the watermarks
+    def check_rollup_rebuild(self, tables) :
+        if "rollup_rebuild" not in tables :
+            return
+        rebuild = self.reader.query("select max(rebuild_id) from rollup_rebuild")[0][0]
+        if rebuild is None or rebuild == self.watermarks.get("rollup_rebuild") :
+            return
+        for table, bucket in ROLLUP_LEVELS :
+            shutil.rmtree(os.path.join(self.out_dir, table), ignore_errors=True)
+            self.watermarks.pop(table, None)
+        self.watermarks["rollup_rebuild"] = rebuild
+        save_watermarks(self.out_dir, self.watermarks)
+
+    def export(self, progress=None) :
+        tables = self.tables()
+        self.check_rollup_rebuild(tables)
+        sources = (["zha"] if "zha" in tables else []) + list(partition_tables(self.reader.sql_conn).values())
+        for source in sources :
+            self.export_links(source)
+            if progress :
+                progress(source, self.rows_exported)
+        for source, bucket in ROLLUP_LEVELS :
+            if source in tables :
+                self.export_rollup(source)
+                if progress :
+                    progress(source, self.rows_exported)
+        return self.rows_exported
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="export the zha history to Parquet files partitioned by date")
+    parser.add_argument("database", help="zha_ws.py database")
+    parser.add_argument("out_dir", help="directory of the Parquet files")
+    parser.add_argument("--full", action="store_true", help="export everything again, not only what is new since the last export")
+    parser.add_argument("--chunk-rows", type=int, default=50000, help="rows held in memory at a time")
+    parser.add_argument("--compression", default="zstd", help="zstd, snappy, gzip or none")
+    args = parser.parse_args()
+
+    if pyarrow is None :
+        print("zha_export.py needs pyarrow : pip3 install pyarrow")
+        sys.exit(1)
+
+    exporter = ZhaExporter(args.database, args.out_dir, chunk_rows=args.chunk_rows, compression=args.compression).open()
+    if args.full :
+        exporter.reset()
+    start = time.perf_counter()
+
+    def progress(source, rows) :
+        print(f"{source} done, {rows} rows exported, {time.perf_counter() - start:.1f}s")
+
+    exporter.export(progress)
+    exporter.close()
+    elapsed = time.perf_counter() - start
+    print(f"{exporter.rows_exported} rows in {exporter.files_written} files, {exporter.bytes_written / 1e6:.1f} MB, " \
+        f"{exporter.rows_exported / max(elapsed, 1e-9):.0f} rows/s")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,439 @@
+#!/usr/bin/python3
+# zha_fake_ha.py
+
+PROGRAM_NAME = "zha_fake_ha"
+VERSION_MAJOR = "1"
+VERSION_MINOR = "0"
+
+# 202610190200
+# --rewire, entries of the router tables move, an end device changes parent, a router hears another router
+# 202610182330
+# the mesh changes from call to call : lqi / rssi drift, last_seen moves on, devices go offline and come back,
+# renames, and faults can be injected : latency, oversized frames, disconnects and calls that are never answered
+# 202610181100
+#
+# a stand in for the Home Assistant web socket api, just enough of it to answer the 'zha/devices' call
+# with a synthetic zigbee mesh, and to send state_changed / zha_event / device_registry_updated events to the
+# clients that subscribe to them, so zha_ws.py and the benchmarks can be run on a laptop without a live HA
+# https://developers.home-assistant.io/docs/api/websocket/
+#
+# run it on its own :
+#  ./zha_fake_ha.py --port 8123 --devices 50
+# and point ha_ip in zha_ws.yaml at "localhost:8123", ws02.py .. ws08.py talk to it the same way
+#
+# by default the mesh stays as it was generated, these make each 'zha/devices' call see a living mesh :
+#  --drift 0.05        part of the lqi / rssi values that move a few steps
+#  --seen 0.5          part of the online devices whose last_seen is now
+#  --offline 0.01      part of the devices that go offline (available false, last_seen stops), --recover 0.2 of
+#                      the offline ones come back
+#  --rename 0.001      part of the devices that get a new user_given_name
+#  --rewire 0.001      part of the neighbor table entries that move, a child goes to another router, a router
+#                      hears another router instead
+# and these inject faults into the answers to 'zha/devices' :
+#  --latency 0.5 --jitter 0.5     seconds before answering, plus up to jitter more
+#  --oversize 0.1 --oversize-mb 4 part of the answers padded to this size
+#  --disconnect 0.02              part of the calls where the server closes the connection instead of answering
+#  --hang 0.01                    part of the calls never answered, until the client gives up and closes
+#
+#  ./zha_fake_ha.py --devices 300 --router-ratio 0.2 --fan-out 8 --drift 0.05 --seen 0.5 --offline 0.01 --disconnect 0.02
+
+import sys
+import argparse
+import asyncio
+import json
+import random
+import threading
+from datetime import datetime, timezone
+
+import websockets
+
+
+# build a synthetic mesh : one coordinator, some routers and end devices that hang off the routers
+# returns the list of devices in the same layout as the 'result' of a 'zha/devices' call
+def generate_mesh(device_count, router_ratio=0.3, fan_out=6, seed=1) :
+
+    rnd = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+
+    def ieee(ii) :
+        raw = "%016x" % (0x00158d0000000000 + ii)
+        return ":".join(raw[jj:jj + 2] for jj in range(0, 16, 2))
+
+    devices = []
+    router_count = max(1, int((device_count - 1) * router_ratio))
+    for ii in range(device_count) :
+        if ii == 0 :
+            device_type = "Coordinator"
+        elif ii <= router_count :
+            device_type = "Router"
+        else :
+            device_type = "EndDevice"
+        devices.append({"ieee" : ieee(ii), \
+            "nwk" : 0 if ii == 0 else rnd.randint(1, 0xfff7), \
+            "manufacturer" : "Silicon Labs" if ii == 0 else rnd.choice(["LUMI", "IKEA of Sweden", "LEDVANCE", "Samjin"]), \
+            "model" : "EZSP" if ii == 0 else rnd.choice(["lumi.weather", "TRADFRI bulb", "PLUG", "multi"]), \
+            "name" : "device %d" % ii, \
+            "quirk_applied" : rnd.random() < 0.5, \
+            "quirk_class" : "zigpy.device.Device", \
+            "manufacturer_code" : rnd.randint(0, 0xffff), \
+            "device_reg_id" : "%032x" % rnd.getrandbits(128), \
+            "user_given_name" : None if ii == 0 else "%s %d" % (device_type, ii), \
+            "power_source" : "Mains" if device_type != "EndDevice" else "Battery or Unknown", \
+            "available" : True, \
+            "lqi" : rnd.randint(60, 255), \
+            "rssi" : rnd.randint(-90, -40), \
+            "last_seen" : now.strftime('%Y-%m-%dT%H:%M:%S'), \
+            "device_type" : device_type, \
+            "signature" : {"node_descriptor" : "NodeDescriptor(byte1=1, byte2=64, mac_capability_flags=142)", \
+                "endpoints" : {"1" : {"profile_id" : 260, "device_type" : "0x0100", \
+                    "in_clusters" : ["0x0000", "0x0003", "0x0004", "0x0005", "0x0006"], "out_clusters" : ["0x0019"]}}}, \
+            "endpoint_names" : [{"name" : "ON_OFF_LIGHT"}], \
+            "neighbors" : [] \
+            })
+
+    routers = devices[:router_count + 1]
+
+    def neighbor_entry(device, relationship, depth) :
+        return {"device_type" : device["device_type"], \
+            "rx_on_when_idle" : "On" if device["device_type"] != "EndDevice" else "Off", \
+            "relationship" : relationship, \
+            "extended_pan_id" : "cc:cc:cc:cc:00:00:00:00", \
+            "ieee" : device["ieee"], \
+            "nwk" : "0x%04x" % device["nwk"], \
+            "permit_joining" : "Unknown", \
+            "depth" : str(depth), \
+            "lqi" : str(rnd.randint(40, 255)) \
+            }
+
+    # routers (and the coordinator) hear a handful of other routers
+    for device in routers :
+        for peer in rnd.sample(routers, min(fan_out, len(routers))) :
+            if peer is not device :
+                device["neighbors"].append(neighbor_entry(peer, "Sibling", 1))
+
+    # each end device is the child of one router, end devices have an empty neighbor table
+    for device in devices[router_count + 1:] :
+        parent = rnd.choice(routers)
+        parent["neighbors"].append(neighbor_entry(device, "Child", 2))
+
+    return devices
+
+
+class FakeHomeAssistant :
+
+    # devices : the mesh, see generate_mesh()
+    # drift, seen, offline, recover, rename, rewire : how the mesh changes on each 'zha/devices' call, see above
+    # latency, jitter, oversize, oversize_bytes, disconnect, hang : faults in the answers, see above
+    def __init__(self, devices, access_token="fake-token", host="127.0.0.1", port=0, event_rate=0.0, other_event_ratio=0.5, seed=1, \
+        drift=0.0, seen=0.0, offline=0.0, recover=0.2, rename=0.0, rewire=0.0, \
+        latency=0.0, jitter=0.0, oversize=0.0, oversize_bytes=4 * 1024 * 1024, disconnect=0.0, hang=0.0) :
+        self.devices = devices
+        self.access_token = access_token
+        self.host = host
+        self.port = port
+        self.server = None
+        # events per second sent to the clients that subscribed, about zigbee devices and about other HA entities
+        self.event_rate = event_rate
+        self.other_event_ratio = other_event_ratio
+        self.rnd = random.Random(seed)
+        # web socket -> {event_type : subscription id}
+        self.subscribers = {}
+        self.event_task = None
+        # the living mesh
+        self.drift = drift
+        self.seen = seen
+        self.offline = offline
+        self.recover = recover
+        self.rename = rename
+        self.rewire = rewire
+        # faults
+        self.latency = latency
+        self.jitter = jitter
+        self.oversize = oversize
+        self.oversize_bytes = oversize_bytes
+        self.disconnect = disconnect
+        self.hang = hang
+        # count of 'zha/devices' calls answered, events sent and bytes sent, for the benchmarks
+        self.calls = 0
+        self.events_sent = 0
+        self.bytes_sent = 0
+        # connections authenticated, and faults injected
+        self.connections = 0
+        self.disconnects = 0
+        self.hangs = 0
+        self.oversized = 0
+        self.renames = 0
+        self.rewired = 0
+
+    def entity_id(self, device) :
+        return "switch.zha_" + device["ieee"].replace(":", "")
+
+    def device_registry(self) :
+        return [{"id" : device["device_reg_id"], "identifiers" : [["zha", device["ieee"]]], \
+            "name" : device["name"], "name_by_user" : device["user_given_name"], "manufacturer" : device["manufacturer"], \
+            "model" : device["model"]} for device in self.devices]
+
+    def entity_registry(self) :
+        return [{"entity_id" : self.entity_id(device), "device_id" : device["device_reg_id"], "platform" : "zha"} \
+            for device in self.devices]
+
+    async def send(self, websocket, message) :
+        text = json.dumps(message)
+        self.bytes_sent += len(text)
+        await websocket.send(text)
+
+    async def result(self, websocket, ident, result) :
+        await self.send(websocket, {"id" : ident, "type" : "result", "success" : True, "result" : result})
+
+    # move the mesh on by one 'zha/devices' call
+    def advance(self) :
+        rnd = self.rnd
+        now = datetime.now().replace(microsecond=0).strftime('%Y-%m-%dT%H:%M:%S')
+        for device in self.devices :
+            coordinator = device["device_type"] == "Coordinator"
+            if self.drift :
+                for neighbor in device["neighbors"] :
+                    if rnd.random() < self.drift :
+                        neighbor["lqi"] = str(max(0, min(255, int(neighbor["lqi"]) + rnd.randint(-8, 8))))
+                if rnd.random() < self.drift :
+                    device["lqi"] = max(0, min(255, device["lqi"] + rnd.randint(-8, 8)))
+                if rnd.random() < self.drift :
+                    device["rssi"] = max(-100, min(0, device["rssi"] + rnd.randint(-3, 3)))
+            if device["available"] :
+                if not coordinator and rnd.random() < self.offline :
+                    device["available"] = False
+                elif coordinator or rnd.random() < self.seen :
+                    device["last_seen"] = now
+            elif rnd.random() < self.recover :
+                device["available"] = True
+                device["last_seen"] = now
+            if not coordinator and rnd.random() < self.rename :
+                device["user_given_name"] = "%s renamed %d" % (device["device_type"], rnd.randint(0, 9999))
+                self.renames += 1
+        if self.rewire :
+            self.rewire_tables()
+
+    # move some entries of the router tables, a 'Child' entry goes to another router, the new parent of the end
+    # device, any other entry is replaced by one for a router the table does not have yet
+    def rewire_tables(self) :
+        rnd = self.rnd
+        routers = [device for device in self.devices if device["device_type"] != "EndDevice"]
+        if len(routers) < 2 :
+            return
+        for device in routers :
+            kept = []
+            for neighbor in device["neighbors"] :
+                if rnd.random() >= self.rewire :
+                    kept.append(neighbor)
+                    continue
+                self.rewired += 1
+                if neighbor["relationship"] == "Child" :
+                    rnd.choice([router for router in rnd.sample(routers, 2) if router is not device])["neighbors"].append(neighbor)
+                    continue
+                heard = set(entry["ieee"] for entry in device["neighbors"])
+                peer = rnd.choice(routers)
+                if peer is device or peer["ieee"] in heard :
+                    kept.append(neighbor)
+                    continue
+                kept.append(dict(neighbor, ieee=peer["ieee"], nwk="0x%04x" % peer["nwk"], device_type=peer["device_type"], \
+                    lqi=str(rnd.randint(40, 255))))
+            device["neighbors"] = kept
+
+    # the answer to a 'zha/devices' call, with the faults asked for
+    async def devices_result(self, websocket, ident) :
+        self.advance()
+        if self.latency or self.jitter :
+            await asyncio.sleep(self.latency + self.rnd.uniform(0, self.jitter))
+        if self.rnd.random() < self.disconnect :
+            self.disconnects += 1
+            await websocket.close(1011, "fake disconnect")
+            return
+        if self.rnd.random() < self.hang :
+            # no answer, the client has to time out and close the connection
+            self.hangs += 1
+            await websocket.wait_closed()
+            return
+        result = self.devices
+        if self.rnd.random() < self.oversize :
+            # the same devices, each with an attribute big enough to make the frame oversize_bytes
+            self.oversized += 1
+            padding = "x" * (self.oversize_bytes // max(1, len(self.devices)))
+            result = [dict(device, fake_padding=padding) for device in self.devices]
+        self.calls += 1
+        await self.result(websocket, ident, result)
+
+    async def handler(self, websocket) :
+
+        # HA auth handshake
+        await self.send(websocket, {"type" : "auth_required", "ha_version" : "2021.1.5"})
+        auth = json.loads(await websocket.recv())
+        if auth.get("type") != "auth" or auth.get("access_token") != self.access_token :
+            await self.send(websocket, {"type" : "auth_invalid", "message" : "Invalid access token or password"})
+            return
+        await self.send(websocket, {"type" : "auth_ok", "ha_version" : "2021.1.5"})
+        self.connections += 1
+
+        try :
+            async for text in websocket :
+                message = json.loads(text)
+                kind = message.get("type")
+                if kind == "zha/devices" :
+                    await self.devices_result(websocket, message["id"])
+                elif kind == "zha/device" :
+                    device = next((device for device in self.devices if device["ieee"] == message.get("ieee")), None)
+                    await self.result(websocket, message["id"], device)
+                elif kind == "subscribe_events" :
+                    self.subscribers.setdefault(websocket, {})[message.get("event_type")] = message["id"]
+                    await self.result(websocket, message["id"], None)
+                elif kind == "config/device_registry/list" :
+                    await self.result(websocket, message["id"], self.device_registry())
+                elif kind == "config/entity_registry/list" :
+                    await self.result(websocket, message["id"], self.entity_registry())
+                elif kind == "ping" :
+                    await self.send(websocket, {"id" : message["id"], "type" : "pong"})
+                else :
+                    await self.send(websocket, {"id" : message.get("id"), "type" : "result", "success" : False, \
+                        "error" : {"code" : "unknown_command", "message" : "Unknown command."}})
+        except websockets.ConnectionClosed :
+            pass
+        finally :
+            self.subscribers.pop(websocket, None)
+
+    # make up one HA event, and change the device data so a later 'zha/devices' call agrees with it
+    def make_event(self) :
+
+        now = datetime.now(timezone.utc)
+        time_fired = now.isoformat()
+
+        if self.rnd.random() < self.other_event_ratio :
+            return {"event_type" : "state_changed", "time_fired" : time_fired, "origin" : "LOCAL", \
+                "data" : {"entity_id" : "sensor.outside_temperature", \
+                    "old_state" : {"entity_id" : "sensor.outside_temperature", "state" : "12.1", "attributes" : {"unit_of_measurement" : "C"}}, \
+                    "new_state" : {"entity_id" : "sensor.outside_temperature", "state" : "12.2", "attributes" : {"unit_of_measurement" : "C"}, \
+                        "last_changed" : time_fired, "last_updated" : time_fired}}}
+
+        device = self.rnd.choice(self.devices[1:] or self.devices)
+        device["last_seen"] = now.astimezone().strftime('%Y-%m-%dT%H:%M:%S')
+        device["available"] = True
+
+        # now and then somebody renames a device
+        if self.rnd.random() < 0.02 :
+            device["user_given_name"] = "%s renamed %d" % (device["device_type"], self.rnd.randint(0, 9999))
+            return {"event_type" : "device_registry_updated", "time_fired" : time_fired, "origin" : "LOCAL", \
+                "data" : {"action" : "update", "device_id" : device["device_reg_id"], "changes" : {"name_by_user" : None}}}
+
+        if self.rnd.random() < 0.3 :
+            return {"event_type" : "zha_event", "time_fired" : time_fired, "origin" : "LOCAL", \
+                "data" : {"device_ieee" : device["ieee"], "unique_id" : device["ieee"] + ":1:0x0006", \
+                    "device_id" : device["device_reg_id"], "endpoint_id" : 1, "cluster_id" : 6, "command" : "toggle", "args" : []}}
+
+        entity_id = self.entity_id(device)
+        state = self.rnd.choice(["on", "off"])
+        return {"event_type" : "state_changed", "time_fired" : time_fired, "origin" : "LOCAL", \
+            "data" : {"entity_id" : entity_id, \
+                "old_state" : {"entity_id" : entity_id, "state" : "off" if state == "on" else "on", "attributes" : {"friendly_name" : device["user_given_name"]}}, \
+                "new_state" : {"entity_id" : entity_id, "state" : state, "attributes" : {"friendly_name" : device["user_given_name"]}, \
+                    "last_changed" : time_fired, "last_updated" : time_fired}}}
+
+    async def send_event(self, event) :
+        for websocket, subscriptions in list(self.subscribers.items()) :
+            ident = subscriptions.get(event["event_type"])
+            if ident is None :
+                continue
+            try :
+                await self.send(websocket, {"id" : ident, "type" : "event", "event" : event})
+                self.events_sent += 1
+            except websockets.ConnectionClosed :
+                pass
+
+    async def event_source(self) :
+        while True :
+            await asyncio.sleep(1.0 / self.event_rate)
+            await self.send_event(self.make_event())
+
+    async def start(self) :
+        self.server = await websockets.serve(self.handler, self.host, self.port, max_size=None)
+        self.port = self.server.sockets[0].getsockname()[1]
+        if self.event_rate > 0 :
+            self.event_task = asyncio.create_task(self.event_source())
+        return self
+
+    async def stop(self) :
+        if self.event_task is not None :
+            self.event_task.cancel()
+            self.event_task = None
+        if self.server is not None :
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    # "host:port", the way ha_ip is written in zha_ws.yaml
+    @property
+    def ha_ip(self) :
+        return self.host + ":" + str(self.port)
+
+
+# run a fake HA server on a background thread with its own event loop, for callers that are not asyncio
+class FakeHomeAssistantThread :
+
+    def __init__(self, fake) :
+        self.fake = fake
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self) :
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.fake.start(), self.loop).result()
+        return self.fake
+
+    def stop(self) :
+        asyncio.run_coroutine_threadsafe(self.fake.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="fake Home Assistant ZHA web socket server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--devices", type=int, default=50, help="number of zigbee devices in the synthetic mesh")
+    parser.add_argument("--token", default="fake-token", help="access token the server accepts")
+    parser.add_argument("--router-ratio", type=float, default=0.3, help="part of the devices that are routers, the rest are end devices")
+    parser.add_argument("--fan-out", type=int, default=6, help="routers each router hears")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--event-rate", type=float, default=0.0, help="HA events per second sent to subscribers")
+    parser.add_argument("--drift", type=float, default=0.0, help="part of the lqi / rssi values that move on each call")
+    parser.add_argument("--seen", type=float, default=0.0, help="part of the online devices seen again on each call")
+    parser.add_argument("--offline", type=float, default=0.0, help="part of the devices that go offline on each call")
+    parser.add_argument("--recover", type=float, default=0.2, help="part of the offline devices that come back on each call")
+    parser.add_argument("--rename", type=float, default=0.0, help="part of the devices renamed on each call")
+    parser.add_argument("--rewire", type=float, default=0.0, help="part of the neighbor table entries that move on each call")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before answering a call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds before answering")
+    parser.add_argument("--oversize", type=float, default=0.0, help="part of the answers padded to --oversize-mb")
+    parser.add_argument("--oversize-mb", type=float, default=4.0)
+    parser.add_argument("--disconnect", type=float, default=0.0, help="part of the calls answered by closing the connection")
+    parser.add_argument("--hang", type=float, default=0.0, help="part of the calls never answered")
+    args = parser.parse_args()
+
+    async def serve() :
+        fake = await FakeHomeAssistant(generate_mesh(args.devices, router_ratio=args.router_ratio, fan_out=args.fan_out, seed=args.seed), \
+            access_token=args.token, host=args.host, port=args.port, event_rate=args.event_rate, seed=args.seed, \
+            drift=args.drift, seen=args.seen, offline=args.offline, recover=args.recover, rename=args.rename, rewire=args.rewire, \
+            latency=args.latency, jitter=args.jitter, oversize=args.oversize, oversize_bytes=int(args.oversize_mb * 1024 * 1024), \
+            disconnect=args.disconnect, hang=args.hang).start()
+        print(PROGRAM_NAME + " listening on ws://" + fake.ha_ip + "/api/websocket with " + str(args.devices) + " devices")
+        await asyncio.Future()
+
+    try :
+        asyncio.run(serve())
+    except KeyboardInterrupt :
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+# zha_graph.py
+
+# 202610190200
+# touched, the table entries that came, went or changed since zha_routes.MeshRoutes last looked
+# 202610190100
+#
+# the neighbor tables of the mesh as a graph, kept by zha_process.ZhaProcessor from one web socket call to the next
+# instead of the neighbor_db dict keyed by "ieee:ieee" strings, and the is_neighbor flag found by walking every
+# neighbor list
+#
+# each IEEE address gets a small integer id, the first time it is seen as a device or as a neighbor, ids are never
+# reused, a mesh sees at most a few thousand addresses in its life
+# an edge a -> b is the entry for b in the neighbor table of a, 'a hears b', with the lqi, relationship and depth
+# of that entry, the forward adjacency of a is its neighbor table, the reverse adjacency of b the devices that
+# hear it
+#
+# each call replaces the neighbor table of each device that is in it, only the entries that came or went change
+# the adjacency, the lqi / relationship / depth of the others are updated in place
+#
+#  edge(a, b)           O(1)    the entry for b in the table of a, None if there is none
+#  heard_by(x)          O(k)    the devices that have x in their table
+#  is_orphaned(x)       O(1)    no device has x in its table
+#  children(r)          O(k)    the devices r lists as its 'Child'
+#  asymmetric()         O(k)    links a -> b where b has a neighbor table without a in it, kept up to date as the
+#                               edges change, end devices have empty tables so their links are not counted
+
+import sys
+
+
+CHILD = "Child"
+
+
+# one entry of a neighbor table
+class Edge :
+
+    __slots__ = ("lqi", "relationship", "depth")
+
+    def __init__(self, lqi, relationship, depth) :
+        self.lqi = lqi
+        self.relationship = relationship
+        self.depth = depth
+
+    def __repr__(self) :
+        return "Edge(lqi %s %s depth %s)" % (self.lqi, self.relationship, self.depth)
+
+
+class NeighborGraph :
+
+    def __init__(self) :
+        # interned IEEE address -> id, and id -> address
+        self.ids = {}
+        self.addresses = []
+        # by id : {id heard : Edge}, the neighbor table, and the set of ids that hear this one
+        self.forward = []
+        self.reverse = []
+        # (id, id) of the links a -> b where b has a table without a, ids of the nodes with a non empty table
+        self.one_way = set()
+        self.has_table = set()
+        # (id, id heard) of the table entries that came, went or changed, emptied by whoever keeps something derived
+        # from the edges up to date, see zha_routes.py
+        self.touched = set()
+
+    def __len__(self) :
+        return len(self.addresses)
+
+    # the id of an address, a new one if it was never seen
+    def node(self, ieee) :
+        node = self.ids.get(ieee)
+        if node is None :
+            node = len(self.addresses)
+            ieee = sys.intern(ieee)
+            self.ids[ieee] = node
+            self.addresses.append(ieee)
+            self.forward.append({})
+            self.reverse.append(set())
+        return node
+
+    # the neighbor table of a device from one call, a list of zha_decode.Neighbor
+    def set_neighbors(self, ieee, neighbors) :
+        node = self.node(ieee)
+        table = self.forward[node]
+        touched = self.touched
+        seen = set()
+        changed = False
+        for neighbor in neighbors :
+            other = self.node(neighbor.ieee)
+            seen.add(other)
+            edge = table.get(other)
+            if edge is None :
+                table[other] = Edge(neighbor.lqi, neighbor.relationship, neighbor.depth)
+                self.added(node, other)
+                touched.add((node, other))
+                changed = True
+            elif edge.lqi != neighbor.lqi or edge.relationship != neighbor.relationship or edge.depth != neighbor.depth :
+                edge.lqi = neighbor.lqi
+                edge.relationship = neighbor.relationship
+                edge.depth = neighbor.depth
+                touched.add((node, other))
+        if len(seen) != len(table) :
+            for other in [other for other in table if other not in seen] :
+                del table[other]
+                self.removed(node, other)
+                touched.add((node, other))
+            changed = True
+        if changed :
+            self.table_changed(node)
+
+    # forget the neighbor table of a device that left the mesh, the tables of the others still say who heard it
+    def remove(self, ieee) :
+        node = self.ids.get(ieee)
+        if node is None :
+            return
+        table = self.forward[node]
+        if not table :
+            return
+        for other in list(table) :
+            del table[other]
+            self.removed(node, other)
+            self.touched.add((node, other))
+        self.table_changed(node)
+
+    # ---- keeping the reverse adjacency and the one way links ----
+
+    def added(self, node, other) :
+        self.reverse[other].add(node)
+        if node in self.forward[other] :
+            # the other side already listed us, the link is both ways now
+            self.one_way.discard((other, node))
+        elif other in self.has_table :
+            self.one_way.add((node, other))
+
+    def removed(self, node, other) :
+        self.reverse[other].discard(node)
+        self.one_way.discard((node, other))
+        if node in self.forward[other] and node in self.has_table :
+            # other still lists us, and we have a table without it
+            self.one_way.add((other, node))
+
+    # a device's table went from empty to not, or back, the links to it count as one way, or stop counting
+    def table_changed(self, node) :
+        if self.forward[node] :
+            if node not in self.has_table :
+                self.has_table.add(node)
+                for other in self.reverse[node] :
+                    if other not in self.forward[node] :
+                        self.one_way.add((other, node))
+        elif node in self.has_table :
+            self.has_table.discard(node)
+            for other in self.reverse[node] :
+                self.one_way.discard((other, node))
+
+    # ---- queries, by IEEE address ----
+
+    def edge(self, ieee, neighbor_ieee) :
+        node = self.ids.get(ieee)
+        other = self.ids.get(neighbor_ieee)
+        if node is None or other is None :
+            return None
+        return self.forward[node].get(other)
+
+    def heard_by(self, ieee) :
+        node = self.ids.get(ieee)
+        return [self.addresses[other] for other in self.reverse[node]] if node is not None else []
+
+    def is_orphaned(self, ieee) :
+        node = self.ids.get(ieee)
+        return node is None or not self.reverse[node]
+
+    def neighbors(self, ieee) :
+        node = self.ids.get(ieee)
+        return [(self.addresses[other], edge) for other, edge in self.forward[node].items()] if node is not None else []
+
+    def children(self, ieee) :
+        node = self.ids.get(ieee)
+        if node is None :
+            return []
+        return [self.addresses[other] for other, edge in self.forward[node].items() if edge.relationship == CHILD]
+
+    # (a, b) of each link where a hears b but b, which has a neighbor table, does not list a
+    def asymmetric(self) :
+        return [(self.addresses[node], self.addresses[other]) for node, other in self.one_way]
+
+
+# EOF
@@ -0,0 +1,397 @@
+#!/usr/bin/python3
+# zha_migrate.py
+
+# 202610182200
+#
+# migrate the databases of every version of these programs into the zha table of zha_ws.py, or into the
+# normalized schema of zha_normalized.py
+# each version created its own 'zha' table, the schema of a source file is found from its columns :
+#
+#  ws03    : retrieve_ts (unix epoch), ieee_address, attributes (the device json, or attributes_hash, zha_blobs.py)
+#  ws04    : one row per neighbor of a device, the neighbor's name / nwk / lqi / rssi / availability, and the
+#            json of the device in attributes / attributes_hash
+#  ws05    : ws04 without the json, the rows do not say which device the neighbor was listed by
+#  ws06    : packet, the neighbor (ieee_address ...) and the device it is a neighbor of (peer_address)
+#  ws07    : neighbor_ / peer_ columns and both names, ws08.py has the same table
+#  zha_ws  : the zha table of zha_ws.py, the names come from its zha_device_name table, and the zha_pYYYYMMDD
+#            tables of a partitioned database (zha_partition.py), each table migrated with a checkpoint of its own
+#
+# ws03 and ws04 have the json of the devices, so each web socket call is run through zha_process.ZhaProcessor
+# again and gives the same rows zha_ws.py would have written, the devices of ws04 that had no neighbors were never
+# written, so they are missing here too
+# ws05 has no packet, each web socket call (a new retrieve_ts) gets the next number, and no peer, the nwk and lqi
+# it kept are those of the device as the coordinator saw it, there is no column for them in the zha table
+# ws06 has the lqi of the link as the device listing the neighbor heard it, that is peer_lqi in the zha table
+#
+# each source file is read by a reader process of its own, up to --workers at a time, in chunks of --chunk rows
+# by rowid, so a file of many GB is never in memory, the chunks go through a bounded queue to the one writer,
+# the rows of a chunk and the checkpoint of its source (the rowid read up to) are committed together
+# an interrupted migration started again carries on from the checkpoints, a finished source is skipped
+# ws03 / ws04 / ws05 chunks end on a whole web socket call, the last, incomplete, call is read again with the
+# next chunk
+#
+#  python3 zha_migrate.py zha_ws.db ws03.db ws06.db ws07.db                 # into the zha table
+#  python3 zha_migrate.py zha_ws.db ws0*.db --schema normalized --workers 4
+#  python3 zha_migrate.py zha_ws.db ws05.db --site home                    # site of rows that have none
+
+import os
+import sys
+import json
+import time
+import queue
+import sqlite3
+import argparse
+import traceback
+import urllib.parse
+import multiprocessing
+from datetime import datetime
+
+from zha_process import LINK_COLUMNS, ZhaProcessor
+from zha_store import ZhaStore, ZHA_INSERT, ZHA_DEVICE_NAME_UPSERT, zha_values
+from zha_normalized import NormalizedZhaStore, LINK_INSERT
+from zha_partition import partition_tables
+
+
+MIGRATE_CHECKPOINT_TABLE = "CREATE TABLE IF NOT EXISTS migrate_checkpoint (source text primary key, source_schema text, last_rowid integer not null, packet integer not null, rows integer not null, done integer not null default 0)"
+
+# the columns of each flat source schema in the order of a migrated row : the 16 columns of the zha table, then
+# neighbor_given_name, peer_given_name, the site is added by the reader, and the packet of ws05 rows is numbered by it
+SOURCE_COLUMNS = {
+    "ws05" : "retrieve_ts, ieee_address, null, rssi, delta_last_seen, null, null, available, null, null, null, null, null, null, null, " \
+        "user_given_name, null",
+    "ws06" : "packet, retrieve_ts, ieee_address, null, rssi, delta_last_seen, last_seen_ts, device_type, available, depth, relationship, " \
+        "null, lqi, null, null, peer_address, user_given_name, peer_given_name",
+    "ws07" : ", ".join(LINK_COLUMNS) + ", neighbor_given_name, peer_given_name",
+    "zha_ws" : ", ".join("zha." + column for column in LINK_COLUMNS),
+    }
+
+# sources whose rows are grouped into whole web socket calls, by retrieve_ts
+CALL_SCHEMAS = ("ws03", "ws04", "ws05")
+
+# where the addresses, the names and the site are in a migrated row
+COLUMN_NEIGHBOR = LINK_COLUMNS.index("neighbor_address")
+COLUMN_PEER = LINK_COLUMNS.index("peer_address")
+NEIGHBOR_NAME = len(LINK_COLUMNS)
+PEER_NAME = NEIGHBOR_NAME + 1
+SITE = PEER_NAME + 1
+
+
+def connect_source(source_file) :
+    return sqlite3.connect("file:" + urllib.parse.quote(source_file) + "?mode=ro", uri=True)
+
+
+# which version of the programs wrote the zha table of a database
+def detect_schema(sql_conn) :
+    columns = set(row[1] for row in sql_conn.execute("PRAGMA table_info(zha)"))
+    if not columns :
+        raise ValueError("no zha table")
+    if "neighbor_given_name" in columns :
+        return "ws07"
+    if "neighbor_address" in columns :
+        return "zha_ws"
+    if "peer_address" in columns :
+        return "ws06"
+    if "user_given_name" in columns :
+        return "ws04" if "attributes" in columns else "ws05"
+    if "attributes" in columns :
+        return "ws03"
+    raise ValueError("unknown zha table, columns : " + ", ".join(sorted(columns)))
+
+
+# the tables of a source with rows to migrate, the zha table, then the partitions of zha_partition.py oldest first
+def source_tables(sql_conn, schema) :
+    if schema != "zha_ws" :
+        return ["zha"]
+    return ["zha"] + list(partition_tables(sql_conn).values())
+
+
+# the migrate_checkpoint source of one table of a source file, the zha table is the file itself
+def checkpoint_source(source, table) :
+    return source if table == "zha" else source + ":" + table
+
+
+# the select of a chunk of rows after a rowid, the first column is the rowid
+# table : the zha table, or a partition of a zha_ws source, it is read as 'zha'
+def source_select(sql_conn, schema, table="zha") :
+    if schema in ("ws03", "ws04") :
+        columns = [row[1] for row in sql_conn.execute("PRAGMA table_info(zha)")]
+        tables = [row[0] for row in sql_conn.execute("select name from sqlite_master where type = 'table'")]
+        attributes = "coalesce(zha.attributes, (select b.attributes from device_blob b where b.blob_hash = zha.attributes_hash))" \
+            if "attributes_hash" in columns and "device_blob" in tables else "zha.attributes"
+        return "select zha.rowid, zha.retrieve_ts, " + attributes + " from zha where zha.rowid > ? order by zha.rowid limit ?"
+    if schema == "zha_ws" :
+        columns = [row[1] for row in sql_conn.execute("PRAGMA table_info(" + table + ")")]
+        tables = [row[0] for row in sql_conn.execute("select name from sqlite_master where type = 'table'")]
+        site = ", coalesce(zha.site, ?)" if "site" in columns else ", ?"
+        # the names are the ones in zha_device_name now, zha_ws.py never kept them per row
+        if "zha_device_name" in tables :
+            return "select zha.rowid, " + SOURCE_COLUMNS[schema] + ", neighbor_name.device_given_name, peer_name.device_given_name" + site + \
+                " from " + table + " zha left join zha_device_name neighbor_name on neighbor_name.device_address = zha.neighbor_address" \
+                " left join zha_device_name peer_name on peer_name.device_address = zha.peer_address" \
+                " where zha.rowid > ? order by zha.rowid limit ?"
+        return "select zha.rowid, " + SOURCE_COLUMNS[schema] + ", null, null" + site + " from " + table + " zha where zha.rowid > ? order by zha.rowid limit ?"
+    return "select rowid, " + SOURCE_COLUMNS[schema] + ", ? from zha where rowid > ? order by rowid limit ?"
+
+
+# the rows of one ws03 / ws04 web socket call, the device json run through the processor
+def process_call(processor, schema, packet, retrieve_ts, texts, site) :
+    retrieve_time = datetime.fromtimestamp(retrieve_ts) if schema == "ws03" else datetime.fromisoformat(retrieve_ts)
+    # ws04 has the json of a device on each of its neighbor rows
+    devices = [json.loads(text) for text in dict.fromkeys(texts) if text is not None]
+    if processor.setup_pass :
+        # the first call only fills the processor's device database, so it goes through twice
+        processor.process(packet, retrieve_time, devices)
+    snapshot = processor.process(packet, retrieve_time, devices)
+    return [tuple(zha_values(link)) + (link.neighbor_given_name, link.peer_given_name, site) for link in snapshot.links]
+
+
+# the rows of whole web socket calls of a ws03 / ws04 / ws05 source, the rows are (rowid, retrieve_ts, ...)
+def call_rows(processor, schema, packet, rows, site) :
+    migrated = []
+    start = 0
+    for ii in range(1, len(rows) + 1) :
+        if ii == len(rows) or rows[ii][1] != rows[start][1] :
+            if schema == "ws05" :
+                migrated.extend((packet,) + row[1 :] for row in rows[start : ii])
+            else :
+                migrated.extend(process_call(processor, schema, packet, rows[start][1], [row[2] for row in rows[start : ii]], site))
+            packet += 1
+            start = ii
+    return migrated, packet
+
+
+# read one table of a source file from the rowid after last_rowid, yields (rows, last_rowid, packet) for each
+# chunk, last_rowid and packet are where to start from again
+def read_chunks(source_file, schema=None, last_rowid=0, packet=0, chunk_rows=50000, site=None, table="zha") :
+    sql_conn = connect_source(source_file)
+    try :
+        schema = schema or detect_schema(sql_conn)
+        select = source_select(sql_conn, schema, table)
+        parameters = (site,) if schema not in ("ws03", "ws04") else ()
+        processor = ZhaProcessor()
+        # rows of a web socket call that is not complete yet, read again after a restart
+        pending = []
+        read_rowid = last_rowid
+        while True :
+            rows = sql_conn.execute(select, parameters + (read_rowid, chunk_rows)).fetchall()
+            if schema not in CALL_SCHEMAS :
+                if not rows :
+                    break
+                read_rowid = last_rowid = rows[-1][0]
+                yield [row[1 :] for row in rows], last_rowid, packet
+                continue
+            if rows :
+                read_rowid = rows[-1][0]
+                pending.extend(rows)
+                # up to the start of the last call, which may go on in the next chunk
+                cut = len(pending)
+                while cut > 0 and pending[cut - 1][1] == pending[-1][1] :
+                    cut -= 1
+            else :
+                cut = len(pending)
+            if cut > 0 :
+                complete, pending = pending[: cut], pending[cut :]
+                migrated, packet = call_rows(processor, schema, packet, complete, site)
+                last_rowid = complete[-1][0]
+                yield migrated, last_rowid, packet
+            if not rows :
+                break
+    finally :
+        sql_conn.close()
+
+
+# reader process, reads the sources in task_queue until it gets None, the chunks go to result_queue
+def reader(task_queue, result_queue, chunk_rows, site) :
+    while True :
+        task = task_queue.get()
+        if task is None :
+            break
+        checkpoint, source, table, schema, last_rowid, packet = task
+        try :
+            for rows, last_rowid, packet in read_chunks(source, schema, last_rowid, packet, chunk_rows, site, table) :
+                result_queue.put(("rows", checkpoint, rows, last_rowid, packet))
+            result_queue.put(("done", checkpoint, None, last_rowid, packet))
+        except Exception :
+            result_queue.put(("error", checkpoint, traceback.format_exc(), last_rowid, packet))
+
+
+class ZhaMigration :
+
+    # schema : "wide" for the zha table, "normalized" for zha_normalized.py
+    # chunk_rows : rows read per chunk, and per transaction of the writer
+    # workers : reader processes, 0 reads in this process
+    # site : site of the rows of sources that have none
+    def __init__(self, target_file, schema="wide", chunk_rows=50000, workers=2, site=None, pragmas=None) :
+        if schema not in ("wide", "normalized") :
+            raise ValueError("unknown migration target schema : " + str(schema))
+        self.target_file = target_file
+        self.schema = schema
+        self.chunk_rows = chunk_rows
+        self.workers = workers
+        self.site = site
+        self.pragmas = pragmas if pragmas is not None else {"journal_mode" : "wal", "synchronous" : "normal"}
+        self.store = None
+        # source -> [source_schema, last_rowid, packet, rows, done] as in the migrate_checkpoint table, the source of
+        # a partition of a zha_ws database is checkpoint_source()
+        self.checkpoints = {}
+        # source -> traceback of the sources that failed
+        self.errors = {}
+        # statistics
+        self.rows_written = 0
+
+    def open(self) :
+        if self.schema == "normalized" :
+            self.store = NormalizedZhaStore(self.target_file, pragmas=self.pragmas).open()
+        else :
+            self.store = ZhaStore(self.target_file, pragmas=self.pragmas).open()
+        self.store.sql_conn.execute(MIGRATE_CHECKPOINT_TABLE)
+        self.store.sql_conn.commit()
+        for row in self.store.sql_conn.execute("select source, source_schema, last_rowid, packet, rows, done from migrate_checkpoint") :
+            self.checkpoints[row[0]] = list(row[1 :])
+        return self
+
+    def close(self) :
+        if self.store is not None :
+            self.store.close()
+            self.store = None
+
+    # the rows of one chunk and the checkpoint of its source, in one transaction
+    def write(self, source, rows, last_rowid, packet, done=False) :
+        sql_conn = self.store.sql_conn
+        if self.schema == "normalized" :
+            sql_conn.executemany(LINK_INSERT, [self.store.link_values(row, row[SITE], row[NEIGHBOR_NAME], row[PEER_NAME]) for row in rows])
+        else :
+            sql_conn.executemany(ZHA_INSERT, [row[: NEIGHBOR_NAME] + (row[SITE],) for row in rows])
+            names = {}
+            for row in rows :
+                if row[NEIGHBOR_NAME] is not None :
+                    names[row[COLUMN_NEIGHBOR]] = row[NEIGHBOR_NAME]
+                if row[PEER_NAME] is not None and row[COLUMN_PEER] is not None :
+                    names[row[COLUMN_PEER]] = row[PEER_NAME]
+            names = [(address, name) for address, name in names.items() if self.store.device_names.get(address) != name]
+            if names :
+                sql_conn.executemany(ZHA_DEVICE_NAME_UPSERT, names)
+                self.store.device_names.update(names)
+        checkpoint = self.checkpoints[source]
+        checkpoint[1 :] = [last_rowid, packet, checkpoint[3] + len(rows), 1 if done else 0]
+        sql_conn.execute("insert or replace into migrate_checkpoint values (?, ?, ?, ?, ?, ?)", [source] + checkpoint)
+        sql_conn.commit()
+        self.store.commits += 1
+        self.rows_written += len(rows)
+
+    # migrate the source files, progress(source, rows of that source) after each chunk, returns the rows written
+    # the source of the progress and of the errors is checkpoint_source(), a partition has its own
+    def run(self, sources, progress=None) :
+        tasks = []
+        for source_file in sources :
+            source = os.path.abspath(source_file)
+            if source in self.checkpoints and self.checkpoints[source][0] != "zha_ws" :
+                source_schema, last_rowid, packet, rows, done = self.checkpoints[source]
+                if not done :
+                    tasks.append((source, source, "zha", source_schema, last_rowid, packet))
+                continue
+            # a zha_ws source is opened every time, its partitions are only known from the file
+            sql_conn = connect_source(source)
+            try :
+                source_schema = detect_schema(sql_conn)
+                tables = source_tables(sql_conn, source_schema)
+            except ValueError as e :
+                self.errors[source] = str(e)
+                continue
+            finally :
+                sql_conn.close()
+            for table in tables :
+                checkpoint = checkpoint_source(source, table)
+                if checkpoint not in self.checkpoints :
+                    self.checkpoints[checkpoint] = [source_schema, 0, 0, 0, 0]
+                source_schema, last_rowid, packet, rows, done = self.checkpoints[checkpoint]
+                if not done :
+                    tasks.append((checkpoint, source, table, source_schema, last_rowid, packet))
+
+        if self.workers <= 0 :
+            for checkpoint, source, table, source_schema, last_rowid, packet in tasks :
+                for rows, last_rowid, packet in read_chunks(source, source_schema, last_rowid, packet, self.chunk_rows, self.site, table) :
+                    self.write(checkpoint, rows, last_rowid, packet)
+                    if progress is not None :
+                        progress(checkpoint, self.checkpoints[checkpoint][3])
+                self.write(checkpoint, [], last_rowid, packet, done=True)
+            return self.rows_written
+
+        # the queue of chunks is bounded, readers wait for the writer, at most about two chunks per reader are in memory
+        task_queue = multiprocessing.Queue()
+        result_queue = multiprocessing.Queue(maxsize=2 * self.workers)
+        for task in tasks :
+            task_queue.put(task)
+        processes = []
+        for ii in range(min(self.workers, len(tasks))) :
+            task_queue.put(None)
+            process = multiprocessing.Process(target=reader, args=(task_queue, result_queue, self.chunk_rows, self.site), daemon=True)
+            process.start()
+            processes.append(process)
+
+        remaining = len(tasks)
+        try :
+            while remaining > 0 :
+                try :
+                    kind, source, rows, last_rowid, packet = result_queue.get(timeout=1)
+                except queue.Empty :
+                    if not any(process.is_alive() for process in processes) :
+                        raise RuntimeError("migration reader processes ended with " + str(remaining) + " sources not done")
+                    continue
+                if kind == "rows" :
+                    self.write(source, rows, last_rowid, packet)
+                    if progress is not None :
+                        progress(source, self.checkpoints[source][3])
+                elif kind == "done" :
+                    self.write(source, [], last_rowid, packet, done=True)
+                    remaining -= 1
+                else :
+                    self.errors[source] = rows
+                    remaining -= 1
+        finally :
+            for process in processes :
+                if process.is_alive() and remaining > 0 :
+                    process.terminate()
+                process.join()
+        return self.rows_written
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="migrate ws03 .. ws08 and zha_ws.py databases into the zha_ws.py schema")
+    parser.add_argument("target", help="database to migrate into, zha_ws.db")
+    parser.add_argument("sources", nargs="+", help="databases to migrate from")
+    parser.add_argument("--schema", choices=("wide", "normalized"), default="wide", help="the zha table, or the normalized tables")
+    parser.add_argument("--workers", type=int, default=2, help="reader processes, 0 reads in this process")
+    parser.add_argument("--chunk", type=int, default=50000, help="rows per chunk and per transaction")
+    parser.add_argument("--site", default=None, help="site of the rows of sources that have no site column")
+    args = parser.parse_args()
+
+    for source in args.sources :
+        if os.path.abspath(source) == os.path.abspath(args.target) :
+            print("Error : " + source + " is the target database")
+            sys.exit(1)
+
+    migration = ZhaMigration(args.target, schema=args.schema, chunk_rows=args.chunk, workers=args.workers, site=args.site).open()
+    start = time.perf_counter()
+    try :
+        migration.run(args.sources, progress=lambda source, rows : print(f"\r{os.path.basename(source)} {rows} rows", end=" " * 10, flush=True))
+    except KeyboardInterrupt :
+        print("\ninterrupted, run again to carry on from the checkpoints")
+    finally :
+        migration.close()
+    elapsed = time.perf_counter() - start
+    print(f"\r{migration.rows_written} rows written in {elapsed:.1f}s ({migration.rows_written / max(elapsed, 1e-9):.0f} rows/s)" + " " * 20)
+    for source, (source_schema, last_rowid, packet, rows, done) in sorted(migration.checkpoints.items()) :
+        print(f"{source}  {source_schema:6s}  {rows} rows  " + ("done" if done else "to be continued, rowid " + str(last_rowid)))
+    for source, error in migration.errors.items() :
+        print("Error : " + source + " : " + error)
+    if migration.errors :
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+# zha_normalized.py
+
+# 202610182200
+# a row without a peer address (ws05.py rows migrated by zha_migrate.py) gets a null peer_id
+# 202610181700
+#
+# normalized schema for the zha neighbor 'link' history, 'schema : "normalized"' in zha_ws.yaml
+# the 'zha' table repeats the 23 character IEEE addresses, the device type, relationship and availability
+# strings and 'YYYY-MM-DD HH:MM:SS' timestamps on every row, here each row is integers only :
+#
+#  site          : site_id, name
+#  device        : device_id, ieee, given_name (the current name)
+#  device_type   : device_type_id, name         ('Router', 'EndDevice', 'Coordinator', '*')
+#  relationship  : relationship_id, name        ('Parent', 'Child', 'Sibling', 'None', 'none' ...)
+#  link          : one row per neighbor link per web socket call, ids for the above, availability 1 / 0 / null,
+#                  timestamps as unix epoch seconds
+#  zha_link_view : the link table joined back into the columns of the 'zha' table, with local time timestamps,
+#                  for queries written against the old table
+#
+# migrate a database of the 'zha' table into the normalized tables (the zha table is left as it is) :
+#
+#  python3 zha_normalized.py zha_ws.db                      # normalized tables in the same file
+#  python3 zha_normalized.py zha_ws.db zha_ws_normal.db     # into a new file
+
+import sys
+import time
+import sqlite3
+import argparse
+import urllib.parse
+from datetime import datetime
+
+from zha_process import LINK_COLUMNS
+from zha_store import ZhaStore
+
+
+SITE_TABLE = "CREATE TABLE IF NOT EXISTS site (site_id integer primary key, name text unique not null)"
+DEVICE_TABLE = "CREATE TABLE IF NOT EXISTS device (device_id integer primary key, ieee text unique not null, given_name text)"
+DEVICE_TYPE_TABLE = "CREATE TABLE IF NOT EXISTS device_type (device_type_id integer primary key, name text unique not null)"
+RELATIONSHIP_TABLE = "CREATE TABLE IF NOT EXISTS relationship (relationship_id integer primary key, name text unique not null)"
+LINK_TABLE = "CREATE TABLE IF NOT EXISTS link (packet integer, retrieve_ts integer, site_id integer, neighbor_id integer, neighbor_lqi integer, neighbor_rssi integer, neighbor_delta_last_seen real, neighbor_last_seen_ts integer, neighbor_device_type_id integer, neighbor_available integer, neighbor_depth integer, neighbor_relationship_id integer, peer_id integer, peer_nwk integer, peer_lqi integer, peer_rssi integer, peer_available integer)"
+
+LINK_VIEW = """CREATE VIEW IF NOT EXISTS zha_link_view AS SELECT link.packet,
+ datetime(link.retrieve_ts, 'unixepoch', 'localtime') AS retrieve_ts,
+ neighbor.ieee AS neighbor_address, link.neighbor_lqi, link.neighbor_rssi, link.neighbor_delta_last_seen,
+ datetime(link.neighbor_last_seen_ts, 'unixepoch', 'localtime') AS neighbor_last_seen_ts,
+ device_type.name AS neighbor_device_type,
+ CASE link.neighbor_available WHEN 1 THEN 'true' WHEN 0 THEN 'false' ELSE 'unk' END AS neighbor_available,
+ link.neighbor_depth, relationship.name AS neighbor_relationship,
+ link.peer_nwk, link.peer_lqi, link.peer_rssi,
+ CASE link.peer_available WHEN 1 THEN 'true' WHEN 0 THEN 'false' ELSE 'unk' END AS peer_available,
+ peer.ieee AS peer_address, site.name AS site, neighbor.given_name AS neighbor_given_name, peer.given_name AS peer_given_name
+ FROM link
+ LEFT JOIN device AS neighbor ON neighbor.device_id = link.neighbor_id
+ LEFT JOIN device AS peer ON peer.device_id = link.peer_id
+ LEFT JOIN device_type ON device_type.device_type_id = link.neighbor_device_type_id
+ LEFT JOIN relationship ON relationship.relationship_id = link.neighbor_relationship_id
+ LEFT JOIN site ON site.site_id = link.site_id"""
+
+LINK_INSERT = "insert into link values (" + ", ".join(["?"] * 17) + ")"
+
+# availability is recorded as the strings 'true' / 'false' / 'unk', and sometimes as booleans
+AVAILABLE_CODES = {'true' : 1, 'false' : 0, 'True' : 1, 'False' : 0, True : 1, False : 0}
+
+# where each value is in a row of the 'zha' table, and in a zha_process.LinkRow
+COLUMN = dict((name, ii) for ii, name in enumerate(LINK_COLUMNS))
+
+
+# lqi, depth and nwk come from HA as numbers or as strings of numbers
+def to_int(value) :
+    if value is None or value == "" or value == "None" :
+        return None
+    return int(value)
+
+
+# unix epoch seconds of a local time datetime, or of one stored as 'YYYY-MM-DD HH:MM:SS'
+def to_epoch(value) :
+    if value is None :
+        return None
+    if isinstance(value, str) :
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp())
+
+
+class NormalizedZhaStore(ZhaStore) :
+
+    def __init__(self, database_file, **settings) :
+        super().__init__(database_file, **settings)
+        # name -> id of the lookup tables, all kept in memory, they are small
+        self.site_ids = {}
+        self.device_ids = {}
+        self.device_names = {}
+        self.device_type_ids = {}
+        self.relationship_ids = {}
+
+    def create_tables(self, sql_cursor) :
+        for table in (SITE_TABLE, DEVICE_TABLE, DEVICE_TYPE_TABLE, RELATIONSHIP_TABLE, LINK_TABLE, LINK_VIEW) :
+            sql_cursor.execute(table)
+        self.site_ids = dict(sql_cursor.execute("select name, site_id from site").fetchall())
+        self.device_type_ids = dict(sql_cursor.execute("select name, device_type_id from device_type").fetchall())
+        self.relationship_ids = dict(sql_cursor.execute("select name, relationship_id from relationship").fetchall())
+        for device_id, ieee, given_name in sql_cursor.execute("select device_id, ieee, given_name from device") :
+            self.device_ids[ieee] = device_id
+            self.device_names[ieee] = given_name
+
+    # id for a name of a lookup table, added to the table the first time it is seen
+    def lookup(self, ids, table, name) :
+        if name is None :
+            return None
+        if name not in ids :
+            ids[name] = self.sql_conn.execute("insert into " + table + " (name) values (?)", (name,)).lastrowid
+        return ids[name]
+
+    # id for a device, its name is kept current, None for a name not known leaves the name as it is
+    # rows migrated from ws05.py have no peer, no address is a null id
+    def device_id(self, ieee, given_name) :
+        if ieee is None :
+            return None
+        if ieee not in self.device_ids :
+            self.device_ids[ieee] = self.sql_conn.execute("insert into device (ieee, given_name) values (?, ?)", (ieee, given_name)).lastrowid
+            self.device_names[ieee] = given_name
+        elif given_name is not None and given_name != self.device_names[ieee] :
+            self.sql_conn.execute("update device set given_name = ? where device_id = ?", (given_name, self.device_ids[ieee]))
+            self.device_names[ieee] = given_name
+        return self.device_ids[ieee]
+
+    # the values of a link table row, from a row in the order of the 'zha' table (a zha_process.LinkRow or a
+    # row read from the table)
+    def link_values(self, row, site, neighbor_given_name=None, peer_given_name=None) :
+        return (row[COLUMN["packet"]], \
+            to_epoch(row[COLUMN["retrieve_ts"]]), \
+            self.lookup(self.site_ids, "site", site), \
+            self.device_id(row[COLUMN["neighbor_address"]], neighbor_given_name), \
+            to_int(row[COLUMN["neighbor_lqi"]]), \
+            to_int(row[COLUMN["neighbor_rssi"]]), \
+            row[COLUMN["neighbor_delta_last_seen"]], \
+            to_epoch(row[COLUMN["neighbor_last_seen_ts"]]), \
+            self.lookup(self.device_type_ids, "device_type", row[COLUMN["neighbor_device_type"]]), \
+            AVAILABLE_CODES.get(row[COLUMN["neighbor_available"]]), \
+            to_int(row[COLUMN["neighbor_depth"]]), \
+            self.lookup(self.relationship_ids, "relationship", row[COLUMN["neighbor_relationship"]]), \
+            self.device_id(row[COLUMN["peer_address"]], peer_given_name), \
+            to_int(row[COLUMN["peer_nwk"]]), \
+            to_int(row[COLUMN["peer_lqi"]]), \
+            to_int(row[COLUMN["peer_rssi"]]), \
+            AVAILABLE_CODES.get(row[COLUMN["peer_available"]]))
+
+    def insert_links(self, snapshot) :
+        site = snapshot.site
+        self.sql_conn.executemany(LINK_INSERT, [self.link_values(link, site, link.neighbor_given_name, link.peer_given_name) \
+            for link in snapshot.links])
+        return len(snapshot.links)
+
+
+# copy the 'zha' table (and the names in zha_device_name) of source_file into the normalized tables of store
+# reads chunk_rows rows at a time by rowid, and commits after each chunk, returns the number of rows copied
+def migrate(source_file, store, chunk_rows=50000, progress=None) :
+
+    source = sqlite3.connect("file:" + urllib.parse.quote(source_file) + "?mode=ro", uri=True)
+    try :
+        tables = [row[0] for row in source.execute("select name from sqlite_master where type = 'table'")]
+        names = dict(source.execute("select device_address, device_given_name from zha_device_name").fetchall()) \
+            if "zha_device_name" in tables else {}
+        columns = [row[1] for row in source.execute("PRAGMA table_info(zha)")]
+        select = "select rowid, " + ", ".join(LINK_COLUMNS) + (", site" if "site" in columns else ", null") + \
+            " from zha where rowid > ? order by rowid limit ?"
+
+        rows_copied = 0
+        last_rowid = 0
+        while True :
+            rows = source.execute(select, (last_rowid, chunk_rows)).fetchall()
+            if not rows :
+                break
+            last_rowid = rows[-1][0]
+            store.sql_conn.executemany(LINK_INSERT, [store.link_values(row[1:], row[-1], names.get(row[1 + COLUMN["neighbor_address"]])) \
+                for row in rows])
+            store.sql_conn.commit()
+            store.commits += 1
+            rows_copied += len(rows)
+            if progress is not None :
+                progress(rows_copied)
+        store.rows_written += rows_copied
+        return rows_copied
+    finally :
+        source.close()
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="copy the zha table of a zha_ws.py database into the normalized schema")
+    parser.add_argument("source", help="database with the zha table")
+    parser.add_argument("target", nargs="?", default=None, help="database for the normalized tables, default the source database")
+    parser.add_argument("--chunk", type=int, default=50000, help="rows per transaction")
+    args = parser.parse_args()
+
+    store = NormalizedZhaStore(args.target or args.source, pragmas={"journal_mode" : "wal", "synchronous" : "normal"}).open()
+    if store.sql_conn.execute("select count(*) from link").fetchone()[0] > 0 :
+        print("Error : " + (args.target or args.source) + " already has rows in the link table, not migrating twice")
+        store.close()
+        sys.exit(1)
+
+    start = time.perf_counter()
+    rows = migrate(args.source, store, chunk_rows=args.chunk, progress=lambda rows : print(f"\r{rows} rows", end="", flush=True))
+    store.close()
+    print(f"\r{rows} rows copied in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
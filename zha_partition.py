@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# zha_partition.py
+
+# 202610181900
+# query_indexes, the indexes of zha_queries.py on each new partition
+# 202610181830
+#
+# time partitioned zha history, 'partition_period' and 'retention_days' in zha_ws.yaml
+# the rows of each day (or week, or month) go into a table of their own, zha_pYYYYMMDD named for the first day
+# of the period, and the zha_history view puts all of them, and the zha table of the rows from before, together
+# as one table with the columns of the zha table
+#
+# old history is expired a whole partition at a time with DROP TABLE, never with row deletes, so expiry takes
+# about as long as one insert and there is nothing for a VACUUM to do, sqlite reuses the pages of the dropped
+# table for new rows, the file stops growing instead of shrinking
+# at most one partition is dropped per web socket call, inside the same transaction as its rows
+# the zha table of the rows from before partitioning is not expired, drop it by hand once it is too old
+#
+# queries over a time range can skip the partitions outside of it, history_sql() gives the union of only
+# the partitions that can hold rows in the range
+
+from datetime import datetime, timedelta
+
+from zha_store import ZhaStore, ZHA_TABLE, sql_value
+from zha_queries import INDEXES
+
+
+PARTITION_PREFIX = "zha_p"
+PARTITION_TABLE = ZHA_TABLE[: -1].replace("EXISTS zha (", "EXISTS {table} (") + ", site text)"
+PARTITION_INDEX = "CREATE INDEX IF NOT EXISTS {table}_retrieve_ts ON {table} (retrieve_ts)"
+HISTORY_VIEW = "zha_history"
+
+# the columns of the zha table, the view lists them so every part of the union is in the same order
+HISTORY_COLUMNS = "packet, retrieve_ts, neighbor_address, neighbor_lqi, neighbor_rssi, neighbor_delta_last_seen, neighbor_last_seen_ts, " \
+    "neighbor_device_type, neighbor_available, neighbor_depth, neighbor_relationship, peer_nwk, peer_lqi, peer_rssi, peer_available, " \
+    "peer_address, site"
+
+PARTITION_PERIODS = ("day", "week", "month")
+
+
+# first day of the period a local time datetime is in
+def period_start(when, period) :
+    day = datetime(when.year, when.month, when.day)
+    if period == "week" :
+        return day - timedelta(days=day.weekday())
+    if period == "month" :
+        return day.replace(day=1)
+    return day
+
+
+# first day of the period after the one that starts on 'start'
+def period_end(start, period) :
+    if period == "week" :
+        return start + timedelta(days=7)
+    if period == "month" :
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def partition_name(start) :
+    return PARTITION_PREFIX + start.strftime("%Y%m%d")
+
+
+# {first day : table} of the partitions in the database, oldest first
+def partition_tables(sql_conn) :
+    partitions = {}
+    for (table,) in sql_conn.execute("select name from sqlite_master where type = 'table' and name like ? order by name", (PARTITION_PREFIX + "%",)) :
+        try :
+            partitions[datetime.strptime(table[len(PARTITION_PREFIX) :], "%Y%m%d")] = table
+        except ValueError :
+            continue
+    return partitions
+
+
+# a sub query of the history from start to end (datetimes or 'YYYY-MM-DD HH:MM:SS', None for no limit), only the
+# partitions that can hold rows of the range, and the zha table of the rows from before partitioning, returns
+# (sql, parameters), the parameters bind the bounds of each table of the union, to use like
+#  sql, parameters = history_sql(sql_conn, start, end, "day")
+#  sql_conn.execute("select ... from " + sql + " where ...", parameters + [...])
+def history_sql(sql_conn, start=None, end=None, period="day") :
+    if isinstance(start, str) :
+        start = datetime.fromisoformat(start)
+    if isinstance(end, str) :
+        end = datetime.fromisoformat(end)
+    tables = ["zha"] if sql_conn.execute("select 1 from sqlite_master where type = 'table' and name = 'zha'").fetchone() else []
+    for first_day, table in partition_tables(sql_conn).items() :
+        if (end is None or first_day <= end) and (start is None or period_end(first_day, period) > start) :
+            tables.append(table)
+    where = []
+    bounds = []
+    if start is not None :
+        where.append("retrieve_ts >= ?")
+        bounds.append(sql_value(start))
+    if end is not None :
+        where.append("retrieve_ts <= ?")
+        bounds.append(sql_value(end))
+    where = (" where " + " and ".join(where)) if where else ""
+    if not tables :
+        return "(select " + HISTORY_COLUMNS + " from zha where 0)", []
+    return "(" + " union all ".join("select " + HISTORY_COLUMNS + " from " + table + where for table in tables) + ")", \
+        bounds * len(tables)
+
+
+class PartitionedZhaStore(ZhaStore) :
+
+    # partition_period : "day", "week" or "month"
+    # retention_days : partitions that end more than this many days ago are dropped, 0 keeps everything
+    # query_indexes : each partition also gets the indexes of the queries of zha_queries.py
+    def __init__(self, database_file, partition_period="day", retention_days=0, query_indexes=False, **settings) :
+        if partition_period not in PARTITION_PERIODS :
+            raise ValueError("unknown partition period : " + str(partition_period))
+        super().__init__(database_file, **settings)
+        self.partition_period = partition_period
+        self.retention_days = retention_days
+        self.query_indexes = query_indexes
+        # {first day : table} of the partitions
+        self.partitions = {}
+        # the partition of the last web socket call, and when it ends
+        self.current = None
+        self.current_end = None
+        # statistics
+        self.partitions_dropped = 0
+
+    def create_tables(self, sql_cursor) :
+        super().create_tables(sql_cursor)
+        self.partitions = partition_tables(sql_cursor)
+        self.create_view(sql_cursor)
+
+    def create_view(self, sql_cursor) :
+        sql_cursor.execute("DROP VIEW IF EXISTS " + HISTORY_VIEW)
+        tables = ["zha"] + list(self.partitions.values())
+        sql_cursor.execute("CREATE VIEW " + HISTORY_VIEW + " AS " + " union all ".join("select " + HISTORY_COLUMNS + " from " + table for table in tables))
+
+    def link_table(self, snapshot) :
+        if self.current is None or snapshot.retrieve_time >= self.current_end or snapshot.retrieve_time < self.current[0] :
+            start = period_start(snapshot.retrieve_time, self.partition_period)
+            if start not in self.partitions :
+                table = partition_name(start)
+                self.sql_conn.execute(PARTITION_TABLE.format(table=table))
+                self.sql_conn.execute(PARTITION_INDEX.format(table=table))
+                if self.query_indexes :
+                    for index in INDEXES :
+                        self.sql_conn.execute(index.format(table=table))
+                self.partitions = dict(sorted(list(self.partitions.items()) + [(start, table)]))
+                self.create_view(self.sql_conn.cursor())
+            self.current = (start, self.partitions[start])
+            self.current_end = period_end(start, self.partition_period)
+        return self.current[1]
+
+    def insert_links(self, snapshot) :
+        rows = super().insert_links(snapshot)
+        if self.retention_days > 0 :
+            self.expire(snapshot.retrieve_time - timedelta(days=self.retention_days))
+        return rows
+
+    # drop the oldest partition if all of it is from before 'cutoff', one per call keeps each call short
+    def expire(self, cutoff) :
+        for start, table in self.partitions.items() :
+            if period_end(start, self.partition_period) <= cutoff and table != self.current[1] :
+                self.sql_conn.execute("DROP TABLE " + table)
+                del self.partitions[start]
+                self.create_view(self.sql_conn.cursor())
+                self.partitions_dropped += 1
+            return
+
+
+# EOF
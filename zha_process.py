@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+# zha_process.py
+
+# 202610190200
+# the routes of each device to the coordinator, its child load and the devices stranded if it goes away, from
+# zha_routes.MeshRoutes, are in the snapshot as routes
+# 202610190100
+# the neighbor tables are kept in the zha_graph.NeighborGraph, which takes the place of neighbor_db and gives
+# is_neighbor, a device is a neighbor while some device has it in its table, no longer once and for all, and
+# entries gone from a table no longer give a stale uplink lqi, online devices no one hears are in the snapshot
+# as orphaned
+# 202610190030
+# device_db is a zha_registry.DeviceRegistry of slotted records updated in place, the snapshot devices and the
+# offline devices are DeviceRecord copies
+# 202610182345
+# the devices are decoded into the slotted Device / Neighbor records of zha_decode.py, json dicts passed in are
+# converted, and the input is no longer changed, an end device gets its fake neighbor without it being added
+# to the device's neighbor list
+# 202610182000
+# manufacturer, model and power_source of each device are kept in device_db, for zha_device_history.py
+# 202610181015
+#
+# turn the json result of a ZHA 'zha/devices' web socket call into our in memory database of zigbee devices
+# and into the neighbor 'link' rows that zha_ws.py displays and records in the SQLite database
+# this is the device / neighbor logic that used to live inside the main() loop of zha_ws.py, pulled out
+# so the collector, benchmarks and other tools can all run exactly the same processing
+
+from collections import namedtuple
+
+from zha_decode import Neighbor, device_records
+from zha_registry import DeviceRegistry, unknown_device
+from zha_graph import NeighborGraph
+from zha_routes import MeshRoutes
+
+
+# one row per (neighbor, device) pair found in a web socket call
+# the first 16 fields are the columns of the 'zha' table in the SQLite database, in table order
+# the remaining fields are only needed to display the row on the console
+LINK_COLUMNS = ("packet", "retrieve_ts", "neighbor_address", "neighbor_lqi", "neighbor_rssi", "neighbor_delta_last_seen", \
+    "neighbor_last_seen_ts", "neighbor_device_type", "neighbor_available", "neighbor_depth", "neighbor_relationship", \
+    "peer_nwk", "peer_lqi", "peer_rssi", "peer_available", "peer_address")
+
+LinkRow = namedtuple("LinkRow", LINK_COLUMNS + ("neighbor_given_name", "neighbor_db_device_type", "delta_last_seen", \
+    "peer_given_name", "peer_device_type", "peer_is_neighbor"))
+
+# number of LinkRow fields that are stored in the 'zha' table
+ZHA_COLUMN_COUNT = len(LINK_COLUMNS)
+
+
+# everything that came out of one web socket call, this is what gets passed from the processing step
+# to the display and database steps
+class Snapshot :
+
+    __slots__ = ("packet", "retrieve_time", "setup_pass", "links", "offline", "devices", "raw", "site", "orphaned", "routes")
+
+    def __init__(self, packet, retrieve_time, setup_pass=False, links=None, offline=None, devices=None, raw=None, site=None, \
+        orphaned=None, routes=None) :
+        # web socket call identifier, decremented by 1 to align with json entities starting at zero
+        self.packet = packet
+        self.retrieve_time = retrieve_time
+        # True on the first pass, which only populates the in memory database
+        self.setup_pass = setup_pass
+        # list of LinkRow
+        self.links = links if links is not None else []
+        # list of zha_registry.DeviceRecord of the devices that ZHA reports as not available
+        self.offline = offline if offline is not None else []
+        # IEEE address -> zha_registry.DeviceRecord, device_db as it was at the end of processing this web socket call
+        self.devices = devices if devices is not None else {}
+        # the raw web socket string, only kept when the raw json is being archived
+        self.raw = raw
+        # name of the Home Assistant site this came from
+        self.site = site
+        # list of zha_registry.DeviceRecord of the devices ZHA reports as available that are in no neighbor table
+        self.orphaned = orphaned if orphaned is not None else []
+        # dict of IEEE address -> zha_routes.Route of each device
+        self.routes = routes if routes is not None else {}
+
+
+# if the device has NO neighbors, then create a fake neighbor, these are end devices
+def fake_neighbor(device_lqi) :
+    return Neighbor("00:00:00:00:00:00:00:00", "*", "none", 0, device_lqi)
+
+
+# holds the in memory state that is carried from one web socket call to the next
+class ZhaProcessor :
+
+    def __init__(self) :
+        # we will create a database of zigbee devices that are returned by the web socket call to ZHA, see zha_registry.py
+        # we keep appending on new entries with each web socket call
+        self.device_db = DeviceRegistry()
+        # the neighbor tables of all devices, see zha_graph.py
+        self.graph = NeighborGraph()
+        # paths to the coordinator and single points of failure, kept up to date from the changes of the graph
+        self.routes = MeshRoutes(self.graph)
+        # do one processing pass on the first ZHA web socket call to populate the devices
+        self.setup_pass = True
+
+    # process the 'result' list of one successful 'zha/devices' web socket call, zha_decode.Device records
+    # or the json dicts
+    def process(self, packet, retrieve_time, devices) :
+
+        devices = device_records(devices)
+        device_db = self.device_db
+        graph = self.graph
+        setup_pass = self.setup_pass
+        links = []
+        coordinator = None
+
+        # remove from device database devices that do not show up in current retrieval from ZHA web socket call
+        for ieee in device_db.retain(set(device.ieee for device in devices)) :
+            graph.remove(ieee)
+
+        # this is a 'fake' record of database, so we can retrieve 'default' values from it, if the device is not there
+        template = unknown_device(retrieve_time)
+
+        # retrieve each device that was returned in current web socket call
+        for device in devices :
+            if device.available :
+                device_status = "true"
+            else :
+                device_status = "false"
+
+            # update or add the current info for the device retrieved from the ZHA web socket call
+            record = device_db.record(device.ieee)
+            record.user_given_name = device.user_given_name
+            record.last_seen = device.last_seen
+            record.device_type = device.device_type
+            record.nwk = device.nwk
+            record.lqi = device.lqi
+            record.rssi = device.rssi
+            record.available = device_status
+            record.manufacturer = device.manufacturer
+            record.model = device.model
+            record.power_source = device.power_source
+            if device.device_type == "Coordinator" :
+                coordinator = device.ieee
+
+            # the neighbor table of this device replaces the one of the call before, the tables of the devices not
+            # yet walked in this call are still those of the call before
+            graph.set_neighbors(device.ieee, device.neighbors)
+            # whether the device is found to be the neighbor of another device on network
+            record.is_neighbor = "false" if graph.is_orphaned(device.ieee) else "true"
+
+            neighbors = device.neighbors
+            if len(neighbors) == 0 :
+                neighbors = [fake_neighbor(device.lqi)]
+
+            # iterate thru each neighbor of the device returned
+            # so basically we are going to display / find / 'pull up' / extract the network of devices by the neighbor connections
+            for neighbor in neighbors :
+
+                # don't display or record in db anything for the first web socket, we is this pass just to populate in memory database
+                if setup_pass :
+                    continue
+
+                neighbor_record = device_db.get(neighbor.ieee, template)
+                peer_record = record
+
+                # calculate the time delta from this retrieve from ZHA web socket to when this devices was last seen, decimal minutes
+                # if this is a end device then calculate it's last seen delta from it's device record, not a neighbor record
+                if neighbor.device_type == "*" :
+                    delta_last_seen = retrieve_time - peer_record.last_seen
+                else :
+                    delta_last_seen = retrieve_time - neighbor_record.last_seen
+
+                # 'up link' from neighbor to peer, end devices will not have this link
+                uplink = graph.edge(neighbor.ieee, device.ieee)
+                neighbor_lqi = uplink.lqi if uplink is not None else 0
+
+                # NOTE: the last_seen time delta and timestamp, may be from prior record, not this web socket call
+                # because if we have not processed the main entry for this device on this web socket call
+                # these value remain from the prior web socket call, this is an aberation of walking thru
+                # the devices by their neighbor relationship.
+                links.append(LinkRow(packet, \
+                    retrieve_time, \
+                    str(neighbor.ieee), \
+                    neighbor_lqi, \
+                    neighbor_record.rssi, \
+                    delta_last_seen.seconds/60.0, \
+                    neighbor_record.last_seen, \
+                    neighbor.device_type, \
+                    neighbor_record.available, \
+                    neighbor.depth, \
+                    neighbor.relationship, \
+                    device.nwk, \
+                    neighbor.lqi, \
+                    peer_record.rssi, \
+                    peer_record.available, \
+                    str(device.ieee), \
+                    str(neighbor_record.user_given_name), \
+                    str(neighbor_record.device_type), \
+                    delta_last_seen, \
+                    str(device.user_given_name), \
+                    peer_record.device_type, \
+                    peer_record.is_neighbor))
+
+        # now that all the tables of this call are in, a device that is not in any other devices neighbor table is
+        # not a neighbor
+        for record in device_db.values() :
+            record.is_neighbor = "false" if graph.is_orphaned(record.ieee) else "true"
+
+        # display a line for all the device which are offline, the coordinator seems to put itself 'offline', so we
+        # ignore if coordinator says it is 'offline', if that were case, network would be 'offline'
+        # and one for each device that says it is online but that no other device hears
+        snapshot_devices = device_db.snapshot()
+        routes = self.routes.update(coordinator, snapshot_devices)
+        offline = []
+        orphaned = []
+        if not setup_pass :
+            for record in snapshot_devices.values() :
+                if record.device_type == "Coordinator" :
+                    continue
+                if record.available == "false" :
+                    offline.append(record)
+                elif record.is_neighbor == "false" :
+                    orphaned.append(record)
+
+        # reset of 1st pass thru web socket retreval flag
+        self.setup_pass = False
+
+        return Snapshot(packet, retrieve_time, setup_pass=setup_pass, links=links, offline=offline, devices=snapshot_devices, \
+            orphaned=orphaned, routes=routes)
+
+
+# EOF
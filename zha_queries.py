@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# zha_queries.py
+
+# 202610181900
+#
+# the common questions asked of the zha history, as named queries with parameters, and the indexes they need
+# the zha table has no indexes of its own, without these every question is a scan of the whole table
+#
+#  link_history          : neighbor, peer, start, end      every call of one link, lqi / rssi / availability
+#  availability_timeline : device, start, end              the device's availability at each call
+#  worst_links           : start, end, limit               the links with the lowest average lqi in the window
+#  never_neighbor        : start, end                      devices in the window no other device lists as a neighbor
+#
+# start and end are 'YYYY-MM-DD HH:MM:SS' strings, or datetimes, like the retrieve_ts column
+#
+#  python3 zha_queries.py zha_ws.db --indexes --check          # create the indexes, show each query plan
+#  python3 zha_queries.py zha_ws.db worst_links start="2026-10-01 00:00:00" end="2026-10-08 00:00:00" limit=10
+#
+# the check is the self test of this module : every query has to be answered with an index, it reads each
+# query plan (EXPLAIN QUERY PLAN) and reports any query that scans the whole table
+
+import sys
+import time
+import sqlite3
+import argparse
+
+from zha_store import sql_value
+
+
+# {table} is the history table, the zha table, or a partition of zha_partition.py
+QUERIES = {
+    "link_history" : """select retrieve_ts, neighbor_lqi, peer_lqi, neighbor_rssi, neighbor_available, neighbor_relationship, neighbor_depth
+ from {table} where neighbor_address = :neighbor and peer_address = :peer and retrieve_ts >= :start and retrieve_ts <= :end
+ order by retrieve_ts""",
+
+    "availability_timeline" : """select retrieve_ts, max(peer_available) from {table}
+ where peer_address = :device and retrieve_ts >= :start and retrieve_ts <= :end
+ group by retrieve_ts order by retrieve_ts""",
+
+    "worst_links" : """select neighbor_address, peer_address, avg(peer_lqi) as lqi_mean, min(peer_lqi), count(*) from {table}
+ where retrieve_ts >= :start and retrieve_ts <= :end
+ group by neighbor_address, peer_address order by lqi_mean limit :limit""",
+
+    "never_neighbor" : """select distinct peer_address from {table}
+ where retrieve_ts >= :start and retrieve_ts <= :end
+ and peer_address not in (select neighbor_address from {table} where retrieve_ts >= :start and retrieve_ts <= :end)""",
+}
+
+# the indexes for the queries above, the last columns make them covering so the table rows are not read
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS {table}_link_ts ON {table} (neighbor_address, peer_address, retrieve_ts)",
+    "CREATE INDEX IF NOT EXISTS {table}_peer_ts ON {table} (peer_address, retrieve_ts, peer_available)",
+    "CREATE INDEX IF NOT EXISTS {table}_ts_link ON {table} (retrieve_ts, neighbor_address, peer_address, peer_lqi)",
+)
+
+
+def create_indexes(sql_conn, table="zha") :
+    for index in INDEXES :
+        sql_conn.execute(index.format(table=table))
+    sql_conn.commit()
+
+
+def drop_indexes(sql_conn, table="zha") :
+    for index in INDEXES :
+        name = index.split(" ON ")[0].split()[-1].format(table=table)
+        sql_conn.execute("DROP INDEX IF EXISTS " + name)
+    sql_conn.commit()
+
+
+def parameters(values) :
+    return dict((name, sql_value(value)) for name, value in values.items())
+
+
+# run a named query, the parameters by name
+def run_query(sql_conn, name, table="zha", **values) :
+    return sql_conn.execute(QUERIES[name].format(table=table), parameters(values)).fetchall()
+
+
+# the lines of the query plan of a named query
+def query_plan(sql_conn, name, table="zha") :
+    # the plan does not depend on the values, only on there being some
+    values = dict((parameter, None) for parameter in ("neighbor", "peer", "device", "start", "end", "limit"))
+    sql = QUERIES[name].format(table=table)
+    values = dict((parameter, value) for parameter, value in values.items() if ":" + parameter in sql)
+    return [row[3] for row in sql_conn.execute("EXPLAIN QUERY PLAN " + sql, values)]
+
+
+# the queries that read the whole table instead of using an index, {name : plan}, empty when all is well
+def check_plans(sql_conn, table="zha") :
+    problems = {}
+    for name in QUERIES :
+        plan = query_plan(sql_conn, name, table)
+        if any(line.startswith("SCAN " + table) and "USING" not in line for line in plan) or \
+            not any("USING INDEX" in line or "USING COVERING INDEX" in line for line in plan) :
+            problems[name] = plan
+    return problems
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="named queries of the zha history")
+    parser.add_argument("database", help="zha_ws.py database")
+    parser.add_argument("query", nargs="?", choices=sorted(QUERIES), help="query to run")
+    parser.add_argument("values", nargs="*", help="name=value parameters of the query")
+    parser.add_argument("--table", default="zha", help="history table")
+    parser.add_argument("--indexes", action="store_true", help="create the indexes the queries need")
+    parser.add_argument("--check", action="store_true", help="check each query uses an index")
+    args = parser.parse_args()
+
+    sql_conn = sqlite3.connect(args.database)
+
+    if args.indexes :
+        start = time.perf_counter()
+        create_indexes(sql_conn, args.table)
+        print(f"indexes created in {time.perf_counter() - start:.1f}s")
+
+    if args.check :
+        problems = check_plans(sql_conn, args.table)
+        for name in QUERIES :
+            print(("FAIL " if name in problems else "ok   ") + name)
+            for line in query_plan(sql_conn, name, args.table) :
+                print("       " + line)
+        if problems :
+            sys.exit(1)
+
+    if args.query :
+        values = dict(value.split("=", 1) for value in args.values)
+        if "limit" in values :
+            values["limit"] = int(values["limit"])
+        for row in run_query(sql_conn, args.query, args.table, **values) :
+            print(row)
+
+    sql_conn.close()
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# zha_registry.py
+
+# 202610190030
+#
+# the in memory database of zigbee devices that zha_process.ZhaProcessor keeps from one web socket call to the
+# next, what used to be the device_db dict of an 11 key dict per device, rebuilt for every device on every call
+#
+# each device has one slotted DeviceRecord for as long as it is in the 'zha/devices' result, updated in place on
+# every call, and a small integer index, the IEEE address -> index map is keyed by the interned address strings
+# that zha_decode.py hands out, so the lookups of the neighbor walk hash nothing and compare by identity
+# the slots of devices that left the mesh are reused by the next new device
+#
+# the display and the database writer run on their own threads, on a snapshot of the registry taken at the end of
+# each call, the records in a snapshot are copies that are never changed, copied again only for the devices
+# whose values changed since the snapshot before, so a quiet mesh shares them from call to call
+#
+# a DeviceRecord holds about a fifth of the memory of the dict it replaces, which counts most in the snapshots
+# waiting in the writer queue
+
+import sys
+
+
+# what we keep of one device, the text "true" / "false" of available and is_neighbor are what the display and
+# the database have always had
+class DeviceRecord :
+
+    __slots__ = ("ieee", "index", "user_given_name", "last_seen", "device_type", "nwk", "lqi", "rssi", "available", \
+        "is_neighbor", "manufacturer", "model", "power_source")
+
+    def __init__(self, ieee, index, user_given_name="", last_seen=None, device_type="*", nwk=-1, lqi=-1, rssi=0, \
+        available="unk", is_neighbor="false", manufacturer="", model="", power_source="") :
+        self.ieee = ieee
+        self.index = index
+        self.user_given_name = user_given_name
+        self.last_seen = last_seen
+        self.device_type = device_type
+        self.nwk = nwk
+        self.lqi = lqi
+        self.rssi = rssi
+        self.available = available
+        # "true" while the device is in the neighbor table of another device, see zha_graph.py
+        self.is_neighbor = is_neighbor
+        self.manufacturer = manufacturer
+        self.model = model
+        self.power_source = power_source
+
+    def copy(self) :
+        return DeviceRecord(self.ieee, self.index, self.user_given_name, self.last_seen, self.device_type, self.nwk, self.lqi, \
+            self.rssi, self.available, self.is_neighbor, self.manufacturer, self.model, self.power_source)
+
+    # the values that make a new copy for the snapshot when they change
+    def values(self) :
+        return (self.user_given_name, self.last_seen, self.device_type, self.nwk, self.lqi, self.rssi, self.available, \
+            self.is_neighbor, self.manufacturer, self.model, self.power_source)
+
+    def __repr__(self) :
+        return "DeviceRecord(%s #%d %s %r)" % (self.ieee, self.index, self.device_type, self.user_given_name)
+
+
+# the 'fake' record, for the default values of a neighbor we have no record of
+def unknown_device(retrieve_time) :
+    return DeviceRecord("", -1, last_seen=retrieve_time)
+
+
+class DeviceRegistry :
+
+    def __init__(self) :
+        # interned IEEE address -> index of the device in records
+        self.ids = {}
+        # DeviceRecord by index, None for a free slot
+        self.records = []
+        self.free = []
+        # index -> (values, copy) of the snapshot copy of each device
+        self.published = {}
+
+    def __len__(self) :
+        return len(self.ids)
+
+    def __contains__(self, ieee) :
+        return ieee in self.ids
+
+    def __iter__(self) :
+        return iter(self.ids)
+
+    # the record of a device, or default
+    def get(self, ieee, default=None) :
+        index = self.ids.get(ieee)
+        return self.records[index] if index is not None else default
+
+    def __getitem__(self, ieee) :
+        return self.records[self.ids[ieee]]
+
+    def values(self) :
+        records = self.records
+        return [records[index] for index in self.ids.values()]
+
+    # the record of a device, a new one if the device is new, updated in place by the caller
+    def record(self, ieee) :
+        index = self.ids.get(ieee)
+        if index is not None :
+            return self.records[index]
+        ieee = sys.intern(ieee)
+        if self.free :
+            index = self.free.pop()
+            self.records[index] = DeviceRecord(ieee, index)
+        else :
+            index = len(self.records)
+            self.records.append(DeviceRecord(ieee, index))
+        self.ids[ieee] = index
+        return self.records[index]
+
+    # forget the devices that are not in current, a set of IEEE addresses, returns the addresses forgotten
+    def retain(self, current) :
+        if len(current) == len(self.ids) and all(ieee in current for ieee in self.ids) :
+            return []
+        gone = [ieee for ieee in self.ids if ieee not in current]
+        for ieee in gone :
+            index = self.ids.pop(ieee)
+            self.records[index] = None
+            self.published.pop(index, None)
+            self.free.append(index)
+        return gone
+
+    # IEEE address -> copy of the record, for the snapshot of a call, unchanged devices get the copy they had in
+    # the snapshot before
+    def snapshot(self) :
+        published = self.published
+        devices = {}
+        for ieee, index in self.ids.items() :
+            record = self.records[index]
+            values = record.values()
+            entry = published.get(index)
+            if entry is None or entry[0] != values :
+                entry = published[index] = (values, record.copy())
+            devices[ieee] = entry[1]
+        return devices
+
+
+# EOF
@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+# zha_render.py
+
+# 202610190200
+# a line with the deepest route, the devices with no route to the coordinator and the routers that are single
+# points of failure, from snapshot.routes
+# 202610190100
+# a line for each orphaned device, online but in no neighbor table
+# 202610181030
+#
+# display the result of one ZHA web socket call on the console, one line per neighbor 'link' and
+# one line per device that ZHA reports as off line
+# this is the rich print code that used to live inside the main() loop of zha_ws.py
+
+from datetime import timedelta
+
+
+# pick the color to show a last seen time delta in, based on the type of device
+def last_seen_style(device_type, delta_last_seen) :
+    style = 'bold green on black'
+    if device_type == "Router" and delta_last_seen > timedelta(minutes=1) :
+        style = 'bold yellow on black'
+    if device_type == "Router" and delta_last_seen > timedelta(minutes=5) :
+        style = 'bold red on black'
+    if (device_type == "EndDevice" or device_type == "*") and delta_last_seen > timedelta(minutes=25) :
+        style = 'black on yellow'
+    if (device_type == "EndDevice" or device_type == "*") and delta_last_seen > timedelta(minutes=35) :
+        style = 'black on red'
+    return style
+
+
+def lqi_style(lqi) :
+    style = 'bold green on black'
+    if lqi < 170 :
+        style = 'bold yellow on black'
+    if lqi < 85 :
+        style = 'bold red on black'
+    return style
+
+
+def rssi_style(rssi) :
+    style = 'bold green on black'
+    if rssi < -70 :
+        style = 'bold red on black'
+    if rssi < -60 :
+        style = 'bold yellow on black'
+    return style
+
+
+# display one neighbor 'link' row, see zha_process.LinkRow
+def render_link(console, link) :
+
+    console.print(f"{link.retrieve_ts:%H:%M:%S} ", style = 'white', end="")
+    console.print(f"{link.neighbor_device_type:1.1} ", style = 'bold white', end="")
+
+    # devices available seems to be set at some point by ZHA to false if the device is no visable on network
+    if link.neighbor_available == "false" :
+        av_text = "F"
+        style = 'bold red on black'
+    else :
+        av_text = "T"
+        style = 'bold green on black'
+    # hack for coordinator, it thinks it is off line, which could not be, display it as online
+    if link.neighbor_device_type == "Coordinator" :
+        av_text = "T"
+        style = 'bold green on black'
+
+    console.print(f"Online ", style = 'white', end="")
+    console.print(f"{av_text:1}", style=style, end="")
+
+    console.print(f" Last seen ", style = 'white', end="")
+    console.print(f"{link.neighbor_delta_last_seen:6.1f}", style=last_seen_style(link.neighbor_device_type, link.delta_last_seen), end="")
+
+    # display the device name
+    if link.neighbor_db_device_type == "Coordinator" :
+        console.print(f" {'Coordinator':38.38} ", style = 'white', end="")
+    else:
+        console.print(f" {link.neighbor_given_name:38.38} ", style = 'white', end="")
+
+    # 'up link' from neighbor to peer, end devices will not have this link
+    # if this neighbor device is listed as 'off line' display unknown for LQI and RSSI connections to this neighbor
+    # which if were true, then the network would be down
+    neighbor_unknown = link.neighbor_available == "false" and link.neighbor_db_device_type != "Coordinator"
+    lqi_display = link.neighbor_lqi
+    if neighbor_unknown :
+        console.print(f"{'unk':4}", style='bold red on black', end="")
+    elif lqi_display == 0 :
+        console.print(f"{'na':>3}", style='bold red on black', end="")
+    else :
+        console.print(f"{lqi_display:3}", style=lqi_style(lqi_display), end="")
+
+    # this rssi is the one reported by the neighbor device
+    rssi_display = int(link.neighbor_rssi)
+    if neighbor_unknown :
+        console.print(f"{'unk':>4.4} ", style='bold red on black', end="")
+    else :
+        console.print(f" {rssi_display:4} ", style=rssi_style(rssi_display), end="")
+
+    # peer
+    # if this 'peer' device is listed as 'off line' display unknown for LQI and RSSI connections to this neighbor
+    # which if were true, then the network would be down
+    peer_unknown = link.peer_available == "false" and link.peer_device_type != "Coordinator"
+    lqi_display = int(link.peer_lqi)
+    if peer_unknown :
+        console.print(f"{'unk':4}", style='bold red on black', end="")
+    else :
+        console.print(f"{lqi_display:3}", style=lqi_style(lqi_display), end="")
+
+    # this rssi is the one reported by the peer device
+    rssi_display = int(link.peer_rssi)
+    if peer_unknown :
+        console.print(f"{'unk':>4.4}", style='bold red on black', end="")
+    else :
+        console.print(f" {rssi_display:4}", style=rssi_style(rssi_display), end="")
+
+    # display then name of the device 'peer', remember we are stepping thru each 'neighbor' of this device
+    # to display, so these are all the devices which are 'parents', end devices do not have neighbors, so
+    # no end devices will appear in this column.
+    console.print(f" {link.neighbor_relationship:14.14} of ", style = 'white', end="")
+
+    # if this 'parent' device is listed as 'off line' color it red, the coordinator seems to always be 'off line'
+    # which if were true, then the network would be down
+    style = 'white'
+    if link.peer_device_type != "Coordinator" and link.peer_available == "false" :
+        style = 'bold red'
+
+    # if the peer is not found to be a neighbor of any other device then flag
+    if link.peer_is_neighbor == "false" :
+        style = "bold red on black"
+
+    # so far, it does not look like the Coordinator can be given a 'user given name' so that is always 'none'
+    # so for the coordinator, display the device type of 'Coordinator'
+    if link.peer_device_type == "Coordinator" :
+        console.print(f"{'Coordinator':38.38} ", style=style)
+    else:
+        console.print(f"{link.peer_given_name:38.38} ", style=style)
+
+
+# display one line for a device that ZHA reports as off line, or that no other device hears, the record is a
+# zha_registry.DeviceRecord
+def render_offline(console, retrieve_time, device) :
+
+    console.print(f"{retrieve_time:%H:%M:%S} ", style = 'white', end="")
+    console.print(f"{device.device_type:1.1}", style = 'bold white', end="")
+
+    # devices available seems to be set at some point by ZHA to false if the device is no visable on network
+    if device.available == "false" :
+        av_text = "F"
+        style = 'bold red on black'
+    else :
+        av_text = "T"
+        style = 'bold green on black'
+
+    console.print(f" Online ", style = 'white', end="")
+    console.print(f"{av_text:1}", style=style, end="")
+
+    # calculate the time delta from this retrieve from ZHA web socket to when this devices was last seen, decimal minutes
+    delta_last_seen = retrieve_time - device.last_seen
+    console.print(f" Last seen ", style = 'white', end="")
+    console.print(f"{delta_last_seen.seconds/60.0:6.1f}", style=last_seen_style(device.device_type, delta_last_seen), end="")
+
+    # display the peer device name
+    style = "white"
+    if device.is_neighbor == "false" :
+        style = "red"
+
+    if device.device_type == "Coordinator" :
+        console.print(f" {'Coordinator':38.38} ", style = style, end="")
+    else:
+        console.print(f" {str(device.user_given_name):38.38} ", style = style, end="")
+
+    console.print(f"{'unk  unk':>8.8}", style='bold red on black')
+
+
+# the routers whose loss strands the most devices, named in the routes line
+CRITICAL_SHOWN = 5
+
+
+# display one line about the routes of the mesh, see zha_routes.py
+def render_routes(console, snapshot) :
+
+    routes = snapshot.routes
+    if not routes :
+        return
+    hops = [route.hops for route in routes.values() if route.hops is not None]
+    unreachable = len(routes) - len(hops)
+    critical = sorted(((route.stranded, ieee) for ieee, route in routes.items() if route.stranded > 0), reverse=True)
+
+    console.print(f"{snapshot.retrieve_time:%H:%M:%S} ", style = 'white', end="")
+    console.print(f"Routes  max hops {max(hops) if hops else 0:2}  no route ", style = 'white', end="")
+    console.print(f"{unreachable:4}", style = 'bold red on black' if unreachable else 'bold green on black', end="")
+    console.print(f"  single points of failure {len(critical):4}", style = 'white', end="")
+    names = []
+    for stranded, ieee in critical[: CRITICAL_SHOWN] :
+        device = snapshot.devices.get(ieee)
+        name = str(device.user_given_name) if device is not None else ieee
+        names.append(f"{name} ({stranded})")
+    console.print(("  " + ", ".join(names)) if names else "", style = 'bold yellow on black')
+
+
+# display everything from one web socket call, see zha_process.Snapshot
+def render_snapshot(console, snapshot) :
+
+    if snapshot.setup_pass :
+        console.print("First ZHA data retrieval pass, setting up database")
+
+    for link in snapshot.links :
+        render_link(console, link)
+
+    for device in snapshot.offline :
+        render_offline(console, snapshot.retrieve_time, device)
+
+    for device in snapshot.orphaned :
+        render_offline(console, snapshot.retrieve_time, device)
+
+    if not snapshot.setup_pass :
+        render_routes(console, snapshot)
+
+    if snapshot.site :
+        console.print(40*"-" + " " + snapshot.site)
+    else :
+        console.print(40*"-")
+
+
+# EOF
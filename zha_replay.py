@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+# zha_replay.py
+
+# 202610182300
+#
+# offline replay of the raw json archive (zha_archive.py) through the whole zha_ws.py pipeline, the decoder and
+# ZhaProcessor, the writer thread and the store, and when asked the console display, as fast as it will go
+# there is no Home Assistant and no sleeping, each site of the archive is a ReplaySite of the collector whose
+# 'web socket' is the archive, the calls go down the same queues as live ones
+#
+# the time is a virtual clock, set to the recorded time of each call, so retrieve_time, and the last_seen deltas
+# computed from it, are those of the live run, and a replay gives the same rows every time
+# a restart of zha_ws.py is seen in the archive as a new segment where the packet number goes back, the replay
+# starts a new processor there, with its setup pass, as the live program did
+# archives of subscribe mode only have the full 'zha/devices' downloads, they replay as if they were polled
+#
+# for testing changes to the processing against weeks of recorded calls, and as an end to end benchmark that
+# does not depend on the network or the clock
+#
+#  python3 zha_replay.py raw/ replay.db                                 # the whole archive into replay.db
+#  python3 zha_replay.py raw/ replay.db --site home --start "2026-10-01 00:00:00" --end "2026-10-08 00:00:00"
+#  python3 zha_replay.py raw/ replay.db --schema normalized --rollups --render
+
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+
+from rich.console import Console
+
+from zha_process import ZhaProcessor
+from zha_store import ZhaStore
+from zha_normalized import NormalizedZhaStore
+from zha_delta import DeltaZhaStore
+from zha_rollup import ZhaRollup
+from zha_current import ZhaCurrent
+from zha_device_history import ZhaDeviceHistory
+from zha_route_history import ZhaRouteHistory
+from zha_archive import ArchiveReader
+from zha_writer import OVERFLOW_BLOCK
+from zha_collector import ZhaCollector, ZhaSite, DEVICES
+
+
+# the time of the replay, it only moves when a recorded call says so
+class VirtualClock :
+
+    def __init__(self) :
+        self.time = None
+        # the first and last recorded time of the replay, for the report
+        self.first = None
+        self.last = None
+
+    def now(self) :
+        return self.time
+
+    def set(self, when) :
+        self.time = when
+        # the sites of an archive are replayed side by side, each in its own time order
+        self.first = when if self.first is None else min(self.first, when)
+        self.last = when if self.last is None else max(self.last, when)
+        return when
+
+    # virtual seconds the replay has covered
+    @property
+    def seconds(self) :
+        return (self.last - self.first).total_seconds() if self.first is not None else 0.0
+
+
+class ReplaySite(ZhaSite) :
+
+    # reader : zha_archive.ArchiveReader of this site alone, each site reads its own segments
+    def __init__(self, collector, name, reader, start=None, end=None, clock=None) :
+        super().__init__(collector, name, None, None)
+        self.reader = reader
+        self.start = start
+        self.end = end
+        self.clock = clock if clock is not None else VirtualClock()
+        # statistics
+        self.restarts = 0
+
+    # the archive in the place of the web socket, every recorded call of the site at once, the decode queue is
+    # what holds it back
+    async def replay(self, polls) :
+        last_segment = None
+        last_packet = None
+        cancelled = False
+        try :
+            for retrieve_ts, site, packet, segment, offset, length in self.reader.entries(self.start, self.end, self.name).fetchall() :
+                if polls is not None and self.polls_sent >= polls :
+                    break
+                # zha_ws.py was started again, a new processor, as it had
+                restart = last_packet is not None and segment != last_segment and packet is not None and packet <= last_packet
+                last_segment, last_packet = segment, packet
+                result = self.reader.read_raw(segment, offset, length)
+                retrieve_time = self.clock.set(datetime.fromisoformat(retrieve_ts))
+                self.polls_sent += 1
+                self.full_downloads += 1
+                self.bytes_received += len(result)
+                await self.decode_queue.put((DEVICES, time.perf_counter(), retrieve_time, (restart, result)))
+        except asyncio.CancelledError :
+            cancelled = True
+            raise
+        finally :
+            await self.end_of_polls(cancelled)
+
+    def source(self, polls) :
+        return self.replay(polls)
+
+    # runs on the decode thread, in the order of the calls
+    def decode(self, retrieve_time, result) :
+        restart, text = result
+        if restart :
+            self.processor = ZhaProcessor()
+            self.restarts += 1
+        return super().decode(retrieve_time, text)
+
+
+class ZhaReplay :
+
+    # archive_dir, name : the archive, see zha_archive.py
+    # store : the store to write into, opened and closed by the caller
+    # sites : names of the sites to replay, None for all in the archive
+    # start, end : 'YYYY-MM-DD HH:MM:SS' or datetimes, None for all
+    # console : rich console to display the calls on, None for no display
+    def __init__(self, archive_dir, store, name="zha_ws", sites=None, start=None, end=None, console=None, logger=None) :
+        self.archive_dir = archive_dir
+        self.name = name
+        self.store = store
+        self.sites = sites
+        self.start = start
+        self.end = end
+        self.console = console
+        self.logger = logger if logger is not None else logging.getLogger("zha_replay")
+        self.clock = VirtualClock()
+        self.collector = None
+        # statistics
+        self.calls = 0
+        self.restarts = 0
+        self.seconds = 0.0
+
+    async def run(self, polls=None) :
+        readers = []
+        started = time.perf_counter()
+        try :
+            index = ArchiveReader(self.archive_dir, self.name)
+            sites = self.sites if self.sites is not None else \
+                [row[0] for row in index.index_conn.execute("select distinct site from archive_index order by site")]
+            index.close()
+            # the writer blocks the replay when it falls behind, nothing is dropped or spilled
+            self.collector = ZhaCollector(self.store, console=self.console, overflow=OVERFLOW_BLOCK, logger=self.logger)
+            for site in sites :
+                readers.append(ArchiveReader(self.archive_dir, self.name))
+                self.collector.sites.append(ReplaySite(self.collector, site, readers[-1], self.start, self.end, self.clock))
+            await self.collector.run(polls)
+        finally :
+            for reader in readers :
+                reader.close()
+            self.seconds = time.perf_counter() - started
+        self.calls = sum(site.polls_sent for site in self.collector.sites)
+        self.restarts = sum(site.restarts for site in self.collector.sites)
+        return self.calls
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="replay the raw json archive through the zha_ws.py pipeline")
+    parser.add_argument("archive", help="raw json archive directory")
+    parser.add_argument("database", help="database to write the replayed history into")
+    parser.add_argument("--name", default="zha_ws", help="first part of the segment file names")
+    parser.add_argument("--site", action="append", default=None, help="only this site, can be given more than once")
+    parser.add_argument("--start", default=None, help="first call, 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("--end", default=None, help="last call, 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("--schema", choices=("wide", "normalized", "delta"), default="wide")
+    parser.add_argument("--rollups", action="store_true", help="keep the rollup tables")
+    parser.add_argument("--current", action="store_true", help="keep the zha_current / device_current tables")
+    parser.add_argument("--device-history", action="store_true", help="keep the device_attribute table")
+    parser.add_argument("--route-history", action="store_true", help="keep the route_poll / device_route tables")
+    parser.add_argument("--commit-polls", type=int, default=100, help="calls per transaction")
+    parser.add_argument("--render", action="store_true", help="display the calls on the console")
+    args = parser.parse_args()
+
+    store_settings = {"commit_polls" : args.commit_polls, "pragmas" : {"journal_mode" : "wal", "synchronous" : "normal"}, \
+        "derived" : ([ZhaRollup()] if args.rollups else []) + ([ZhaCurrent()] if args.current else []) + \
+        ([ZhaDeviceHistory()] if args.device_history else []) + ([ZhaRouteHistory()] if args.route_history else [])}
+    if args.schema == "normalized" :
+        store = NormalizedZhaStore(args.database, **store_settings)
+    elif args.schema == "delta" :
+        store = DeltaZhaStore(args.database, **store_settings)
+    else :
+        store = ZhaStore(args.database, **store_settings)
+    store.open()
+
+    replay = ZhaReplay(args.archive, store, name=args.name, sites=args.site, start=args.start, end=args.end, \
+        console=Console() if args.render else None)
+    try :
+        asyncio.run(replay.run())
+    except KeyboardInterrupt :
+        print("interrupted")
+    finally :
+        store.close()
+    print(f"{replay.calls} calls, {store.rows_written} rows in {replay.seconds:.1f}s ({replay.calls / max(replay.seconds, 1e-9):.1f} calls/s), " \
+        f"{replay.clock.seconds / 3600:.1f} hours of recording, {replay.clock.seconds / max(replay.seconds, 1e-9):.0f}x real time, " \
+        f"{replay.restarts} restarts")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,370 @@
+#!/usr/bin/python3
+# zha_rollup.py
+
+# 202610182030
+# each backfill leaves a row in rollup_rebuild, for zha_export.py to know the buckets it exported were replaced
+# 202610181800
+#
+# rollup tables of the zha neighbor link history, 'rollups : True' in zha_ws.yaml
+# one row per link (site, neighbor, peer) per 1 minute, 1 hour and 1 day bucket (local time), kept up to date by
+# the collector as the rows are written, so a question about a week of one link reads 168 hourly rows instead
+# of scanning the whole history
+#
+#  rollup_1m / rollup_1h / rollup_1d :
+#   site, neighbor_address, peer_address, bucket_ts (unix epoch of the start of the bucket)
+#   samples                              web socket calls the link was in
+#   lqi_min, lqi_max, lqi_mean, lqi_p95  lqi of the link in the neighbor table (the peer_lqi column)
+#   rssi_min, rssi_max, rssi_mean, rssi_p95  rssi of the neighbor device (the neighbor_rssi column)
+#   available_samples, available_ratio   calls the neighbor's availability was known, and the part of them it was available
+#
+# a bucket is written when the first row of the next bucket arrives, and on a clean exit, and the buckets still
+# open (this hour, today) are written as they are every flush_seconds (of retrieve time, 300 by default,
+# 'rollup_flush_seconds' in zha_ws.yaml) and replaced as they fill, so rollup_1h and rollup_1d have the current
+# hour and day, at most flush_seconds behind the zha table
+# when the program is killed, the rows of the calls after the last time the open buckets were written (at most
+# flush_seconds of them) are missing from the rollups, the rest of each bucket is kept, the backfill below
+# rebuilds everything exactly
+# a bucket that was in the table when this program first saw it (the program was restarted inside it) is merged
+# with what this run adds, counts, min, max and means exactly, p95 as the larger of the two
+#
+# backfill, builds the rollups from the history already in the database, in chunks, stop zha_ws.py first :
+#
+#  python3 zha_rollup.py zha_ws.db                      # the 'zha' table, and its partitions (zha_partition.py)
+#  python3 zha_rollup.py zha_ws.db --schema normalized  # the 'link' table of zha_normalized.py
+#  python3 zha_rollup.py zha_ws.db --schema delta       # the intervals of zha_delta.py
+
+import time
+import sqlite3
+import argparse
+from datetime import datetime
+
+from zha_normalized import AVAILABLE_CODES, to_int, to_epoch
+from zha_partition import partition_tables
+
+
+def minute_bucket(when) :
+    return when.replace(second=0, microsecond=0)
+
+
+def hour_bucket(when) :
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(when) :
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# table, start of the bucket of a local time datetime
+ROLLUP_LEVELS = (("rollup_1m", minute_bucket), ("rollup_1h", hour_bucket), ("rollup_1d", day_bucket))
+
+ROLLUP_TABLE = "CREATE TABLE IF NOT EXISTS {table} (site text not null, neighbor_address text not null, peer_address text not null, bucket_ts integer not null, samples integer, lqi_min integer, lqi_max integer, lqi_mean real, lqi_p95 integer, rssi_min integer, rssi_max integer, rssi_mean real, rssi_p95 integer, available_samples integer, available_ratio real, PRIMARY KEY (neighbor_address, peer_address, bucket_ts, site)) WITHOUT ROWID"
+ROLLUP_INDEX = "CREATE INDEX IF NOT EXISTS {table}_bucket ON {table} (bucket_ts)"
+# one row per backfill, when it ran and the first bucket it replaced
+ROLLUP_REBUILD_TABLE = "CREATE TABLE IF NOT EXISTS rollup_rebuild (rebuild_id integer primary key, rebuilt_ts integer, first_bucket_ts integer)"
+
+# the values of a bucket after the key columns
+ROLLUP_VALUES = "samples, lqi_min, lqi_max, lqi_mean, lqi_p95, rssi_min, rssi_max, rssi_mean, rssi_p95, available_samples, available_ratio"
+ROLLUP_REPLACE = "insert or replace into {table} values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+# the buckets of one bucket_ts already in the table
+ROLLUP_SELECT = "select site, neighbor_address, peer_address, " + ROLLUP_VALUES + " from {table} where bucket_ts = ?"
+
+
+# min, max, mean and 95th percentile (nearest rank) of a histogram {value : count}, all None when it is empty
+def histogram_stats(histogram) :
+    if not histogram :
+        return None, None, None, None
+    values = sorted(histogram)
+    count = sum(histogram.values())
+    rank = -(-95 * count // 100)
+    seen = 0
+    p95 = values[-1]
+    for value in values :
+        seen += histogram[value]
+        if seen >= rank :
+            p95 = value
+            break
+    return values[0], values[-1], sum(value * histogram[value] for value in values) / count, p95
+
+
+def merged_min(value, other) :
+    return other if value is None else value if other is None else min(value, other)
+
+
+def merged_max(value, other) :
+    return other if value is None else value if other is None else max(value, other)
+
+
+def merged_mean(value, count, other, other_count) :
+    if value is None or other is None :
+        return other if value is None else value
+    return (value * count + other * other_count) / (count + other_count)
+
+
+# two sets of the values of the same bucket (ROLLUP_VALUES), one in the table from before, and what this run has
+def merge_values(values, other) :
+    return (values[0] + other[0], merged_min(values[1], other[1]), merged_max(values[2], other[2]), \
+        merged_mean(values[3], values[0], other[3], other[0]), merged_max(values[4], other[4]), \
+        merged_min(values[5], other[5]), merged_max(values[6], other[6]), \
+        merged_mean(values[7], values[0], other[7], other[0]), merged_max(values[8], other[8]), \
+        values[9] + other[9], merged_mean(values[10], values[9], other[10], other[9]))
+
+
+# one link in one bucket, lqi and rssi are small integers so a histogram keeps the p95 exact in little memory
+class Bucket :
+
+    __slots__ = ("samples", "lqi", "rssi", "available_samples", "available", "written")
+
+    def __init__(self) :
+        # samples when the bucket was last written to the table
+        self.written = 0
+        self.samples = 0
+        self.lqi = {}
+        self.rssi = {}
+        self.available_samples = 0
+        self.available = 0
+
+    def add(self, lqi, rssi, available) :
+        self.samples += 1
+        if lqi is not None :
+            self.lqi[lqi] = self.lqi.get(lqi, 0) + 1
+        if rssi is not None :
+            self.rssi[rssi] = self.rssi.get(rssi, 0) + 1
+        if available is not None :
+            self.available_samples += 1
+            self.available += available
+
+    def values(self) :
+        return (self.samples,) + histogram_stats(self.lqi) + histogram_stats(self.rssi) + \
+            (self.available_samples, self.available / self.available_samples if self.available_samples else None)
+
+
+class ZhaRollup :
+
+    # flush_seconds : the open buckets are written every this many seconds of retrieve time, 0 only when they end
+    def __init__(self, levels=ROLLUP_LEVELS, flush_seconds=300) :
+        self.levels = levels
+        self.flush_seconds = flush_seconds
+        # table -> {(bucket_ts, site, neighbor_address, peer_address) : Bucket} of the buckets still open
+        self.buckets = dict((table, {}) for table, bucket in levels)
+        # table -> {(bucket_ts, site, neighbor_address, peer_address) : values} of the buckets that were in the
+        # table before this run added to them, and the bucket_ts they were read for
+        self.existing = dict((table, {}) for table, bucket in levels)
+        self.existing_read = dict((table, set()) for table, bucket in levels)
+        # table -> start of the newest bucket seen
+        self.newest = dict((table, None) for table, bucket in levels)
+        # retrieve time the open buckets were last written
+        self.last_flush = None
+        # the bucket starts of the last retrieve time, every link of a web socket call has the same one
+        self.last_time = None
+        self.last_starts = None
+        # statistics
+        self.buckets_written = 0
+
+    def create_tables(self, sql_cursor) :
+        for table, bucket in self.levels :
+            sql_cursor.execute(ROLLUP_TABLE.format(table=table))
+            sql_cursor.execute(ROLLUP_INDEX.format(table=table))
+        sql_cursor.execute(ROLLUP_REBUILD_TABLE)
+
+    def bucket_starts(self, retrieve_time) :
+        if retrieve_time != self.last_time :
+            self.last_time = retrieve_time
+            self.last_starts = [to_epoch(bucket(retrieve_time)) for table, bucket in self.levels]
+        return self.last_starts
+
+    # one observation of a link, retrieve_time is a local time datetime
+    def add(self, sql_conn, retrieve_time, site, neighbor_address, peer_address, lqi, rssi, available) :
+        site = site or ""
+        for (table, bucket), start in zip(self.levels, self.bucket_starts(retrieve_time)) :
+            if self.newest[table] is None or start > self.newest[table] :
+                # the first row of a new bucket, the buckets before it are done
+                if self.newest[table] is not None :
+                    self.flush(sql_conn, table, start)
+                self.newest[table] = start
+            buckets = self.buckets[table]
+            key = (start, site, neighbor_address, peer_address)
+            if key not in buckets :
+                if start not in self.existing_read[table] :
+                    self.read_existing(sql_conn, table, start)
+                buckets[key] = Bucket()
+            buckets[key].add(lqi, rssi, available)
+
+    def add_snapshot(self, sql_conn, snapshot) :
+        for link in snapshot.links :
+            self.add(sql_conn, snapshot.retrieve_time, snapshot.site, link.neighbor_address, link.peer_address, \
+                to_int(link.peer_lqi), to_int(link.neighbor_rssi), AVAILABLE_CODES.get(link.neighbor_available))
+        if self.flush_seconds > 0 :
+            if self.last_flush is None :
+                self.last_flush = snapshot.retrieve_time
+            elif (snapshot.retrieve_time - self.last_flush).total_seconds() >= self.flush_seconds :
+                for table, bucket in self.levels :
+                    self.write(sql_conn, table, list(self.buckets[table].items()))
+                self.last_flush = snapshot.retrieve_time
+
+    # the buckets of one bucket_ts already in the table, what this run adds to them is merged with them
+    def read_existing(self, sql_conn, table, start) :
+        existing = self.existing[table]
+        for row in sql_conn.execute(ROLLUP_SELECT.format(table=table), (start,)) :
+            existing[(start,) + tuple(row[: 3])] = tuple(row[3 :])
+        self.existing_read[table].add(start)
+
+    # write the buckets of table that start before 'before', None for all of them, they are done
+    def flush(self, sql_conn, table, before=None) :
+        buckets = self.buckets[table]
+        done = [key for key in buckets if before is None or key[0] < before]
+        self.write(sql_conn, table, [(key, buckets.pop(key)) for key in done])
+        # a row for a bucket that is done reads the table again, and is merged with what was written here
+        self.existing[table] = dict(item for item in self.existing[table].items() if before is not None and item[0][0] >= before)
+        self.existing_read[table] = set(start for start in self.existing_read[table] if before is not None and start >= before)
+
+    # write (key, Bucket) of table that have samples not yet in the table, merged with the bucket already there
+    def write(self, sql_conn, table, buckets) :
+        existing = self.existing[table]
+        rows = []
+        for key, bucket in buckets :
+            if bucket.samples == bucket.written :
+                continue
+            values = bucket.values()
+            if key in existing :
+                values = merge_values(existing[key], values)
+            rows.append((key[1], key[2], key[3], key[0]) + values)
+            bucket.written = bucket.samples
+        sql_conn.executemany(ROLLUP_REPLACE.format(table=table), rows)
+        self.buckets_written += len(rows)
+
+    def close(self, sql_conn) :
+        for table, bucket in self.levels :
+            self.flush(sql_conn, table)
+
+
+# ---- reports ----
+
+# the rollup rows of one link from start to end (datetimes), level is the table
+def link_rollup(sql_conn, neighbor_address, peer_address, start, end, level="rollup_1h", site=None) :
+    sql = "select * from " + level + " where neighbor_address = ? and peer_address = ? and bucket_ts >= ? and bucket_ts <= ?"
+    parameters = [neighbor_address, peer_address, to_epoch(start), to_epoch(end)]
+    if site is not None :
+        sql += " and site = ?"
+        parameters.append(site or "")
+    return sql_conn.execute(sql + " order by bucket_ts", parameters).fetchall()
+
+
+# one summary of a link from start to end : samples, lqi min / max / mean / largest hourly p95, rssi the same,
+# availability ratio
+def link_summary(sql_conn, neighbor_address, peer_address, start, end, level="rollup_1h", site=None) :
+    sql = "select sum(samples), min(lqi_min), max(lqi_max), sum(lqi_mean * samples) / sum(samples), max(lqi_p95), " \
+        "min(rssi_min), max(rssi_max), sum(rssi_mean * samples) / sum(samples), max(rssi_p95), " \
+        "sum(available_ratio * available_samples) / sum(available_samples) from " + level + \
+        " where neighbor_address = ? and peer_address = ? and bucket_ts >= ? and bucket_ts <= ?"
+    parameters = [neighbor_address, peer_address, to_epoch(start), to_epoch(end)]
+    if site is not None :
+        sql += " and site = ?"
+        parameters.append(site or "")
+    return sql_conn.execute(sql, parameters).fetchone()
+
+
+# ---- backfill ----
+
+# rows of (retrieve_time, site, neighbor_address, peer_address, lqi, rssi, available) of the history, in chunks
+# of about chunk_rows, each chunk read completely before it is handed out, so the same database can be written
+# between chunks
+# the zha table of the rows from before partitioning first, then the partitions of zha_partition.py oldest first,
+# each in the order it was written, which is retrieve_ts order
+def wide_history(sql_conn, chunk_rows) :
+    for table in ["zha"] + list(partition_tables(sql_conn).values()) :
+        columns = [row[1] for row in sql_conn.execute("PRAGMA table_info(" + table + ")")]
+        select = "select rowid, retrieve_ts, " + ("site" if "site" in columns else "null") + \
+            ", neighbor_address, peer_address, peer_lqi, neighbor_rssi, neighbor_available from " + table + " where rowid > ? order by rowid limit ?"
+        last_rowid = 0
+        while True :
+            rows = sql_conn.execute(select, (last_rowid, chunk_rows)).fetchall()
+            if not rows :
+                break
+            last_rowid = rows[-1][0]
+            yield [(datetime.fromisoformat(row[1]), row[2], row[3], row[4], to_int(row[5]), to_int(row[6]), AVAILABLE_CODES.get(row[7])) \
+                for row in rows]
+
+
+def normalized_history(sql_conn, chunk_rows) :
+    select = "select link.rowid, link.retrieve_ts, site.name, neighbor.ieee, peer.ieee, link.peer_lqi, link.neighbor_rssi, link.neighbor_available " \
+        "from link left join site on site.site_id = link.site_id left join device as neighbor on neighbor.device_id = link.neighbor_id " \
+        "left join device as peer on peer.device_id = link.peer_id where link.rowid > ? order by link.rowid limit ?"
+    last_rowid = 0
+    while True :
+        rows = sql_conn.execute(select, (last_rowid, chunk_rows)).fetchall()
+        if not rows :
+            return
+        last_rowid = rows[-1][0]
+        yield [(datetime.fromtimestamp(row[1]),) + tuple(row[2:]) for row in rows]
+
+
+def delta_history(sql_conn, chunk_rows) :
+    from zha_delta import reconstruct
+    first_poll_id, last_poll_id = sql_conn.execute("select min(poll_id), max(poll_id) from link_poll").fetchone()
+    if first_poll_id is None :
+        return
+    # about chunk_rows rows per chunk, from the number of links of the last web socket call
+    links = sql_conn.execute("select count(*) from link_interval where first_poll_id <= ? and coalesce(last_poll_id, ?) >= ?", \
+        (last_poll_id, last_poll_id, last_poll_id)).fetchone()[0]
+    polls = max(1, chunk_rows // max(1, links))
+    for start in range(first_poll_id, last_poll_id + 1, polls) :
+        yield [(row[1], row[14], row[2], row[13], row[10], row[4], row[6]) \
+            for row in reconstruct(sql_conn, first_poll_id=start, last_poll_id=start + polls - 1)]
+
+
+HISTORY_SOURCES = {"wide" : wide_history, "normalized" : normalized_history, "delta" : delta_history}
+
+
+# rebuild the rollups of everything in the history of the database
+# the rollup rows from the first to the last bucket of the history are replaced
+def backfill(database_file, schema="wide", chunk_rows=100000, progress=None) :
+
+    source = sqlite3.connect(database_file)
+    target = sqlite3.connect(database_file)
+    rollup = ZhaRollup()
+    rollup.create_tables(target.cursor())
+    rows_read = 0
+    cleared = False
+    try :
+        for rows in HISTORY_SOURCES[schema](source, chunk_rows) :
+            if not rows :
+                continue
+            if not cleared :
+                # buckets from the start of the history on are rebuilt, the day bucket starts first
+                first = min(to_epoch(bucket(rows[0][0])) for table, bucket in rollup.levels)
+                for table, bucket in rollup.levels :
+                    target.execute("delete from " + table + " where bucket_ts >= ?", (first,))
+                target.execute("insert into rollup_rebuild (rebuilt_ts, first_bucket_ts) values (?, ?)", (int(time.time()), first))
+                cleared = True
+            for row in rows :
+                rollup.add(target, *row)
+            target.commit()
+            rows_read += len(rows)
+            if progress is not None :
+                progress(rows_read)
+        rollup.close(target)
+        target.commit()
+        return rows_read, rollup.buckets_written
+    finally :
+        source.close()
+        target.close()
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="build the rollup tables from the history already in a zha_ws.py database")
+    parser.add_argument("database", help="zha_ws.py database")
+    parser.add_argument("--schema", default="wide", choices=sorted(HISTORY_SOURCES), help="schema of the history")
+    parser.add_argument("--chunk", type=int, default=100000, help="rows per transaction")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows, buckets = backfill(args.database, args.schema, args.chunk, progress=lambda rows : print(f"\r{rows} rows", end="", flush=True))
+    print(f"\r{rows} rows read, {buckets} rollup rows written in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# zha_route_history.py
+
+# 202610190200
+#
+# the routes of the mesh for each web socket call, 'route_history : True' in zha_ws.yaml, from the
+# zha_routes.Route of each device in snapshot.routes
+#
+#  route_poll   : one row per web socket call (site, retrieve_ts), the packet, devices, devices with no route to
+#                 the coordinator, deepest route, single points of failure and the most devices one of them strands
+#  device_route : each version of the route of a device (a slowly changing dimension, as in zha_device_history.py)
+#   site, device_address
+#   hops, cost, via      fewest hops, least link cost to the coordinator and the next device on that path
+#   children, stranded   child load, devices that lose their route if this one goes away
+#   valid_from           retrieve_ts of the first web socket call with these values
+#   valid_to             retrieve_ts of the first call with other values, or without the device, null for the current version
+#
+# the routes of a call are those of the rows valid at its retrieve_ts, a call only writes the devices whose route
+# changed, and a route only changes when a link came, went or crossed a link cost step
+#
+#  python3 zha_route_history.py zha_ws.db                                  # the single points of failure now
+#  python3 zha_route_history.py zha_ws.db 00:15:8d:00:01:02:03:04          # the route versions of one device
+#  python3 zha_route_history.py zha_ws.db --at "2026-10-01 12:00:00"       # the single points of failure then
+#  python3 zha_route_history.py zha_ws.db --polls                          # the summary of each call
+
+import sqlite3
+import argparse
+
+from zha_store import sql_value
+
+
+ROUTE_VALUES = ("hops", "cost", "via", "children", "stranded")
+
+ROUTE_POLL_TABLE = "CREATE TABLE IF NOT EXISTS route_poll (site text not null, retrieve_ts integer not null, packet integer, " \
+    "devices integer, no_route integer, max_hops integer, critical integer, max_stranded integer, PRIMARY KEY (site, retrieve_ts)) WITHOUT ROWID"
+DEVICE_ROUTE_TABLE = "CREATE TABLE IF NOT EXISTS device_route (site text not null, device_address text not null, " \
+    "hops int, cost int, via text, children int, stranded int, " \
+    "valid_from integer not null, valid_to integer, PRIMARY KEY (site, device_address, valid_from)) WITHOUT ROWID"
+# the current versions, at most one per device
+DEVICE_ROUTE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS device_route_current ON device_route (site, device_address) WHERE valid_to IS NULL"
+
+ROUTE_POLL_INSERT = "insert or replace into route_poll values (?, ?, ?, ?, ?, ?, ?, ?)"
+DEVICE_ROUTE_INSERT = "insert or replace into device_route values (?, ?, " + ", ".join(["?"] * len(ROUTE_VALUES)) + ", ?, null)"
+DEVICE_ROUTE_CLOSE = "update device_route set valid_to = ? where site = ? and device_address = ? and valid_to is null"
+
+
+class ZhaRouteHistory :
+
+    def __init__(self) :
+        # site -> {device_address : route values} of the current versions, a site is read from the table the first
+        # time it is seen
+        self.current = {}
+        # statistics
+        self.versions_written = 0
+
+    def create_tables(self, sql_cursor) :
+        sql_cursor.execute(ROUTE_POLL_TABLE)
+        sql_cursor.execute(DEVICE_ROUTE_TABLE)
+        sql_cursor.execute(DEVICE_ROUTE_INDEX)
+
+    def load(self, sql_conn, site) :
+        self.current[site] = dict((row[0], tuple(row[1 :])) for row in sql_conn.execute( \
+            "select device_address, " + ", ".join(ROUTE_VALUES) + " from device_route where site = ? and valid_to is null", (site,)))
+
+    def add_snapshot(self, sql_conn, snapshot) :
+        site = snapshot.site or ""
+        if site not in self.current :
+            self.load(sql_conn, site)
+        current = self.current[site]
+        retrieve_ts = sql_value(snapshot.retrieve_time)
+
+        # a Route is a tuple of the values in the order of ROUTE_VALUES
+        routes = dict((str(device_address), tuple(route)) for device_address, route in snapshot.routes.items())
+        hops = [route[0] for route in routes.values() if route[0] is not None]
+        stranded = [route[4] for route in routes.values() if route[4] > 0]
+        sql_conn.execute(ROUTE_POLL_INSERT, (site, retrieve_ts, snapshot.packet, len(routes), len(routes) - len(hops), \
+            max(hops) if hops else None, len(stranded), max(stranded) if stranded else 0))
+
+        changed = [device_address for device_address, values in routes.items() if current.get(device_address) != values]
+        gone = [device_address for device_address in current if device_address not in routes]
+        if not changed and not gone :
+            return
+
+        # the old version ends where the new one starts
+        sql_conn.executemany(DEVICE_ROUTE_CLOSE, [(retrieve_ts, site, device_address) for device_address in changed + gone \
+            if device_address in current])
+        sql_conn.executemany(DEVICE_ROUTE_INSERT, [(site, device_address) + routes[device_address] + (retrieve_ts,) \
+            for device_address in changed])
+        for device_address in changed :
+            current[device_address] = routes[device_address]
+        for device_address in gone :
+            del current[device_address]
+        self.versions_written += len(changed)
+
+    def close(self, sql_conn) :
+        pass
+
+
+# ---- reports ----
+
+# every route version of one device, oldest first
+def route_versions(sql_conn, device_address, site=None) :
+    sql = "select * from device_route where device_address = ?"
+    parameters = [device_address]
+    if site is not None :
+        sql += " and site = ?"
+        parameters.append(site)
+    return sql_conn.execute(sql + " order by site, valid_from", parameters).fetchall()
+
+
+# the devices whose loss strands others, most stranded first, now or as they were at 'when', a datetime or
+# 'YYYY-MM-DD HH:MM:SS'
+def critical_devices(sql_conn, when=None, site=None) :
+    if when is None :
+        sql = "select * from device_route where stranded > 0 and valid_to is null"
+        parameters = []
+    else :
+        when = sql_value(when)
+        sql = "select * from device_route where stranded > 0 and valid_from <= ? and (valid_to is null or valid_to > ?)"
+        parameters = [when, when]
+    if site is not None :
+        sql += " and site = ?"
+        parameters.append(site)
+    return sql_conn.execute(sql + " order by site, stranded desc, device_address", parameters).fetchall()
+
+
+def route_polls(sql_conn, site=None) :
+    sql = "select * from route_poll"
+    if site is not None :
+        return sql_conn.execute(sql + " where site = ? order by retrieve_ts", (site,)).fetchall()
+    return sql_conn.execute(sql + " order by site, retrieve_ts").fetchall()
+
+
+def main() :
+
+    parser = argparse.ArgumentParser(description="routes of the zha mesh to the coordinator and its single points of failure")
+    parser.add_argument("database", help="zha_ws.py database")
+    parser.add_argument("device", nargs="?", help="ieee address of one device")
+    parser.add_argument("--at", default=None, help="the single points of failure at 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("--polls", action="store_true", help="the summary of each web socket call")
+    parser.add_argument("--site", default=None, help="only this site")
+    args = parser.parse_args()
+
+    sql_conn = sqlite3.connect(args.database)
+    if args.polls :
+        rows = route_polls(sql_conn, args.site)
+    elif args.device :
+        rows = route_versions(sql_conn, args.device, args.site)
+    else :
+        rows = critical_devices(sql_conn, args.at, args.site)
+    for row in rows :
+        print(row)
+    sql_conn.close()
+
+
+if __name__ == '__main__':
+   main()
+
+
+# EOF
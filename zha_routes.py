@@ -0,0 +1,436 @@
+#!/usr/bin/python3
+# zha_routes.py
+
+# 202610190200
+#
+# routing analytics of the mesh, on top of the neighbor tables of zha_graph.NeighborGraph, kept up to date by
+# zha_process.ZhaProcessor at the end of each web socket call, for each device :
+#  hops      fewest hops to the coordinator
+#  cost      least total link cost to the coordinator, and via, the next device on that path, following via
+#            from device to device gives the whole path
+#  children  the 'Child' entries in the neighbor table of a router, its child load
+#  stranded  the devices that lose every path to the coordinator if this router goes away, a router with
+#            stranded more than 0 is an articulation point of the mesh, a single point of failure
+#
+# a link joins two devices when either of them has the other in its table, its lqi is the lower of the two
+# entries when both have one, and its cost the ZigBee link cost of that lqi, min(7, round(1 / p ** 4)) with
+# p = lqi / 255, so a path of good links is cheaper than a shorter one over a bad link
+# only the coordinator and the devices with a neighbor table (routers) relay, end devices are only ever the
+# last hop
+#
+# nothing is recomputed from scratch on each call, the graph says which table entries changed
+# (NeighborGraph.touched), only those links are looked at again :
+#  hops, cost   kept as shortest path trees, a link that got worse or went away only clears the subtree hanging
+#               off it, which is found again from its edges, a link that got better or came is relaxed from its
+#               ends, a quiet call costs nothing
+#  children     counted again for the touched routers
+#  stranded     the dominator tree of the mesh seen from the coordinator, found again only when a link between
+#               two routers came or went or a device started or stopped relaying, an end device that changed
+#               parent only moves itself in the tree, an lqi that moved does not change it
+#
+#  python3 bench/bench_routes.py
+
+import heapq
+from collections import namedtuple
+
+from zha_graph import CHILD
+
+
+# the routing values of one device, in zha_process.Snapshot.routes, hops / cost / via are None for a device
+# with no path to the coordinator, via is None for the coordinator itself
+Route = namedtuple("Route", ("hops", "cost", "via", "children", "stranded"))
+
+NO_ROUTE = Route(None, None, None, 0, 0)
+
+
+# ZigBee link cost by lqi
+def link_cost(lqi) :
+    if lqi <= 0 :
+        return 7
+    return min(7, max(1, round((255.0 / min(lqi, 255)) ** 4)))
+
+
+LINK_COSTS = [link_cost(lqi) for lqi in range(256)]
+
+
+# shortest paths to the coordinator over the links of MeshRoutes, each device has its distance and the device
+# before it on the path, the tree is kept as the children of each device so a cut can find what hangs off it
+class PathTree :
+
+    # weighted False counts hops, True adds up the link costs
+    def __init__(self, routes, weighted) :
+        self.routes = routes
+        self.weighted = weighted
+        # by node id, None / -1 for a node with no path
+        self.distance = []
+        self.parent = []
+        self.children = []
+        # ids whose distance or parent changed since the last call of MeshRoutes.update()
+        self.changed = set()
+
+    def grow(self, count) :
+        while len(self.distance) < count :
+            self.distance.append(None)
+            self.parent.append(-1)
+            self.children.append(set())
+
+    # the weight of the link from node to other, None when node does not relay to other
+    def weight(self, node, other) :
+        cost = self.routes.links[node].get(other)
+        if cost is None or not self.routes.relays[node] :
+            return None
+        return cost if self.weighted else 1
+
+    # every path found again, from the root
+    def rebuild(self, root) :
+        for node in range(len(self.distance)) :
+            if self.distance[node] is not None :
+                self.changed.add(node)
+            self.distance[node] = None
+            self.parent[node] = -1
+            self.children[node].clear()
+        if root is not None :
+            self.distance[root] = 0
+            self.changed.add(root)
+            self.settle(self.expand(root, []))
+
+    # links is a collection of (node, other) whose cost, or whether node relays, changed, in either direction
+    def update(self, links) :
+        distance = self.distance
+        parent = self.parent
+
+        # the tree links that got worse or went away, what hangs off them has to find a path again
+        cut = []
+        for node, other in links :
+            for near, far in ((node, other), (other, node)) :
+                if parent[far] == near :
+                    weight = self.weight(near, far)
+                    if weight is None or distance[near] + weight > distance[far] :
+                        cut.append(far)
+        lost = []
+        while cut :
+            node = cut.pop()
+            if distance[node] is None :
+                continue
+            if parent[node] != -1 :
+                self.children[parent[node]].discard(node)
+            distance[node] = None
+            parent[node] = -1
+            self.changed.add(node)
+            lost.append(node)
+            cut.extend(self.children[node])
+            self.children[node].clear()
+
+        # the best way back in for the lost, and the links that got better or came
+        heap = []
+        for node in lost :
+            for other in self.routes.links[node] :
+                weight = self.weight(other, node)
+                if weight is not None and distance[other] is not None :
+                    heap.append((distance[other] + weight, node, other))
+        for node, other in links :
+            for near, far in ((node, other), (other, node)) :
+                weight = self.weight(near, far)
+                if weight is not None and distance[near] is not None and \
+                    (distance[far] is None or distance[near] + weight < distance[far]) :
+                    heap.append((distance[near] + weight, far, near))
+        heapq.heapify(heap)
+        self.settle(heap)
+
+    # the relaxations out of node, added to heap
+    def expand(self, node, heap) :
+        if self.routes.relays[node] :
+            base = self.distance[node]
+            for other, cost in self.routes.links[node].items() :
+                candidate = base + (cost if self.weighted else 1)
+                if self.distance[other] is None or candidate < self.distance[other] :
+                    heap.append((candidate, other, node))
+        return heap
+
+    # dijkstra from the (distance, node, parent) on the heap
+    def settle(self, heap) :
+        distance = self.distance
+        parent = self.parent
+        links = self.routes.links
+        relays = self.routes.relays
+        weighted = self.weighted
+        while heap :
+            base, node, near = heapq.heappop(heap)
+            if distance[node] is not None and distance[node] <= base :
+                continue
+            if parent[node] != -1 :
+                self.children[parent[node]].discard(node)
+            distance[node] = base
+            parent[node] = near
+            self.children[near].add(node)
+            self.changed.add(node)
+            if relays[node] :
+                for other, cost in links[node].items() :
+                    candidate = base + (cost if weighted else 1)
+                    if distance[other] is None or candidate < distance[other] :
+                        heapq.heappush(heap, (candidate, other, node))
+
+
+class MeshRoutes :
+
+    def __init__(self, graph) :
+        self.graph = graph
+        # by node id : {id : link cost} of the links of the node, the same link is in the dict of both ends, and
+        # whether the node relays
+        self.links = []
+        self.relays = []
+        self.root = None
+        self.hops = PathTree(self, False)
+        self.cost = PathTree(self, True)
+        # by node id, the 'Child' entries in its table, and the devices only reachable through it, from the
+        # immediate dominator of each node and its place in the walk that found them
+        self.children = []
+        self.stranded = []
+        self.idom = []
+        self.position = []
+        # by node id, the Route as last published, shared by the snapshots until it changes, and the ids whose
+        # children or stranded changed since
+        self.published = []
+        self.changed = set()
+        # statistics
+        self.updates = 0
+        self.links_changed = 0
+        self.dominator_runs = 0
+
+    def grow(self, count) :
+        while len(self.links) < count :
+            self.links.append({})
+            self.relays.append(False)
+            self.children.append(0)
+            self.stranded.append(0)
+            self.idom.append(-1)
+            self.position.append(-1)
+            self.published.append(NO_ROUTE)
+        self.hops.grow(count)
+        self.cost.grow(count)
+
+    # the link between two nodes as the graph has it now, None for no link
+    def graph_link_cost(self, node, other) :
+        forward = self.graph.forward
+        edge = forward[node].get(other)
+        back = forward[other].get(node)
+        if edge is None and back is None :
+            return None
+        if edge is None :
+            lqi = back.lqi
+        elif back is None :
+            lqi = edge.lqi
+        else :
+            lqi = min(edge.lqi, back.lqi)
+        return LINK_COSTS[max(0, min(255, lqi or 0))]
+
+    # bring everything up to date with the graph, coordinator is the IEEE address of the coordinator, None when
+    # the call had none, returns {IEEE address : Route} for the addresses in devices
+    def update(self, coordinator, devices) :
+        graph = self.graph
+        self.updates += 1
+        root = graph.node(coordinator) if coordinator is not None else None
+        self.grow(len(graph))
+
+        touched = graph.touched
+        graph.touched = set()
+        rebuild = root != self.root
+        if rebuild :
+            # a new coordinator, every node and every entry is looked at again
+            self.root = root
+            nodes = range(len(graph))
+            touched = touched.union((node, other) for node in nodes for other in graph.forward[node])
+        else :
+            nodes = set(node for node, other in touched)
+
+        # full when the dominator tree has to be found again, moved the nodes that do not relay whose links came
+        # or went
+        changed_links = set()
+        full = rebuild
+        moved = set()
+        links = self.links
+        forward = graph.forward
+        for node in nodes :
+            relays = node == root or node in graph.has_table
+            if relays != self.relays[node] :
+                self.relays[node] = relays
+                full = True
+                for other in links[node] :
+                    changed_links.add((node, other) if node < other else (other, node))
+            children = sum(1 for edge in forward[node].values() if edge.relationship == CHILD)
+            if children != self.children[node] :
+                self.children[node] = children
+                self.changed.add(node)
+        for node, other in touched :
+            cost = self.graph_link_cost(node, other)
+            old = links[node].get(other)
+            if cost == old :
+                continue
+            if cost is None :
+                del links[node][other]
+                del links[other][node]
+            else :
+                links[node][other] = cost
+                links[other][node] = cost
+            changed_links.add((node, other) if node < other else (other, node))
+            if cost is None or old is None :
+                if self.relays[node] and self.relays[other] :
+                    full = True
+                elif self.relays[node] :
+                    moved.add(other)
+                elif self.relays[other] :
+                    moved.add(node)
+        self.links_changed += len(changed_links)
+
+        if rebuild :
+            self.hops.rebuild(root)
+            self.cost.rebuild(root)
+        elif changed_links :
+            self.hops.update(changed_links)
+            self.cost.update(changed_links)
+        if full :
+            self.dominators()
+        else :
+            for node in moved :
+                self.redominate(node)
+
+        # the Route of the nodes that changed, the others keep the one they had
+        for node in self.changed.union(self.hops.changed, self.cost.changed) :
+            self.published[node] = self.route(node)
+        self.changed.clear()
+        self.hops.changed.clear()
+        self.cost.changed.clear()
+
+        ids = graph.ids
+        published = self.published
+        return dict((ieee, published[ids[ieee]] if ieee in ids else NO_ROUTE) for ieee in devices)
+
+    def route(self, node) :
+        via = self.cost.parent[node]
+        return Route(self.hops.distance[node], self.cost.distance[node], self.graph.addresses[via] if via != -1 else None, \
+            self.children[node], self.stranded[node])
+
+    # stranded, from the dominator tree of the nodes reachable from the root, the loss of a node strands the
+    # nodes it dominates, Cooper, Harvey and Kennedy, "A Simple, Fast Dominance Algorithm"
+    def dominators(self) :
+        self.dominator_runs += 1
+        count = len(self.links)
+        old = self.stranded
+        self.stranded = [0] * count
+        self.idom = [-1] * count
+        self.position = [-1] * count
+        root = self.root
+        if root is None :
+            self.changed_stranded(old)
+            return
+        links = self.links
+        relays = self.relays
+
+        # reverse postorder of a depth first walk from the root over the relaying nodes, the nodes that do not
+        # relay are leaves, they are in no path to another node, so they are left out of the iterations and get
+        # their dominator at the end
+        order = []
+        leaves = []
+        visited = [False] * count
+        visited[root] = True
+        stack = [(root, iter(links[root]))]
+        while stack :
+            node, others = stack[-1]
+            for other in others :
+                if not visited[other] :
+                    visited[other] = True
+                    if relays[other] :
+                        stack.append((other, iter(links[other])))
+                        break
+                    leaves.append(other)
+            else :
+                stack.pop()
+                order.append(node)
+        order.reverse()
+        position = self.position
+        for index, node in enumerate(order) :
+            position[node] = index
+
+        idom = self.idom
+        idom[root] = root
+        changed = True
+        while changed :
+            changed = False
+            for node in order[1 :] :
+                new = self.immediate_dominator(node)
+                if idom[node] != new :
+                    idom[node] = new
+                    changed = True
+        for node in leaves :
+            idom[node] = self.immediate_dominator(node)
+
+        # the size of the subtree of each node in the dominator tree, children come after their parent in order
+        size = [1] * count
+        for node in leaves :
+            size[idom[node]] += 1
+        for node in reversed(order[1 :]) :
+            size[idom[node]] += size[node]
+        for node in order[1 :] :
+            self.stranded[node] = size[node] - 1
+        self.changed_stranded(old)
+
+    # the nearest common dominator of the relaying nodes with a link to node, -1 if none of them is reachable
+    def immediate_dominator(self, node) :
+        idom = self.idom
+        position = self.position
+        relays = self.relays
+        new = -1
+        for other in self.links[node] :
+            if relays[other] and idom[other] != -1 :
+                if new == -1 :
+                    new = other
+                else :
+                    while other != new :
+                        while position[other] > position[new] :
+                            other = idom[other]
+                        while position[new] > position[other] :
+                            new = idom[new]
+        return new
+
+    # a node that does not relay had a link come or go, it dominates nothing and no path goes through it, so the
+    # rest of the dominator tree stays as it is, only the node moves, and the stranded of the nodes above it
+    def redominate(self, node) :
+        root = self.root
+        idom = self.idom
+        old = idom[node]
+        new = self.immediate_dominator(node)
+        if new == old :
+            return
+        idom[node] = new
+        for above, step in ((old, -1), (new, 1)) :
+            while above != -1 and above != root :
+                self.stranded[above] += step
+                self.changed.add(above)
+                above = idom[above]
+
+    def changed_stranded(self, old) :
+        for node in range(len(old)) :
+            if old[node] != self.stranded[node] :
+                self.changed.add(node)
+
+    # ---- queries, by IEEE address ----
+
+    # the addresses from a device to the coordinator on the least cost path, [] when it has none
+    def path(self, ieee) :
+        node = self.graph.ids.get(ieee)
+        if node is None or self.cost.distance[node] is None :
+            return []
+        path = [ieee]
+        while self.cost.parent[node] != -1 :
+            node = self.cost.parent[node]
+            path.append(self.graph.addresses[node])
+        return path
+
+    # (IEEE address, stranded) of the single points of failure, the most devices stranded first
+    def critical(self) :
+        addresses = self.graph.addresses
+        return sorted(((addresses[node], stranded) for node, stranded in enumerate(self.stranded) if stranded > 0), \
+            key=lambda entry : -entry[1])
+
+
+# EOF
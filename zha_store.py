@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+# zha_store.py
+
+# 202610182000
+# zha_device_name is only written when a name is new or changed, and the update had its parameters the wrong
+# way around, so names never changed
+# 202610181630
+# SQLite pragmas (WAL journaling, synchronous, mmap_size, cache_size, temp_store) set when the database is opened,
+# and ZhaReader, read only connections for reports that see a consistent snapshot and never block the collector
+# 202610181530
+# each web socket call is written in one transaction with executemany, group commit across several calls
+#
+# 202610181045
+#
+# SQLite database of the ZHA neighbor 'link' rows recorded by zha_ws.py
+# one database holds the rows of every Home Assistant site, the 'site' column says which one a row came from
+
+import re
+import time
+import sqlite3
+import urllib.parse
+from contextlib import contextmanager
+
+from zha_process import LINK_COLUMNS, ZHA_COLUMN_COUNT
+
+
+ZHA_TABLE = "CREATE TABLE IF NOT EXISTS zha (packet integer, retrieve_ts integer, neighbor_address text, neighbor_lqi int, neighbor_rssi int, neighbor_delta_last_seen real, neighbor_last_seen_ts integer, neighbor_device_type text, neighbor_available text, neighbor_depth int, neighbor_relationship text, peer_nwk int, peer_lqi int, peer_rssi int, peer_available text, peer_address text)"
+ZHA_DEVICE_NAME_TABLE = "CREATE TABLE IF NOT EXISTS zha_device_name (device_address text primary key, device_given_name text)"
+ZHA_DEVICE_NAME_UPSERT = "insert into zha_device_name values (?, ?) on conflict (device_address) do update set device_given_name = excluded.device_given_name"
+
+# the site column was added to the zha table later, it is always last, see ZhaStore.open()
+ZHA_INSERT_TABLE = "insert into {table} (" + ", ".join(LINK_COLUMNS) + ", site) values (" + ", ".join(["?"] * (ZHA_COLUMN_COUNT + 1)) + ")"
+ZHA_INSERT = ZHA_INSERT_TABLE.format(table="zha")
+
+
+# pragmas that can be set from zha_ws.yaml, a pragma name can not be a query parameter, so only these are allowed
+#  journal_mode : "wal" lets readers and the writer work at the same time, "delete" is the sqlite default
+#  synchronous  : "normal" is safe with wal, a power loss can only lose the last commits, "full" syncs every commit
+#  mmap_size    : bytes of the database file read through memory mapping, 0 for none
+#  cache_size   : pages, or when negative kilobytes, of page cache per connection
+#  temp_store   : "memory" keeps temporary tables and indices (sorting, group by) out of temporary files
+STORE_PRAGMAS = ("journal_mode", "synchronous", "mmap_size", "cache_size", "temp_store", "wal_autocheckpoint", "busy_timeout")
+
+# the pragmas that mean something on a read only connection
+READER_PRAGMAS = ("mmap_size", "cache_size", "temp_store", "busy_timeout")
+
+
+# set pragmas on a connection, returns what sqlite reports back for each, so the log shows what is really in effect
+def apply_pragmas(sql_conn, pragmas, allowed=STORE_PRAGMAS) :
+    settings = {}
+    for name, value in (pragmas or {}).items() :
+        if name not in allowed :
+            raise ValueError("unknown SQLite pragma : " + str(name))
+        value = str(value)
+        if not re.fullmatch(r"-?[0-9A-Za-z_]+", value) :
+            raise ValueError("bad value for SQLite pragma " + name + " : " + value)
+        sql_conn.execute("PRAGMA " + name + " = " + value)
+        row = sql_conn.execute("PRAGMA " + name).fetchone()
+        settings[name] = row[0] if row is not None else None
+    return settings
+
+
+# datetimes are stored the way the sqlite3 module has always stored them for us, 'YYYY-MM-DD HH:MM:SS'
+def sql_value(value) :
+    if hasattr(value, "isoformat") :
+        return value.isoformat(" ")
+    return value
+
+
+# the values of a zha_process.LinkRow that go into the 'zha' table
+def zha_values(link) :
+    return [sql_value(value) for value in link[:ZHA_COLUMN_COUNT]]
+
+
+class ZhaStore :
+
+    # commit_polls : commit after this many web socket calls have been written, 1 commits every call
+    # commit_seconds : also commit once the oldest uncommitted call is this many seconds old, 0 for no time limit
+    # rows written since the last commit are lost if the program is killed, a clean exit (close) commits them
+    # pragmas : dict of STORE_PRAGMAS set on open, None leaves the sqlite defaults
+    # derived : tables kept up to date from the rows as they are written, in the same transaction, objects with
+    #           create_tables(sql_cursor), add_snapshot(sql_conn, snapshot) and close(sql_conn), see zha_rollup.py
+    def __init__(self, database_file, commit_polls=1, commit_seconds=0, pragmas=None, derived=None) :
+        self.database_file = database_file
+        self.pragmas = pragmas
+        self.derived = list(derived or [])
+        # the pragma values in effect after open()
+        self.settings = {}
+        self.commit_polls = max(1, commit_polls)
+        self.commit_seconds = commit_seconds
+        self.sql_conn = None
+        # device_address -> device_given_name as it is in the zha_device_name table
+        self.device_names = {}
+        # web socket calls written since the last commit, and when the first of them was written
+        self.uncommitted_polls = 0
+        self.uncommitted_since = None
+        # statistics, each commit is at least one fsync of the database
+        self.commits = 0
+        self.rows_written = 0
+
+    # open database and create tables if they do not exists
+    # check_same_thread is off, the collector opens the store on one thread and writes from its writer thread
+    def open(self) :
+        self.sql_conn = sqlite3.connect(self.database_file, check_same_thread=False)
+        # journal_mode has to be set outside of a transaction, so before anything else
+        self.settings = apply_pragmas(self.sql_conn, self.pragmas)
+        sql_cursor = self.sql_conn.cursor()
+        self.create_tables(sql_cursor)
+        for derived in self.derived :
+            derived.create_tables(sql_cursor)
+        self.sql_conn.commit()
+        return self
+
+    def create_tables(self, sql_cursor) :
+        sql_cursor.execute(ZHA_TABLE)
+        sql_cursor.execute(ZHA_DEVICE_NAME_TABLE)
+        # databases from before there were several sites, add the site column, old rows keep a null site
+        columns = [row[1] for row in sql_cursor.execute("PRAGMA table_info(zha)")]
+        if "site" not in columns :
+            sql_cursor.execute("ALTER TABLE zha ADD COLUMN site text")
+        self.device_names = dict(sql_cursor.execute("select device_address, device_given_name from zha_device_name").fetchall())
+
+    def close(self) :
+        if self.sql_conn is not None :
+            for derived in self.derived :
+                derived.close(self.sql_conn)
+            self.commit()
+            # and whatever the derived tables wrote on close
+            self.sql_conn.commit()
+            self.sql_conn.close()
+            self.sql_conn = None
+
+    def commit(self) :
+        if self.uncommitted_polls > 0 :
+            self.sql_conn.commit()
+            self.commits += 1
+        self.uncommitted_polls = 0
+        self.uncommitted_since = None
+
+    # throw away every call written since the last commit, after an insert or commit that can not be tried again
+    # the rows are gone, but what the store keeps in memory about them is not, do not write with this store
+    # again, open a new one
+    def rollback(self) :
+        self.sql_conn.rollback()
+        self.uncommitted_polls = 0
+        self.uncommitted_since = None
+
+    # insert the record for status of each neighbor link into the database table for this web socket call
+    # all the rows of the call go in with one executemany per table, inside one transaction
+    def write_snapshot(self, snapshot) :
+        rows = self.insert_snapshot(snapshot)
+        if self.commit_due() :
+            self.commit()
+        return rows
+
+    # the inserts of write_snapshot without the commit
+    # if the database is locked by another program this raises sqlite3.OperationalError on the first insert,
+    # before any row of the call is written, so it can be tried again, the same for a commit that fails
+    # any other error can leave part of the call written in the open transaction, only rollback() gets rid of it
+    def insert_snapshot(self, snapshot) :
+
+        if snapshot.setup_pass :
+            return 0
+
+        rows = self.insert_links(snapshot)
+        for derived in self.derived :
+            derived.add_snapshot(self.sql_conn, snapshot)
+
+        self.rows_written += rows
+        self.uncommitted_polls += 1
+        if self.uncommitted_since is None :
+            self.uncommitted_since = time.monotonic()
+
+        return rows
+
+    # the rows of one web socket call, in the tables of this schema, returns the number of links
+    def insert_links(self, snapshot) :
+
+        sql_cursor = self.sql_conn.cursor()
+
+        site = snapshot.site
+        sql_cursor.executemany(ZHA_INSERT_TABLE.format(table=self.link_table(snapshot)), [zha_values(link) + [site] for link in snapshot.links])
+
+        # one name per device, the same neighbor shows up in many rows, and only the names that are new or changed
+        # are written, the names as they are in the table are kept in memory, renames are kept in zha_device_history.py
+        names = [(address, name) for address, name in dict((link.neighbor_address, link.neighbor_given_name) for link in snapshot.links).items() \
+            if self.device_names.get(address) != name]
+        if names :
+            sql_cursor.executemany(ZHA_DEVICE_NAME_UPSERT, names)
+            self.device_names.update(names)
+
+        return len(snapshot.links)
+
+    # the table the rows of a web socket call go in, see zha_partition.py
+    def link_table(self, snapshot) :
+        return "zha"
+
+    # group commit, several web socket calls can share one transaction
+    def commit_due(self) :
+        return self.uncommitted_polls >= self.commit_polls or \
+            (self.uncommitted_polls > 0 and self.commit_seconds > 0 and time.monotonic() - self.uncommitted_since >= self.commit_seconds)
+
+
+# read only connection for reports and analytics while zha_ws.py keeps writing
+#
+# concurrent reader mode : with journal_mode "wal" on the store, a reader never blocks the writer and the writer
+# never blocks a reader, each query or each snapshot() block sees the database as of one commit, rows written
+# after that are not seen until the next one
+# with the default "delete" journal a reader holds a shared lock for as long as its query runs, and the
+# collector can not commit until it is done, so use wal for anything but short queries
+# keep snapshot() blocks short anyway, the wal file can not be checkpointed past the oldest open snapshot and
+# keeps growing while one is open
+#
+#  reader = ZhaReader("zha_ws.db").open()
+#  with reader.snapshot() as sql_conn :
+#      rows = sql_conn.execute("select count(*) from zha").fetchone()
+#      names = sql_conn.execute("select * from zha_device_name").fetchall()   # same snapshot as the count
+#  reader.close()
+class ZhaReader :
+
+    # pragmas : dict of READER_PRAGMAS, mmap_size and cache_size help big scans
+    def __init__(self, database_file, pragmas=None) :
+        self.database_file = database_file
+        self.pragmas = pragmas
+        self.sql_conn = None
+
+    def open(self) :
+        # read only, it can not take the write lock by mistake, and autocommit so snapshot() decides what a
+        # transaction covers
+        self.sql_conn = sqlite3.connect("file:" + urllib.parse.quote(self.database_file) + "?mode=ro", uri=True, isolation_level=None, \
+            check_same_thread=False)
+        apply_pragmas(self.sql_conn, self.pragmas, allowed=READER_PRAGMAS)
+        self.sql_conn.execute("PRAGMA query_only = 1")
+        return self
+
+    def close(self) :
+        if self.sql_conn is not None :
+            self.sql_conn.close()
+            self.sql_conn = None
+
+    # every query inside the block reads the same snapshot of the database
+    @contextmanager
+    def snapshot(self) :
+        self.sql_conn.execute("BEGIN")
+        try :
+            yield self.sql_conn
+        finally :
+            self.sql_conn.execute("COMMIT")
+
+    # one query, a snapshot of its own
+    def query(self, sql, parameters=()) :
+        return self.sql_conn.execute(sql, parameters).fetchall()
+
+
+# EOF
@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+# zha_writer.py
+
+# 202610182100
+# the raw json goes to the archive of zha_archive.py instead of being appended to a json file per call
+# 202610181600
+#
+# background SQLite writer for zha_collector.py
+# the results of the web socket calls wait in a bounded queue and one thread of its own writes them to the
+# ZhaStore, so the collector never waits on the disk, or on another program (sqlite3 shell, a report) that
+# has the database locked, the writer just keeps trying until the lock is gone while the queue fills up
+#
+# when the queue is full the overflow policy decides what happens to the next result :
+#  block    : the collector waits for room in the queue, nothing is lost, the web socket calls slow down
+#  coalesce : the newest queued result of the same site is replaced by the new one, the calls in between are
+#             not written, the database keeps up with the current state but has gaps in the history
+#  spill    : results go to a spill file on disk, and are read back and written in order once the database
+#             has caught up, nothing is lost as long as the program is not killed
+#
+# queue depth, write latency and the overflow counters are in stats(), and are logged every log_interval seconds
+#
+# any other database error (disk full, a constraint, a bug in a derived table) rolls back every call written
+# since the last commit and stops the writer, the store and its derived tables keep in memory what they wrote,
+# so they can not carry on after a rollback, the next put() raises and the collector ends, a restart reads
+# everything back from the database
+
+import time
+import pickle
+import sqlite3
+import logging
+import tempfile
+import threading
+import traceback
+import statistics
+from collections import deque
+
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_SPILL = "spill"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_COALESCE, OVERFLOW_SPILL)
+
+# latencies kept for the statistics, the newest ones
+LATENCY_SAMPLES = 10000
+
+
+# median and 95th percentile in milliseconds
+def latency_ms(latency) :
+    if not latency :
+        return 0.0, 0.0
+    latency = sorted(latency)
+    return statistics.median(latency) * 1000, latency[max(0, int(len(latency) * 0.95) - 1)] * 1000
+
+
+class ZhaWriter :
+
+    # queue_size : results of web socket calls waiting in memory before the overflow policy starts
+    # spill_file : file for the 'spill' policy, it is emptied when the writer starts, None for a temporary file
+    # retry_seconds : pause between tries while the database is locked by another program
+    # archive : zha_archive.RawArchive the raw json of the calls that kept it (snapshot.raw) is written to, None for none
+    def __init__(self, store, queue_size=1000, overflow=OVERFLOW_BLOCK, spill_file=None, retry_seconds=1.0, \
+        log_interval=300, logger=None, archive=None) :
+
+        if overflow not in OVERFLOW_POLICIES :
+            raise ValueError("unknown database writer overflow policy : " + str(overflow))
+
+        self.store = store
+        self.archive = archive
+        self.queue_size = max(1, queue_size)
+        self.overflow = overflow
+        self.spill_file = spill_file
+        self.retry_seconds = retry_seconds
+        self.log_interval = log_interval
+        self.logger = logger if logger is not None else logging.getLogger("zha_writer")
+
+        # (time the call was sent, snapshot), oldest first
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+        # why the writer stopped after a database error, None while it works
+        self.failure = None
+
+        # the spill file, opened when first needed, results are appended at the end and read back from read_offset
+        self.spill = None
+        self.spill_read_offset = 0
+        self.spilled = 0
+
+        # send times of the calls written since the last commit
+        self.uncommitted_sent = []
+
+        # statistics
+        self.polls_written = 0
+        self.polls_coalesced = 0
+        self.polls_spilled = 0
+        self.polls_failed = 0
+        self.lock_retries = 0
+        self.max_depth = 0
+        # seconds to write one call to the database
+        self.write_latency = deque(maxlen=LATENCY_SAMPLES)
+        # seconds from sending the 'zha/devices' call to its rows being committed to the database
+        self.persist_latency = deque(maxlen=LATENCY_SAMPLES)
+
+    def start(self) :
+        self.thread = threading.Thread(target=self.run, name="zha_writer", daemon=True)
+        self.thread.start()
+        return self
+
+    # write everything still queued or spilled, then stop the thread
+    # timeout : seconds to wait for that, None waits as long as it takes (the database may be locked)
+    def close(self, timeout=None) :
+        with self.condition :
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread is not None :
+            self.thread.join(timeout)
+            if self.thread.is_alive() :
+                self.logger.error("Error : database writer did not finish, results not written : " + str(self.depth()))
+                return
+            self.thread = None
+        if self.spill is not None :
+            self.spill.close()
+            self.spill = None
+
+    # results waiting to be written, in memory and in the spill file
+    def depth(self) :
+        return len(self.queue) + self.spilled
+
+    # True if put() would wait for room in the queue, only the 'block' policy ever waits
+    def would_block(self) :
+        return self.overflow == OVERFLOW_BLOCK and len(self.queue) >= self.queue_size
+
+    # queue the result of one web socket call to be written, raises once the writer stopped on a database error
+    def put(self, sent, snapshot) :
+
+        item = (sent, snapshot)
+        with self.condition :
+            if self.failure is not None :
+                raise RuntimeError("database writer stopped : " + self.failure)
+            # once results are spilled everything after them is spilled too, to keep the calls in order
+            if len(self.queue) < self.queue_size and self.spilled == 0 :
+                self.queue.append(item)
+            elif self.overflow == OVERFLOW_BLOCK :
+                while len(self.queue) >= self.queue_size and self.failure is None :
+                    self.condition.wait()
+                if self.failure is not None :
+                    raise RuntimeError("database writer stopped : " + self.failure)
+                self.queue.append(item)
+            elif self.overflow == OVERFLOW_COALESCE :
+                self.coalesce(item)
+            else :
+                self.spill_item(item)
+            self.max_depth = max(self.max_depth, self.depth())
+            self.condition.notify_all()
+
+    def coalesce(self, item) :
+        if self.polls_coalesced == 0 :
+            self.logger.error("Error : database writes are falling behind, coalescing queued web socket results")
+        self.polls_coalesced += 1
+        site = item[1].site
+        for ii in range(len(self.queue) - 1, -1, -1) :
+            if self.queue[ii][1].site == site :
+                self.queue[ii] = item
+                return
+        # nothing of this site queued, make room by dropping the oldest result
+        self.queue.popleft()
+        self.queue.append(item)
+
+    def spill_item(self, item) :
+        if self.spill is None :
+            self.spill = open(self.spill_file, 'w+b') if self.spill_file is not None else tempfile.TemporaryFile(prefix="zha_spill")
+        if self.spilled == 0 :
+            self.logger.error("Error : database writes are falling behind, spilling web socket results to disk")
+        self.spill.seek(0, 2)
+        pickle.dump(item, self.spill, protocol=pickle.HIGHEST_PROTOCOL)
+        self.spilled += 1
+        self.polls_spilled += 1
+
+    def unspill_item(self) :
+        self.spill.seek(self.spill_read_offset)
+        item = pickle.load(self.spill)
+        self.spill_read_offset = self.spill.tell()
+        self.spilled -= 1
+        if self.spilled == 0 :
+            # all read back, start the file over
+            self.spill.seek(0)
+            self.spill.truncate()
+            self.spill_read_offset = 0
+        return item
+
+    # the next result to write, the queue first, it is older than anything spilled
+    # None when there is nothing after waiting up to timeout seconds
+    def next_item(self, timeout) :
+        with self.condition :
+            if not self.queue and self.spilled == 0 and not self.stopping :
+                self.condition.wait(timeout)
+            if self.queue :
+                item = self.queue.popleft()
+                self.condition.notify_all()
+                return item
+            if self.spilled > 0 :
+                return self.unspill_item()
+            return None
+
+    # ---- writer thread ----
+
+    def run(self) :
+
+        last_log = time.monotonic()
+        while self.failure is None :
+            item = self.next_item(1.0)
+            if item is not None :
+                self.write(item)
+            elif self.stopping :
+                break
+            # the commit_seconds window of the store ends even when no more results arrive
+            if self.failure is None and self.store.uncommitted_polls > 0 and self.store.commit_due() :
+                try :
+                    self.commit()
+                except Exception as e :
+                    self.abort("Unable to commit database")
+            if self.log_interval and time.monotonic() - last_log >= self.log_interval :
+                last_log = time.monotonic()
+                self.log_stats()
+
+        if self.failure is None :
+            try :
+                self.commit()
+            except Exception as e :
+                self.abort("Unable to commit database")
+
+    def write(self, item) :
+
+        sent, snapshot = item
+        start = time.perf_counter()
+        try :
+            # the current web socket result into the raw json archive
+            if self.archive is not None and snapshot.raw is not None :
+                self.archive.write(snapshot)
+            self.retry(self.store.insert_snapshot, snapshot)
+        except Exception as e :
+            self.polls_failed += 1
+            self.abort("Unable to write to database")
+            return
+        self.uncommitted_sent.append(sent)
+        self.polls_written += 1
+        try :
+            if self.store.commit_due() :
+                self.commit()
+        except Exception as e :
+            self.abort("Unable to commit database")
+            return
+        self.write_latency.append(time.perf_counter() - start)
+
+    # a database error that waiting does not fix, throw away the uncommitted calls and stop, see the top of the file
+    def abort(self, message) :
+        self.logger.error("Error : " + message + ", database writer stopped : " + traceback.format_exc())
+        try :
+            self.store.rollback()
+        except Exception as e :
+            self.logger.error("Error : Unable to roll back database : " + traceback.format_exc())
+        # the calls of the group commit window were counted as written, none of them are
+        self.polls_written -= len(self.uncommitted_sent)
+        self.polls_failed += len(self.uncommitted_sent)
+        self.uncommitted_sent = []
+        with self.condition :
+            self.failure = message
+            self.polls_failed += self.depth()
+            self.condition.notify_all()
+
+    def commit(self) :
+        self.retry(self.store.commit)
+        now = time.perf_counter()
+        self.persist_latency.extend(now - sent for sent in self.uncommitted_sent)
+        self.uncommitted_sent = []
+
+    # another program holding the database lock is not an error, wait for it, nothing of the call was written
+    def retry(self, function, *args) :
+        while True :
+            try :
+                return function(*args)
+            except sqlite3.OperationalError as e :
+                if "locked" not in str(e) and "busy" not in str(e) :
+                    raise
+                if self.lock_retries == 0 or self.lock_retries % 60 == 0 :
+                    self.logger.error("Error : database is locked by another program, retrying : " + str(e))
+                self.lock_retries += 1
+                time.sleep(self.retry_seconds)
+
+    # ---- statistics ----
+
+    def stats(self) :
+        write_median, write_p95 = latency_ms(self.write_latency)
+        persist_median, persist_p95 = latency_ms(self.persist_latency)
+        return {'depth' : self.depth(), \
+                'spilled' : self.spilled, \
+                'max_depth' : self.max_depth, \
+                'written' : self.polls_written, \
+                'coalesced' : self.polls_coalesced, \
+                'spilled_total' : self.polls_spilled, \
+                'failed' : self.polls_failed, \
+                'lock_retries' : self.lock_retries, \
+                'write_ms_median' : write_median, \
+                'write_ms_p95' : write_p95, \
+                'persist_ms_median' : persist_median, \
+                'persist_ms_p95' : persist_p95}
+
+    def log_stats(self) :
+        self.logger.info("Database writer : " + ", ".join(key + " " + (f"{value:.1f}" if isinstance(value, float) else str(value)) \
+            for key, value in self.stats().items()))
+
+
+# EOF
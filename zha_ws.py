@@ -3,9 +3,11 @@
 
 PROGRAM_NAME = "zha_ws"
 VERSION_MAJOR = "1"
-VERSION_MINOR = "1"
+VERSION_MINOR = "2"
 WORKING_DIRECTORY = "/home/user/ha-websocket/"
 
+# 202610181145
+# web socket calls, database writes and display now run as separate asyncio tasks, see zha_collector.py
 # 202101231638        
 #
 # use home assistant web sockets to read zha zigbee devices current state and insert a record into SQLite database for each device found
@@ -15,6 +17,8 @@ WORKING_DIRECTORY = "/home/user/ha-websocket/"
 # http://jsonviewer.stack.hu/
 # https://github.com/websocket-client/websocket-client
 # pip3 install websocket-client        0.53.0
+# https://websockets.readthedocs.io/
+# pip3 install websockets
 
 import sys
 
@@ -27,18 +31,25 @@ if not (sys.version_info.major == 3 and sys.version_info.minor >= 7):
 
 
 import traceback
-import json
-import time
-import sqlite3
+import asyncio
 from rich.console import Console
 import yaml
 # from deepdiff import DeepDiff
 # from pprint import pprint
-from datetime import datetime
-from datetime import timedelta
 
 from pathlib import Path
-from websocket import create_connection
+
+from zha_store import ZhaStore
+from zha_normalized import NormalizedZhaStore
+from zha_delta import DeltaZhaStore
+from zha_rollup import ZhaRollup
+from zha_partition import PartitionedZhaStore
+from zha_queries import create_indexes
+from zha_current import ZhaCurrent
+from zha_device_history import ZhaDeviceHistory
+from zha_route_history import ZhaRouteHistory
+from zha_archive import RawArchive
+from zha_collector import ZhaCollector
 
 import logging
 import logging.handlers
@@ -115,61 +126,97 @@ root_logger.setLevel(logging_level_file)
 # number of seconds between queries to ZHA
 QUERY_PERIOD_SECONDS = PROGRAM_CONFIG.get("check_interval", 5)
 
+# number of seconds to wait for an answer on the web socket before it is considered hung and reconnected
+WS_TIMEOUT_SECONDS = PROGRAM_CONFIG.get("ws_timeout", 30)
+
+# "poll" : call zha/devices every check_interval seconds
+# "subscribe" : keep device data current from HA events, full zha/devices download every resync_interval seconds
+INGEST_MODE = PROGRAM_CONFIG.get("ingest_mode", "poll")
+RESYNC_INTERVAL_SECONDS = PROGRAM_CONFIG.get("resync_interval", 300)
+
+# read the devices of each 'zha/devices' result one at a time, instead of decoding the whole frame at once
+STREAM_DECODE = PROGRAM_CONFIG.get("stream_decode", False)
+
 # Home Assistant Long-Lived Access Token
 ACCESS_TOKEN = PROGRAM_CONFIG.get("access_token", "")
 
-if (ACCESS_TOKEN == "") :
-    my_logger.error("Error : Home Assistant Long Lived Access Token Missing.")
-    sys.exit(1)
-
 # SQLite database file
 DATABASE_FILE = PROGRAM_NAME + ".db"
 
-# home assistant server IP address
-HOME_ASSISTANT_IP = PROGRAM_CONFIG.get("ha_ip", "localhost:8123")
+# "wide" : the zha table, text addresses and timestamps on every row
+# "normalized" : integer only link rows with device / device_type / relationship lookup tables, see zha_normalized.py
+# "delta" : normalized, and a link only gets a new row when its values change, see zha_delta.py
+DATABASE_SCHEMA = PROGRAM_CONFIG.get("schema", "wide")
 
-# flag to indicate of the raw web socket json results should be kept in a .json file
-RAW_JSON_KEEP = PROGRAM_CONFIG.get("raw_json_keep", False)
+# keep the 1 minute / 1 hour / 1 day rollup tables of each link up to date, see zha_rollup.py
+ROLLUPS = PROGRAM_CONFIG.get("rollups", True)
+# seconds between writes of the rollup buckets still open (this hour, today)
+ROLLUP_FLUSH_SECONDS = PROGRAM_CONFIG.get("rollup_flush_seconds", 300)
 
-# rich print setup
-# stops rich print from interpreting some parts of MAC addresses as emojis 
-console = Console(emoji=False, color_system="256", highlight=False)
+# keep the zha_current / device_current tables of the mesh as of the last web socket call, see zha_current.py
+CURRENT_TABLES = PROGRAM_CONFIG.get("current_tables", True)
 
+# keep every version of the name, nwk address, type, manufacturer / model and power source of each device, see zha_device_history.py
+DEVICE_HISTORY = PROGRAM_CONFIG.get("device_history", True)
 
-# set up web socket call to Home Assistant
-def ws_init() :
+# keep the routes of each device to the coordinator and the single points of failure of each call, see zha_route_history.py
+ROUTE_HISTORY = PROGRAM_CONFIG.get("route_history", True)
 
-    not_connected = True
+# wide schema only, a table of its own for the rows of each "day", "week" or "month", "" for the one zha table
+# and partitions that ended more than RETENTION_DAYS ago are dropped, 0 keeps everything, see zha_partition.py
+PARTITION_PERIOD = PROGRAM_CONFIG.get("partition_period", "")
+RETENTION_DAYS = PROGRAM_CONFIG.get("retention_days", 0)
 
-    while not_connected :
-        try :
-            # open web socket connection to Home Assistant server
-            ha_web_socket_handle = create_connection("ws://" + HOME_ASSISTANT_IP + "/api/websocket")
-            # connection ack
-            result =  ha_web_socket_handle.recv()
-            # send authentication token to HA server
-            ha_web_socket_handle.send(json.dumps(
-                    {'type': 'auth',
-                     'access_token': ACCESS_TOKEN}
-                ))
+# wide schema, the indexes the queries of zha_queries.py need, they make every insert a little slower
+QUERY_INDEXES = PROGRAM_CONFIG.get("query_indexes", True)
 
-            # authentication result
-            result =  ha_web_socket_handle.recv()
+# group commit, commit the database after this many web socket calls, or once the oldest uncommitted call
+# is this many seconds old, whichever comes first, 1 and 0 commit every call
+COMMIT_POLLS = PROGRAM_CONFIG.get("commit_polls", 1)
+COMMIT_SECONDS = PROGRAM_CONFIG.get("commit_seconds", 0)
 
-            # we need a unique identifier to sent as part of each web socket request
-            ws_identifier = 1
+# SQLite pragmas set when the database is opened, see zha_store.STORE_PRAGMAS
+# wal journaling lets report programs read the database while this program writes it, see zha_store.ZhaReader
+SQLITE_PRAGMAS = PROGRAM_CONFIG.get("sqlite_pragmas", {"journal_mode" : "wal", "synchronous" : "normal"})
 
-            not_connected = False
+# database writer queue, web socket results waiting to be written, and what to do when it is full
+# "block" : wait for the database, "coalesce" : keep only the newest results, "spill" : queue them in WRITER_SPILL_FILE
+WRITER_QUEUE_SIZE = PROGRAM_CONFIG.get("writer_queue_size", 1000)
+WRITER_OVERFLOW = PROGRAM_CONFIG.get("writer_overflow", "block")
+WRITER_SPILL_FILE = PROGRAM_CONFIG.get("writer_spill_file", PROGRAM_NAME + ".spill")
+
+# home assistant server IP address
+HOME_ASSISTANT_IP = PROGRAM_CONFIG.get("ha_ip", "localhost:8123")
 
-        except Exception as e:
-            print("Error : Unable connect to web socket, retrying.")
-            print(traceback.format_exc())
-            my_logger.error("Error : Unable connect to web socket, retrying : " + traceback.format_exc())
-            # pause
-            time.sleep( QUERY_PERIOD_SECONDS * 5)
-            continue
+# flag to indicate of the raw web socket json results should be kept, in the compressed archive of zha_archive.py
+# in RAW_ARCHIVE_DIR, "gzip" or "zstd" (needs the zstandard module), a new segment each day or every RAW_ARCHIVE_SEGMENT_MB
+RAW_JSON_KEEP = PROGRAM_CONFIG.get("raw_json_keep", False)
+RAW_ARCHIVE_DIR = PROGRAM_CONFIG.get("raw_archive_dir", "raw")
+RAW_ARCHIVE_COMPRESSION = PROGRAM_CONFIG.get("raw_archive_compression", "gzip")
+RAW_ARCHIVE_SEGMENT_MB = PROGRAM_CONFIG.get("raw_archive_segment_mb", 64)
+
+# Home Assistant sites to collect from, all into the one database, each row records the site name
+# if there is no 'sites' list in the YAML config file, the single ha_ip / access_token above is the only site
+# settings a site does not give itself are taken from the single site settings above
+SITES = []
+for site_config in (PROGRAM_CONFIG.get("sites") or [{"name" : PROGRAM_CONFIG.get("site", HOME_ASSISTANT_IP)}]) :
+    site = {"name" : site_config.get("name", site_config.get("ha_ip", HOME_ASSISTANT_IP)), \
+        "ha_ip" : site_config.get("ha_ip", HOME_ASSISTANT_IP), \
+        "access_token" : site_config.get("access_token", ACCESS_TOKEN), \
+        "check_interval" : site_config.get("check_interval", QUERY_PERIOD_SECONDS), \
+        "ws_timeout" : site_config.get("ws_timeout", WS_TIMEOUT_SECONDS), \
+        "ingest_mode" : site_config.get("ingest_mode", INGEST_MODE), \
+        "resync_interval" : site_config.get("resync_interval", RESYNC_INTERVAL_SECONDS), \
+        "stream_decode" : site_config.get("stream_decode", STREAM_DECODE) \
+        }
+    if (site["access_token"] == "") :
+        my_logger.error("Error : Home Assistant Long Lived Access Token Missing for site : " + str(site["name"]) + ".")
+        sys.exit(1)
+    SITES.append(site)
 
-    return ha_web_socket_handle, ws_identifier
+# rich print setup
+# stops rich print from interpreting some parts of MAC addresses as emojis 
+console = Console(emoji=False, color_system="256", highlight=False)
 
 
 def main():
@@ -179,458 +226,58 @@ def main():
     my_logger.info("Web socket call interval (seconds) : " + str(QUERY_PERIOD_SECONDS))
 
 
-    if len(ACCESS_TOKEN) == 0 :
-        print("Error : HA Long-Lived token not defined in variable ACCESS_TOKEN")
-        my_logger.error("Error : HA Long-Lived token not defined in variable ACCESS_TOKEN")
-        sys.exit(1)
+    for site in SITES :
+        my_logger.info("Site : " + str(site["name"]) + " : " + site["ha_ip"] + " Ingest mode : " + site["ingest_mode"])
      
     # open database and create tables if they do not exists
-    sql_conn = sqlite3.connect(DATABASE_FILE)
-    sql_cursor = sql_conn.cursor()
-    sql_cursor.execute("CREATE TABLE IF NOT EXISTS zha (packet integer, retrieve_ts integer, neighbor_address text, neighbor_lqi int, neighbor_rssi int, neighbor_delta_last_seen real, neighbor_last_seen_ts integer, neighbor_device_type text, neighbor_available text, neighbor_depth int, neighbor_relationship text, peer_nwk int, peer_lqi int, peer_rssi int, peer_available text, peer_address text)")
-    sql_cursor.execute("CREATE TABLE IF NOT EXISTS zha_device_name (device_address text primary key, device_given_name text)")
-
-    # connect to Home Assistant Web Socket Interface
-    ws, ident = ws_init()
-
-    # do one processing pass on the first ZHA web socket call to populate the devices
-    SETUP_PASS = True
-
-    # we will create a database (dictionary) of zigbee devices that are returned by the web socket call to ZHA
-    # we keep appending on new entries with each web socket call
-    device_db = {}
-
-    neighbor_db = {}
-
-    # initialize dump file of raw received json
-    if RAW_JSON_KEEP :
-        f = open(PROGRAM_NAME + '.json', 'w')
-        f.write('[\n')
-        f.close()
+    store_settings = {"commit_polls" : COMMIT_POLLS, "commit_seconds" : COMMIT_SECONDS, "pragmas" : SQLITE_PRAGMAS, \
+        "derived" : ([ZhaRollup(flush_seconds=ROLLUP_FLUSH_SECONDS)] if ROLLUPS else []) + ([ZhaCurrent()] if CURRENT_TABLES else []) + \
+        ([ZhaDeviceHistory()] if DEVICE_HISTORY else []) + ([ZhaRouteHistory()] if ROUTE_HISTORY else [])}
+    if DATABASE_SCHEMA == "normalized" :
+        store = NormalizedZhaStore(DATABASE_FILE, **store_settings)
+    elif DATABASE_SCHEMA == "delta" :
+        store = DeltaZhaStore(DATABASE_FILE, **store_settings)
+    elif PARTITION_PERIOD :
+        store = PartitionedZhaStore(DATABASE_FILE, partition_period=PARTITION_PERIOD, retention_days=RETENTION_DAYS, \
+            query_indexes=QUERY_INDEXES, **store_settings)
+    else :
+        store = ZhaStore(DATABASE_FILE, **store_settings)
+    store.open()
+    if QUERY_INDEXES and DATABASE_SCHEMA == "wide" :
+        # the first time on a big zha table this takes a while
+        my_logger.info("Creating query indexes")
+        create_indexes(store.sql_conn)
+    my_logger.info("SQLite settings : " + str(store.settings))
+
+    # web socket calls, processing, database writes and display each run as their own asyncio task, see zha_collector.py
+    async def collect() :
+        # one raw json archive for all sites, each line says which site it is from
+        archive = None
+        if RAW_JSON_KEEP :
+            archive = RawArchive(RAW_ARCHIVE_DIR, name=PROGRAM_NAME, compression=RAW_ARCHIVE_COMPRESSION, \
+                segment_bytes=RAW_ARCHIVE_SEGMENT_MB * 1024 * 1024).open()
+        collector = ZhaCollector(store, console=console, logger=my_logger, \
+            persist_queue_size=WRITER_QUEUE_SIZE, \
+            overflow=WRITER_OVERFLOW, \
+            spill_file=WRITER_SPILL_FILE, \
+            archive=archive)
+        for site in SITES :
+            collector.add_site(str(site["name"]), site["ha_ip"], site["access_token"], \
+                check_interval=site["check_interval"], \
+                ws_timeout=site["ws_timeout"], \
+                ingest_mode=site["ingest_mode"], \
+                resync_interval=site["resync_interval"], \
+                keep_raw=RAW_JSON_KEEP, \
+                stream_decode=site["stream_decode"])
+        await collector.run()
 
     # loop forever retrieving the current zha devices
     try :
-        while True :
-
-            try :
-                # this is the query to get the json list of current zigbee devices
-                ws.send(json.dumps(
-                        {'id': ident, 'type': 'zha/devices'}
-                    ))
-
-                # get the data string back from the web socket call
-                result =  ws.recv()
-
-                # record the time when the data was retrieved
-                retrieve_time = datetime.now().replace(microsecond=0)
-
-                # convert the string that came back to JSON
-                json_result = json.loads(result)
-
-                # append the current web socket result to the raw json dump file
-                if RAW_JSON_KEEP :
-                    f = open(PROGRAM_NAME + '.json', 'a')
-                    f.write(result + ',\n')
-                    f.close()
-
-            except Exception as e:
-                print("Error : Unable to execute web socket call.")
-                print(traceback.format_exc())
-                my_logger.error("Error : Unable to execute web socket call : " + traceback.format_exc())
-                # pause
-                time.sleep( QUERY_PERIOD_SECONDS * 5)
-                # reconnect to Home Assistant Web Socket interface
-                ws, ident = ws_init()
-                continue
-#               sys.exit(1)
-
-
-            # if we did not get a success result back from service call, log the face and do not process results, cause there are none
-            if json_result['success'] == False :
-                my_logger.error("Error : Did not receive a success indicator from web socket call : " + result)
-                # pause
-                time.sleep( QUERY_PERIOD_SECONDS * 5)
-            # if we did receive a indication of a successful web socket call, process the results
-            else :
-
-                if SETUP_PASS :
-                    console.print("First ZHA data retrieval pass, setting up database")
-
-
-                # remove from device database devices that do not show up in current retrieval from ZHA web socket call
-
-                for ii in device_db :
-                    device_found = False
-                    for jj in json_result["result"] :
-                        if jj["ieee"] in device_db :
-                            device_found = True
-                    if not device_found :
-                        print("removing : " + ii["ieee"])
-                        device_db.pop(ii["ieee"], "err")
-
-                # retrieve each device that was returned in current web socket call
-                for device in json_result["result"] :
-                    # print(retrieve_time, device["ieee"], device)
-                    last_seen_ts = datetime.strptime(device["last_seen"], '%Y-%m-%dT%H:%M:%S')
-                    if device["available"] :
-                        device_status = "true"
-                    else :
-                        device_status = "false"
-
-                    # add a record to our database (dictionary) of zigbee devices on the network
-
-                    if str(device["lqi"]) == "None" :
-                        device_lqi = 0
-                    else :
-                        device_lqi = int(device["lqi"])
- 
-                    if str(device["rssi"]) == "None" :
-                        device_rssi = 0
-                    else :
-                        device_rssi = int(device["rssi"])
-
-                    # if we already have a record for this device, then keep it current recording of whether is has
-                    # been found to be the neighbor of another device on network
-                    if device["ieee"] in device_db :
-                        is_neigh = device_db[device["ieee"]]["is_neighbor"]
-                    else :
-                        is_neigh = "false"
-
-                    # update or add the current info for the device retrieved from the ZHA web socket call
-                    device_db[device["ieee"]] = {"user_given_name" : device["user_given_name"], \
-                        "last_seen" : last_seen_ts, \
-                        "device_type" : device["device_type"], \
-                        "nwk" : device["nwk"], \
-                        "lqi" : device_lqi, \
-                        "rssi" : device_rssi, \
-                        "available" : device_status, \
-                        "is_neighbor" : is_neigh \
-                        }
-
-                    # this is a 'fake' record of database, so we can retrieve 'default' values from it, if the key does not exist
-                    device_db_template = {"user_given_name" : "", \
-                        "last_seen" : retrieve_time, \
-                        "device_type" : "*", \
-                        "nwk" : -1, \
-                        "lqi" : -1, \
-                        "rssi" : 0, \
-                        "available" : "unk", \
-                        "is_neighbor" : "false" \
-                        }
-
-
-                    # if the device has NO neighbors, then create a fake neighbor, these are end devices
-
-                    if len(device['neighbors']) == 0 :
-                        device['neighbors'].append({"device_type" : "*", \
-                            "rx_on_when_idle" : "unk", \
-                            "relationship" : "none", \
-                            "extended_pan_id" : "cc:cc:cc:cc:00:00:00:00", \
-                            "ieee" : "00:00:00:00:00:00:00:00", \
-                            "nwk" : "0x0000", \
-                            "permit_joining" : "unk", \
-                            "depth" : "0", \
-                            "lqi" : device_lqi \
-                            })
-
-
-                    # iterate thru each neighbor of the device returned
-                    # so basically we are going to display / find / 'pull up' / extract the network of devices by the neighbor connections
-                    for neighbor in device['neighbors'] :
-
-                        # check if the current device is found to be the neighor in another device, if not, this is an indicator
-                        # if we loop thru all devices and all the neighbors for each device and this stays 'false' then the device
-                        # is not in any other devices neighbor table, so we will display it at the end as a off line drive
-                        # this is complicated!!! and not sure I have it right, some how a 'parent' device can NOT appear in any other
-                        # 'parent' device neighbor table, however have the 'peer' in it's neighbor table 
-                        if neighbor['ieee'] in device_db :
-                            # indicates that the current device is found to be the neighbor of another device
-                            device_db[neighbor['ieee']]['is_neighbor'] = 'true'
-
-                        neighbor_db[device['ieee'] + ':' + neighbor['ieee']] = {'lqi' : neighbor['lqi'] \
-                            }
-                        # print(neighbor_db[device['ieee'] + ':' + neighbor['ieee']])
-                        # this is a 'fake' record of database, so we can retrieve 'default' values from it, if the key does not exist
-                        neighbor_db_template = {'lqi' : 0, \
-                            }
-
-
-                        # don't display or record in db anything for the first web socket, we is this pass just to populate in memory database
-                        if not SETUP_PASS :
-                            # we can look at all neighbors of this device, or only the end devices
-                            if True :
-                            # if neighbor["relationship"] == "Child" :
-         
-                                console.print(f"{retrieve_time:%H:%M:%S} ", style = 'white', end="")
-                                console.print(f"{neighbor['device_type']:1.1} ", style = 'bold white', end="") 
-
-                                # devices available seems to be set at some point by ZHA to false if the device is no visable on network
-                                neighbor_available = device_db.get(neighbor['ieee'], device_db_template)['available']
-                                if neighbor_available == "false" :
-                                    av_text = "F"
-                                    style = 'bold red on black'
-                                else :
-                                    av_text = "T"
-                                    style = 'bold green on black'
-                                # hack for coordinator, it thinks it is off line, which could not be, display it as online
-                                if neighbor['device_type'] == "Coordinator" :
-                                    neighbor_available = "true"
-                                    av_text = "T"
-                                    style = 'bold green on black'
-
-                                console.print(f"Online ", style = 'white', end="")
-                                console.print(f"{av_text:1}", style=style, end="")
-
-                                # calculate the time delta from this retrieve from ZHA web socket to when this devices was last seen, decimal minutes
-                                delta_last_seen = retrieve_time - device_db.get(neighbor['ieee'], device_db_template)['last_seen']
-
-                                # if this is a end device then calculate it's last seen delta from it's device record, not a neighbor record
-                                if neighbor['device_type'] == "*" :
-                                    delta_last_seen = retrieve_time - device_db.get(device['ieee'], device_db_template)['last_seen']
-
-                                delta_last_seen_style = 'bold green on black'
-                                if neighbor['device_type'] == "Router" and delta_last_seen > timedelta(minutes=1) :
-                                    delta_last_seen_style = 'bold yellow on black'
-                                if neighbor['device_type'] == "Router" and delta_last_seen > timedelta(minutes=5) :
-                                    delta_last_seen_style = 'bold red on black'
-                                if (neighbor['device_type'] == "EndDevice" or neighbor['device_type'] == "*") and delta_last_seen > timedelta(minutes=25) :
-                                    delta_last_seen_style = 'black on yellow'
-                                if (neighbor['device_type'] == "EndDevice" or neighbor['device_type'] == "*") and delta_last_seen > timedelta(minutes=35) :
-                                    delta_last_seen_style = 'black on red'
-                                console.print(f" Last seen ", style = 'white', end="")
-                                device_delta_last_seen = delta_last_seen.seconds/60.0
-                                console.print(f"{device_delta_last_seen:6.1f}", style=delta_last_seen_style, end="")
-
-                                # display the device name
-
-                                neighbor_name = str(device_db.get(neighbor['ieee'], device_db_template)['user_given_name'])
-                                neighbor_type = str(device_db.get(neighbor['ieee'], device_db_template)['device_type'])
-
-                                if neighbor_type == "Coordinator" :
-                                    console.print(f" {'Coordinator':38.38} ", style = 'white', end="")
-                                else:
-                                    console.print(f" {neighbor_name:38.38} ", style = 'white', end="")
-
-                                # 'up link' from neighbor to peer, end devices will not have this link
-
-                                # lqi_display = int(neighbor['lqi'])
-                                key = neighbor['ieee'] + ':' + device['ieee']
-                                lqi_display = int(neighbor_db.get(key, neighbor_db_template)['lqi'])
-
-                                style = 'bold green on black'
-                                if lqi_display < 170 :
-                                    style = 'bold yellow on black'
-                                if lqi_display < 85 :
-                                    style = 'bold red on black'
-
-                                # if this neighbor device is listed as 'off line' display unknown for LQI and RSSI connections to this neighbor
-                                # which if were true, then the network would be down
-                                neighbor_available = device_db.get(neighbor['ieee'], device_db_template)['available']
-
-                                if neighbor_available == "false" and device_db.get(neighbor['ieee'], device_db_template)['device_type'] != "Coordinator" :
-                                    console.print(f"{'unk':4}", style='bold red on black', end="")
-                                elif lqi_display == 0 :
-                                    console.print(f"{'na':>3}", style='bold red on black', end="")
-                                else :
-                                    console.print(f"{lqi_display:3}", style=style, end="")
-
-                                # this rssi is the one reported by the neighbor device
-                                rssi_display = int(device_db.get(neighbor['ieee'], device_db_template)['rssi'])
-                                style = 'bold green on black'
-                                if rssi_display < -70 :
-                                    style = 'bold red on black'
-                                if rssi_display < -60 :
-                                    style = 'bold yellow on black'
- 
-                                if neighbor_available == "false" and device_db.get(neighbor['ieee'], device_db_template)['device_type'] != "Coordinator" :
-                                    console.print(f"{'unk':>4.4} ", style='bold red on black', end="")
-                                else :
-                                    console.print(f" {rssi_display:4} ", style=style, end="")
-
-
-                                # peer
-                                # print(neighbor)
-                                lqi_display = int(neighbor['lqi'])
-
-                                # key = neighbor['ieee'] + ':' + device['ieee']
-                                # lqi_display = int(neighbor_db.get(key, neighbor_db_template)['lqi'])
-
-                                style = 'bold green on black'
-                                if lqi_display < 170 :
-                                    style = 'bold yellow on black'
-                                if lqi_display < 85 :
-                                    style = 'bold red on black'
-
-                                # if this 'peer' device is listed as 'off line' display unknown for LQI and RSSI connections to this neighbor
-                                # which if were true, then the network would be down
-                                peer_available = device_db.get(device['ieee'], device_db_template)['available']
-
-                                if peer_available == "false" and device_db.get(device['ieee'], device_db_template)['device_type'] != "Coordinator" :
-                                    console.print(f"{'unk':4}", style='bold red on black', end="")
-                                else :
-                                    console.print(f"{lqi_display:3}", style=style, end="")
-
-                                # this rssi is the one reported by the peer device
-                                rssi_display = int(device_db.get(device['ieee'], device_db_template)['rssi'])
-                                style = 'bold green on black'
-                                if rssi_display < -70 :
-                                    style = 'bold red on black'
-                                if rssi_display < -60 :
-                                    style = 'bold yellow on black'
- 
-                                if peer_available == "false" and device_db.get(device['ieee'], device_db_template)['device_type'] != "Coordinator" :
-                                    console.print(f"{'unk':>4.4}", style='bold red on black', end="")
-                                else :
-                                    console.print(f" {rssi_display:4}", style=style, end="")
-
-                                # display then name of the device 'peer', remember we are stepping thru each 'neighbor' of this device
-                                # to display, so these are all the devices which are 'parents', end devices do not have neighbors, so
-                                # no end devices will appear in this column.
-
-                                console.print(f" {neighbor['relationship']:14.14} of ", style = 'white', end="")
-
-                                # if this 'parent' device is listed as 'off line' color it red, the coordinator seems to always be 'off line'
-                                # which if were true, then the network would be down
-                                style = 'white'
-                                if device_db[device['ieee']]["device_type"] != "Coordinator" and peer_available == "false" :
-                                    style = 'bold red'
-
-                                # if the peer is not found to be a neighbor of any other device then flag
-                                # device_db[neighbor['ieee']]['is_neighbor']
-                                if device_db[device['ieee']]['is_neighbor'] == "false" :
-                                    style = "bold red on black"
-
-                                # so far, it does not look like the Coordinator can be given a 'user given name' so that is always 'none'
-                                # so for the coordinator, display the device type of 'Coordinator'
-                                if device_db[device['ieee']]["device_type"] == "Coordinator" :
-                                    console.print(f"{'Coordinator':38.38} ", style=style)
-                                else:
-                                    console.print(f"{str(device['user_given_name']):38.38} ", style=style)
-
-                                # insert the record for status of each device into the database table for this web socket call
-                                # note we are pulling out the devices by the neighbor each device returned this call
-                                # we write the web socket call identifier out for information, we decrement by 1 to align with json
-                                # entities starting at zero, but our first web socket call for real data starts at 1
-                                # NOTE: the last_seen time delta and timestamp, may be from prior record, not this web socket call
-                                # because if we have not processed the main entry for this device on this web socket call
-                                # these value remain from the prior web socket call, this is an aberation of walking thru
-                                # the devices by their neighbor relationship. Is there a way to correct this????
-
-                                key = neighbor['ieee'] + ':' + device['ieee']
-                                lqi_display = int(neighbor_db.get(key, neighbor_db_template)['lqi'])
-
-                                sql_cursor.execute('insert into zha values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', \
-                                    [int(json_result['id']) - 1, \
-                                    retrieve_time, \
-                                    str(neighbor['ieee']), \
-                                    lqi_display, \
-                                    device_db.get(neighbor['ieee'], device_db_template)['rssi'], \
-                                    device_delta_last_seen, \
-                                    device_db.get(neighbor['ieee'], device_db_template)['last_seen'], \
-                                    neighbor['device_type'], \
-                                    neighbor_available, \
-                                    neighbor['depth'], \
-                                    neighbor['relationship'], \
-                                    device['nwk'], \
-                                    neighbor['lqi'], \
-                                    device_db.get(device['ieee'], device_db_template)['rssi'], \
-                                    peer_available, \
-                                    str(device['ieee']) ])
-                                sql_conn.commit()
-
-                                sql_cursor.execute('insert or ignore into zha_device_name values (?, ?)', \
-                                    [str(neighbor['ieee']), \
-                                    str(device_db.get(neighbor['ieee'], device_db_template)['user_given_name']) ])
-                                sql_cursor.execute('''update zha_device_name set device_given_name = ? where device_address = ?''', \
-                                    (str(neighbor['ieee']), \
-                                    str(device_db.get(neighbor['ieee'], device_db_template)['user_given_name']) ))
-                                sql_conn.commit()
-
-
-                # display a line for all the device which are offline, the coordinator seems to put itself 'offline', so we
-                # ignore if coordinator says it is 'offline', if that were case, network would be 'offline'
-                if not SETUP_PASS :
-                    for ii in device_db :
-                        # print(device_db[ii])
-                        if device_db[ii]["available"] == "false" and device_db[ii]["device_type"] != "Coordinator" :
-                            console.print(f"{retrieve_time:%H:%M:%S} ", style = 'white', end="")
-                            console.print(f"{device_db[ii]['device_type']:1.1}", style = 'bold white', end="") 
-
-                            # devices available seems to be set at some point by ZHA to false if the device is no visable on network
-                            device_available = device_db[ii]['available']
-                            if device_available == "false" :
-                                av_text = "F"
-                                style = 'bold red on black'
-                            else :
-                                av_text = "T"
-                                style = 'bold green on black'
-                            # hack for coordinator, it thinks it is off line, which could not be, display it as online
-                            # if neighbor['device_type'] == "Coordinator" :
-                            #     device_available = "true"
-                            #     av_text = "T"
-                            #     style = 'bold green on black'
-
-                            console.print(f" Online ", style = 'white', end="")
-                            console.print(f"{av_text:1}", style=style, end="")
-
-                            # calculate the time delta from this retrieve from ZHA web socket to when this devices was last seen, decimal minutes
-                            delta_last_seen = retrieve_time - device_db[ii]['last_seen']
-                            delta_last_seen_style = 'bold green on black'
-                            if device_db[ii]['device_type'] == "Router" and delta_last_seen > timedelta(minutes=1) :
-                                delta_last_seen_style = 'bold yellow on black'
-                            if device_db[ii]['device_type'] == "Router" and delta_last_seen > timedelta(minutes=5) :
-                                delta_last_seen_style = 'bold red on black'
-                            if neighbor['device_type'] == "EndDevice" and delta_last_seen > timedelta(minutes=25) :
-                                delta_last_seen_style = 'black on yellow'
-                            if device_db[ii]['device_type'] == "EndDevice" and delta_last_seen > timedelta(minutes=35) :
-                                delta_last_seen_style = 'black on red'
-                            console.print(f" Last seen ", style = 'white', end="")
-                            device_delta_last_seen = delta_last_seen.seconds/60.0
-                            console.print(f"{device_delta_last_seen:6.1f}", style=delta_last_seen_style, end="")
-
-                            # display the peer device name
-
-                            peer_name = str(device_db[ii]['user_given_name'])
-                            peer_type = str(device_db[ii]['device_type'])
-
-                            style = "white"
-                            if device_db[device['ieee']]['is_neighbor'] == "false" :
-                                style = "red"
-
-                            if peer_type == "Coordinator" :
-                                console.print(f" {'Coordinator':38.38} ", style = style, end="")
-                            else:
-                                console.print(f" {peer_name:38.38} ", style = style, end="")
-
-                            console.print(f"{'unk  unk':>8.8}", style='bold red on black')
-
-                console.print(40*"-")
-
-
-                # reset of 1st pass thru web socket retreval flag
-                SETUP_PASS = False
-
-                # sleep until next query
-                time.sleep( QUERY_PERIOD_SECONDS )
-
-                # end if successful web socket packet received
-
-            # increment our unique web socket identifier
-            ident = ident + 1
-
-            # end loop forever
+        asyncio.run(collect())
 
     except KeyboardInterrupt :
         # proper exit
-        sql_conn.close()
-        ws.close()
-
-        # finalize dump file of raw received json by putting a proper end of json structure in place
-        if RAW_JSON_KEEP :
-            f = open(PROGRAM_NAME + '.json', 'a')
-            f.write(']\n')
-            f.close()
-
+        store.close()
         my_logger.info("Program end : " + PROGRAM_NAME + " Version : " + VERSION_MAJOR + "." + VERSION_MINOR)
         sys.exit(0)
 